@@ -0,0 +1,509 @@
+import mmap
+import os
+import re
+import struct
+import time
+
+# ヘッダー読み取り時のブロックサイズ（範囲取得1回あたりの大きさ）
+DEFAULT_BLOCK_SIZE = 64 * 1024
+# MP3の先頭フレームを探す範囲（mutagenと同じ1 MiB）
+MP3_SYNC_SEARCH_LIMIT = 1024 * 1024
+# VBRヘッダーがないMP3で、先頭フレームとみなすのに必要な連続したフレーム数（厳密な判定の場合、mutagenと同じ4）
+MP3_STRICT_FRAMES = 4
+MP3_STRICT_WINDOW = 4 * 1024
+# ダウンロード中の解析で保持するデータの上限（これを超えたら諦めて、保存後に解析する）
+STREAM_BUFFER_LIMIT = 16 * 1024 * 1024
+
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_BITRATES[(2, 3)] = _MP3_BITRATES[(2, 2)]
+for _layer in (1, 2, 3):
+    _MP3_BITRATES[(2.5, _layer)] = _MP3_BITRATES[(2, _layer)]
+
+_MP3_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+_LAME_VERSION_RE = re.compile(rb'^L(?:AME)?(\d)\.(\d+)')
+
+
+class ProbeError(Exception):
+    """ヘッダーから再生時間を求められない場合の例外（呼び出し側で通常の解析にフォールバックする）"""
+
+
+class _NeedMore(Exception):
+    """ダウンロード中の解析で、まだ受信していない部分を読もうとした"""
+
+
+class BlockReader:
+    """read_at(offset, size)をブロック単位でキャッシュする
+
+    リモートファイルの範囲取得のように1回の読み取りが高価な場合に、
+    近接する小さな読み取りを1回の取得にまとめる。
+    """
+
+    def __init__(self, fetch, file_size, block_size=DEFAULT_BLOCK_SIZE, head=b''):
+        self.fetch = fetch
+        self.file_size = file_size
+        self.block_size = block_size
+        self._blocks = {}
+        # 取得済みの先頭部分があればキャッシュに入れておく
+        for index in range(len(head) // block_size):
+            self._blocks[index] = head[index * block_size:(index + 1) * block_size]
+        if head and len(head) >= file_size:
+            self._blocks[len(head) // block_size] = head[(len(head) // block_size) * block_size:]
+
+    def read_at(self, offset, size):
+        end = min(offset + size, self.file_size)
+        if offset >= end:
+            return b''
+
+        first = offset // self.block_size
+        last = (end - 1) // self.block_size
+        missing = [i for i in range(first, last + 1) if i not in self._blocks]
+        if missing:
+            # 連続する未取得ブロックはまとめて取得する
+            start = missing[0] * self.block_size
+            stop = min((missing[-1] + 1) * self.block_size, self.file_size)
+            data = self.fetch(start, stop - start)
+            for i in range(missing[0], missing[-1] + 1):
+                pos = i * self.block_size - start
+                self._blocks[i] = data[pos:pos + self.block_size]
+
+        data = b''.join(self._blocks[i] for i in range(first, last + 1))
+        skip = offset - first * self.block_size
+        return data[skip:skip + (end - offset)]
+
+
+def sniff_kind(head, file_name=None):
+    """先頭バイトとファイル名から形式（'m4a'または'mp3'）を判定する"""
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    if head[:3] == b'ID3' or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    if file_name:
+        ext = file_name.rsplit('.', 1)[-1].lower()
+        if ext in ('m4a', 'mp3'):
+            return ext
+    return None
+
+
+def probe_duration(read_at, file_size, kind, strict=False):
+    """ヘッダー部分だけを読んで再生時間（秒）を返す
+
+    Args:
+        read_at: read_at(offset, size)でバイト列を返す関数
+        file_size: ファイル全体のサイズ
+        kind: 'm4a'または'mp3'
+        strict: Trueの場合、mutagenと結果が変わりうるファイルは推定せずにProbeErrorを送出する
+    """
+    if kind == 'm4a':
+        return m4a_duration(read_at, file_size, strict)
+    if kind == 'mp3':
+        return mp3_duration(read_at, file_size, strict)
+    raise ProbeError(f"未対応の形式です: {kind}")
+
+
+def file_duration(file_path, kind):
+    """ローカルファイルをメモリマップし、ヘッダー部分だけを読んで再生時間（秒）を返す
+
+    mutagenのようにすべてのタグやアトムを解析しないので速い（ファイル全体を読み込むこともない）。
+    mutagenと同じ結果になると判断できない場合はProbeErrorを送出する（呼び出し側でmutagenにフォールバックする）。
+    """
+    with open(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size == 0:
+            raise ProbeError("空のファイルです")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # 読むのはヘッダー部分だけなので、ページフォールト時の先読みを抑える
+            if hasattr(mmap, 'MADV_RANDOM'):
+                mapped.madvise(mmap.MADV_RANDOM)
+            try:
+                return probe_duration(
+                    lambda offset, size: mapped[offset:offset + size], file_size, kind, strict=True
+                )
+            except struct.error as e:
+                raise ProbeError(f"ヘッダーが途中で終わっています: {str(e)}")
+
+
+def _iter_atoms(read_at, start, end):
+    """start〜endの範囲にあるMP4アトムを(種類, 本体の開始位置, 終了位置)で列挙する"""
+    pos = start
+    while pos + 8 <= end:
+        header = read_at(pos, 16)
+        if len(header) < 8:
+            raise ProbeError("アトムヘッダーが途中で終わっています")
+        size, kind = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise ProbeError("アトムヘッダーが途中で終わっています")
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            raise ProbeError(f"不正なアトムサイズです: {kind!r}")
+        yield kind, pos + header_size, min(pos + size, end)
+        pos += size
+
+
+def _find_atom(read_at, start, end, kind):
+    for atom_kind, body_start, atom_end in _iter_atoms(read_at, start, end):
+        if atom_kind == kind:
+            return body_start, atom_end
+    return None
+
+
+def _find_path(read_at, start, end, path):
+    for kind in path:
+        found = _find_atom(read_at, start, end, kind)
+        if found is None:
+            return None
+        start, end = found
+    return start, end
+
+
+def m4a_duration(read_at, file_size, strict=False):
+    """M4Aのmoov内のmdhd（音声トラック）またはmvhdから再生時間を求める
+
+    mutagen.mp4.MP4Infoと同じく、音声トラックのmdhdを優先する。
+    moovがファイルの先頭・末尾のどちらにあっても、アトムヘッダーを辿って必要な部分だけを読む。
+    strictがTrueの場合、音声トラックがない・timescaleが0のファイルはProbeErrorとする。
+    """
+    moov = _find_atom(read_at, 0, file_size, b'moov')
+    if moov is None:
+        raise ProbeError("moovアトムが見つかりません")
+
+    for kind, trak_start, trak_end in _iter_atoms(read_at, *moov):
+        if kind != b'trak':
+            continue
+        hdlr = _find_path(read_at, trak_start, trak_end, (b'mdia', b'hdlr'))
+        if hdlr is None:
+            continue
+        if read_at(hdlr[0] + 8, 4) != b'soun':
+            continue
+
+        mdhd = _find_path(read_at, trak_start, trak_end, (b'mdia', b'mdhd'))
+        if mdhd is None:
+            raise ProbeError("mdhdアトムが見つかりません")
+        data = read_at(mdhd[0], 32)
+        if data[:1] == b'\x00':
+            timescale, duration = struct.unpack('>2I', data[12:20])
+        elif data[:1] == b'\x01':
+            timescale, duration = struct.unpack('>IQ', data[20:32])
+        else:
+            raise ProbeError("未対応のmdhdバージョンです")
+        if strict and not timescale:
+            raise ProbeError("timescaleが0です")
+        return float(duration) / timescale if timescale else 0.0
+
+    if strict:
+        raise ProbeError("音声トラックが見つかりません")
+
+    # 音声トラックが見つからない場合はmvhdの全体の長さを使う
+    mvhd = _find_atom(read_at, moov[0], moov[1], b'mvhd')
+    if mvhd is None:
+        raise ProbeError("mvhdアトムが見つかりません")
+    data = read_at(mvhd[0], 32)
+    if data[:1] == b'\x00':
+        timescale, duration = struct.unpack('>lL', data[12:20])
+    elif data[:1] == b'\x01':
+        timescale, duration = struct.unpack('>lQ', data[20:32])
+    else:
+        raise ProbeError("未対応のmvhdバージョンです")
+    if timescale <= 0:
+        raise ProbeError("timescaleが不正です")
+    return float(duration) / timescale
+
+
+def _skip_id3(read_at):
+    """先頭のID3v2タグ（複数の場合もある）を飛ばした位置を返す"""
+    pos = 0
+    while True:
+        header = read_at(pos, 10)
+        if len(header) < 10 or header[:3] != b'ID3':
+            return pos
+        size = 0
+        for b in header[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        if size == 0:
+            return pos
+        pos += 10 + size
+        if header[5] & 0x10:  # フッターあり
+            pos += 10
+
+
+def _parse_mp3_header(header):
+    """MPEGフレームヘッダーを解析する（不正な場合はNone）"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x3
+    layer_bits = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    padding = (header[2] >> 1) & 0x1
+    mode = header[3] >> 6
+    if version_bits == 1 or layer_bits == 0 or rate_index == 3 or bitrate_index in (0, 15):
+        return None
+
+    version = [2.5, None, 2, 1][version_bits]
+    layer = 4 - layer_bits
+    bitrate = _MP3_BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+
+    if layer == 1:
+        frame_size, slot = 384, 4
+    elif version >= 2 and layer == 3:
+        frame_size, slot = 576, 1
+    else:
+        frame_size, slot = 1152, 1
+    frame_length = ((frame_size // 8 * bitrate) // sample_rate + padding) * slot
+
+    return {
+        'version': version,
+        'layer': layer,
+        'mode': mode,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'frame_size': frame_size,
+        'frame_length': frame_length,
+    }
+
+
+def _xing_duration(read_at, frame_offset, frame):
+    """Xing/InfoヘッダーまたはVBRIヘッダーから再生時間を求める（ヘッダーがなければNone、長さ不明なら-1）"""
+    if frame['layer'] != 3:
+        return None
+
+    if frame['version'] == 1:
+        xing_offset = 36 if frame['mode'] != 3 else 21
+    else:
+        xing_offset = 21 if frame['mode'] != 3 else 13
+
+    data = read_at(frame_offset + xing_offset, 8 + 4 + 4 + 100 + 4 + 20 + 24)
+    if data[:4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[4:8])[0]
+        pos = 8
+        frames = -1
+        if flags & 0x1:
+            frames = struct.unpack('>I', data[pos:pos + 4])[0]
+            pos += 4
+        if flags & 0x2:
+            pos += 4
+        if flags & 0x4:
+            pos += 100
+        if flags & 0x8:
+            pos += 4
+        if frames == -1:
+            return -1
+
+        samples = frame['frame_size'] * frames
+        lame = data[pos:pos + 24]
+        version = _LAME_VERSION_RE.match(lame[:20])
+        if version:
+            major, minor = int(version.group(1)), int(version.group(2))
+            if (major, minor) > (3, 90) or ((major, minor) == (3, 90) and lame[9:10] != b'('):
+                # LAMEヘッダーのエンコーダー遅延とパディングを除く（mutagenと同じ）
+                delay_padding = lame[21:24]
+                if len(delay_padding) == 3:
+                    value = int.from_bytes(delay_padding, 'big')
+                    samples -= (value >> 12) + (value & 0xFFF)
+        return float(max(samples, 0)) / frame['sample_rate']
+
+    data = read_at(frame_offset + 36, 18)
+    if data[:4] == b'VBRI' and len(data) >= 18:
+        frames = struct.unpack('>I', data[14:18])[0]
+        return float(frame['frame_size'] * frames) / frame['sample_rate']
+
+    return None
+
+
+def mp3_duration(read_at, file_size, strict=False):
+    """MP3の先頭フレームとXing/VBRIヘッダーから再生時間を求める
+
+    VBRヘッダーがない場合は、mutagenと同じくビットレートとファイルサイズから推定する。
+    strictがTrueの場合は、ID3タグの直後が正しいフレームで始まり、VBRヘッダーがあるか
+    MP3_STRICT_FRAMES個のフレームが連続しているときだけ結果を返し、それ以外はProbeErrorとする。
+    """
+    start = _skip_id3(read_at)
+    limit = min(file_size, start + MP3_SYNC_SEARCH_LIMIT)
+
+    # 厳密な判定では最初の同期候補だけを見るので、小さい単位で読む（ローカルファイルで余計なページを読まないため）
+    window_size = MP3_STRICT_WINDOW if strict else DEFAULT_BLOCK_SIZE
+    pos = start
+    while pos < limit:
+        window = read_at(pos, window_size)
+        if not window:
+            break
+        index = window.find(b'\xff')
+        while index != -1:
+            frame_offset = pos + index
+            frame = _parse_mp3_header(read_at(frame_offset, 4))
+            if frame is None and strict:
+                raise ProbeError("ID3タグの直後がMPEGフレームではありません")
+            if frame is not None:
+                duration = _xing_duration(read_at, frame_offset, frame)
+                if duration is not None and duration >= 0:
+                    return duration
+
+                if strict:
+                    if duration is None and _frames_follow(read_at, frame_offset, frame, file_size):
+                        return 8 * (file_size - frame_offset) / float(frame['bitrate'])
+                    raise ProbeError("先頭フレームを確実に判定できません")
+
+                # VBRヘッダーがない場合は次のフレームも正しく続くことを確認する
+                next_frame = _parse_mp3_header(read_at(frame_offset + frame['frame_length'], 4))
+                if next_frame is not None or frame_offset + frame['frame_length'] >= file_size:
+                    return 8 * (file_size - frame_offset) / float(frame['bitrate'])
+            index = window.find(b'\xff', index + 1)
+        pos += len(window)
+
+    raise ProbeError("MPEGフレームが見つかりません")
+
+
+def _frames_follow(read_at, frame_offset, frame, file_size):
+    """先頭フレームからMP3_STRICT_FRAMES個のフレームが連続しているか（ファイルの終わりに達した場合も含む）"""
+    pos = frame_offset
+    for _ in range(MP3_STRICT_FRAMES - 1):
+        pos += frame['frame_length']
+        if pos >= file_size:
+            return True
+        frame = _parse_mp3_header(read_at(pos, 4))
+        if frame is None:
+            return False
+    return True
+
+
+class StreamingProbe:
+    """ダウンロード中に受信したバイト列から再生時間を求める（GDriveDownloaderのteeに渡す）
+
+    ヘッダーの解析に必要な部分だけを保持し（MP3は先頭部分、M4Aは最上位のアトムヘッダーとmoov。mdatの本体は保持しない）、
+    受信するたびにfile_durationと同じ厳密な判定で解析を試みる。求められたらdurationに秒数が入り、
+    それ以降は何も保持しない。求められなかった場合（形式が違う、判定が確実でないなど）はdurationはNoneのまま。
+    """
+
+    def __init__(self, buffer_limit=STREAM_BUFFER_LIMIT):
+        self.buffer_limit = buffer_limit
+        self.duration = None
+        self.seconds = 0.0  # 解析にかかった時間の合計
+        self.start(None, None)
+
+    def start(self, file_name, total_size):
+        """受信を最初から始める（再開・再試行のたびに呼ばれる）"""
+        kind = None
+        if file_name and total_size:
+            ext = file_name.rsplit('.', 1)[-1].lower()
+            kind = ext if ext in ('m4a', 'mp3') else None
+        self.kind = kind
+        self.file_size = total_size
+        self.duration = None
+        self._done = kind is None
+        self._received = 0
+        self._segments = []  # (開始位置, bytearray)の連続した保持部分
+        self._buffered = 0
+        self._next_atom = 0  # 次の最上位アトムの位置（M4A）
+        self._skip_start = self._skip_end = 0  # 保持しない範囲（M4Aのmdatの本体）
+
+    def write(self, chunk):
+        """受信したデータを渡す"""
+        offset = self._received
+        self._received += len(chunk)
+        if self._done:
+            return
+
+        started = time.perf_counter()
+        start, data = offset, memoryview(chunk)
+        if self._skip_end > start:
+            cut = min(len(data), self._skip_end - start)
+            start, data = start + cut, data[cut:]
+        if len(data):
+            self._append(start, data)
+        try:
+            if self.kind == 'm4a':
+                self._scan_atoms()
+            if self._buffered > self.buffer_limit:
+                raise ProbeError("ヘッダーが大きすぎます")
+            self.duration = probe_duration(self._read_at, self.file_size, self.kind, strict=True)
+            self._finish()
+        except _NeedMore:
+            pass
+        except (ProbeError, struct.error):
+            self._finish()
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def _finish(self):
+        self._done = True
+        self._segments = []
+        self._buffered = 0
+
+    def _append(self, start, data):
+        if self._segments:
+            last_start, last = self._segments[-1]
+            if last_start + len(last) == start:
+                last += data
+                self._buffered += len(data)
+                return
+        self._segments.append((start, bytearray(data)))
+        self._buffered += len(data)
+
+    def _drop(self, start, end):
+        """保持しているデータからstart〜endの範囲を取り除く"""
+        segments = []
+        for seg_start, data in self._segments:
+            seg_end = seg_start + len(data)
+            if seg_end <= start or seg_start >= end:
+                segments.append((seg_start, data))
+                continue
+            if seg_start < start:
+                segments.append((seg_start, data[:start - seg_start]))
+            if seg_end > end:
+                segments.append((end, data[end - seg_start:]))
+        self._segments = segments
+        self._buffered = sum(len(data) for _, data in segments)
+
+    def _scan_atoms(self):
+        """受信済みの最上位アトムヘッダーを辿り、mdatの本体を保持しない範囲にする"""
+        while self._next_atom + 8 <= self.file_size:
+            pos = self._next_atom
+            try:
+                header = self._read_at(pos, min(16, self.file_size - pos))
+            except _NeedMore:
+                return
+            size, kind = struct.unpack('>I4s', header[:8])
+            header_size = 8
+            if size == 1:
+                if len(header) < 16:
+                    raise ProbeError("アトムヘッダーが途中で終わっています")
+                size = struct.unpack('>Q', header[8:16])[0]
+                header_size = 16
+            elif size == 0:
+                size = self.file_size - pos
+            if size < header_size:
+                raise ProbeError(f"不正なアトムサイズです: {kind!r}")
+            if kind == b'mdat':
+                # アトムの列挙では先頭16バイトを読むので、そこまでは保持する
+                self._skip_start, self._skip_end = min(pos + 16, pos + size), pos + size
+                self._drop(self._skip_start, self._skip_end)
+            self._next_atom = pos + size
+
+    def _read_at(self, offset, size):
+        end = min(offset + size, self.file_size)
+        if offset >= end:
+            return b''
+        for seg_start, data in self._segments:
+            if seg_start <= offset and end <= seg_start + len(data):
+                return bytes(data[offset - seg_start:end - seg_start])
+        if self._skip_start <= offset and end <= self._skip_end:
+            raise ProbeError("mdatの中を読もうとしました")
+        if end > self._received:
+            raise _NeedMore()
+        raise ProbeError("保持していない部分を読もうとしました")
@@ -0,0 +1,124 @@
+"""再生時間の解析のベンチマーク（mutagenとメモリマップによる高速経路の比較）
+
+同じファイルについて、mutagen（MP3/MP4のinfo.length）とaudio_probe.file_durationの所要時間を計測し、
+結果が一致することを確認する。高速経路で判定できずmutagenにフォールバックするファイルの数も表示する。
+
+使い方:
+    python benchmarks/bench_duration.py --files 1000
+    python benchmarks/bench_duration.py --dir downloads   # 既存のダウンロードフォルダで計測する
+
+結果が一致しないファイルがあった場合は終了コード1を返す。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from fixtures import make_m4a, make_mp3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from audio_probe import file_duration  # noqa: E402
+
+# 結果が一致するとみなす差（秒）
+TOLERANCE = 1e-6
+
+
+def mutagen_duration(file_path):
+    if file_path.lower().endswith('.mp3'):
+        from mutagen.mp3 import MP3
+        return MP3(file_path).info.length
+    from mutagen.mp4 import MP4
+    return MP4(file_path).info.length
+
+
+def write_fixtures(work_dir, count):
+    """MP3（Xingヘッダーあり・なし）とM4Aを交互に書き出し、パスのリストを返す"""
+    paths = []
+    for index in range(count):
+        seconds = 30 + index % 570
+        if index % 3 == 0:
+            name, data = f"{index}.mp3", make_mp3(seconds)
+        elif index % 3 == 1:
+            name, data = f"{index}.mp3", make_mp3(seconds, xing=False)
+        else:
+            name, data = f"{index}.m4a", make_m4a(seconds, payload_size=16 * 1024)
+        path = os.path.join(work_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def list_audio_files(directory):
+    paths = []
+    for dir_path, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1].lower() in ('.mp3', '.m4a'):
+                paths.append(os.path.join(dir_path, file_name))
+    return sorted(paths)
+
+
+def _time_all(func, paths):
+    """すべてのファイルをfuncで解析し、(所要時間, {パス: 再生時間またはNone})を返す"""
+    results = {}
+    started = time.perf_counter()
+    for path in paths:
+        try:
+            results[path] = func(path)
+        except Exception:
+            results[path] = None
+    return time.perf_counter() - started, results
+
+
+def fast_duration(path):
+    return file_duration(path, os.path.splitext(path)[1][1:].lower())
+
+
+def run(paths, rounds):
+    """両方の方法を交互にrounds回ずつ実行し、それぞれ最も速かった時間を使う（ページキャッシュの状態の偏りを避ける）"""
+    mutagen_duration(paths[0])  # mutagenのインポート時間を含めない
+    mutagen_times, fast_times = [], []
+    for _ in range(rounds):
+        seconds, expected = _time_all(mutagen_duration, paths)
+        mutagen_times.append(seconds)
+        seconds, fast = _time_all(fast_duration, paths)
+        fast_times.append(seconds)
+
+    fallbacks = [path for path in paths if fast[path] is None]
+    mismatches = [
+        path for path in paths
+        if fast[path] is not None and (expected[path] is None or abs(fast[path] - expected[path]) > TOLERANCE)
+    ]
+    return min(mutagen_times), min(fast_times), fallbacks, mismatches, expected, fast
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="再生時間の解析のベンチマーク")
+    parser.add_argument('--files', type=int, default=1000, help="生成するファイル数")
+    parser.add_argument('--rounds', type=int, default=3, help="計測の回数（最も速かった回を使う）")
+    parser.add_argument('--dir', help="計測に使う既存のフォルダ（指定した場合はファイルを生成しない）")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='m4a_report_duration_') as work_dir:
+        paths = list_audio_files(args.dir) if args.dir else write_fixtures(work_dir, args.files)
+        if not paths:
+            print("MP3/M4Aファイルが見つかりませんでした")
+            return 1
+        mutagen_seconds, fast_seconds, fallbacks, mismatches, expected, fast = run(paths, max(1, args.rounds))
+
+    count = len(paths)
+    print(f"ファイル数: {count}")
+    print(f"mutagen:    {mutagen_seconds:.3f}s ({count / mutagen_seconds:.0f} files/s)")
+    print(f"高速経路:   {fast_seconds:.3f}s ({count / fast_seconds:.0f} files/s, "
+          f"{mutagen_seconds / fast_seconds:.1f} 倍)")
+    print(f"mutagenにフォールバック: {len(fallbacks)} 件")
+    for path in mismatches[:10]:
+        print(f"結果が一致しません: {path} (mutagen: {expected[path]}, 高速経路: {fast[path]})")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""エンドツーエンドのパイプラインのベンチマーク（ネットワーク不要）
+
+ローカルのGoogleドライブ代替サーバー（drive_server.py）と、生成したExcelファイル・音声ファイル（fixtures.py）を使い、
+リンクの収集からダウンロード・分析・Excelへの保存までをReportEngineで実行して計測する。
+
+使い方:
+    python benchmarks/bench_pipeline.py --files 200 --sheets 2 --rows 300 --latency 0.05 --throttle 2000000
+    python benchmarks/bench_pipeline.py --save baseline.json
+    python benchmarks/bench_pipeline.py --baseline baseline.json  # files/sが基準より悪化したら終了コード1
+
+計測はサーバーとは別のプロセスで行うので、ピークRSSにはテストデータ生成やサーバーの分は含まれない。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+# 基準値と比べて、この割合以上files/sが下がったら性能低下とみなす
+DEFAULT_TOLERANCE = 0.1
+
+
+class StageTimer:
+    """オブジェクトのメソッドを包んで、段階ごとの所要時間（合計）と呼び出し回数を記録する
+
+    ダウンロードのように複数スレッドから呼ばれる段階は、各スレッドの時間の合計になる。
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, obj, method_name, stage):
+        method = getattr(obj, method_name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed
+                    self.calls[stage] = self.calls.get(stage, 0) + 1
+
+        setattr(obj, method_name, timed)
+
+
+def _peak_rss_mb():
+    """このプロセスと子プロセス（分析用のプロセスプール）のピークRSS（MB）"""
+    try:
+        import resource
+    except ImportError:
+        # Windowsではresourceモジュールがないため計測しない
+        return None, None
+    # LinuxはKB単位、macOSはバイト単位
+    unit = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1024 ** 2
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1024 ** 2
+    return round(own, 1), round(children, 1)
+
+
+def run_child(config):
+    """（計測用プロセス）ReportEngineを実行して計測結果を返す"""
+    sys.path.insert(0, ROOT)
+    from downloader import GDriveDownloader
+    from excel_processor import ExcelProcessor
+    from report_engine import ReportEngine
+
+    timer = StageTimer()
+    excel_processor = ExcelProcessor(config['workbook'])
+    for method_name, stage in (
+        ('scan_links', 'scan'),
+        ('load_excel', 'load_excel'),
+        ('update_cell_with_hyperlink', 'cell_update'),
+        ('save_results', 'save_results'),
+        ('save_excel', 'save_excel'),
+    ):
+        timer.wrap(excel_processor, method_name, stage)
+
+    downloader = GDriveDownloader(base_url=config['base_url'])
+    timer.wrap(downloader, 'download_with_hash', 'download')
+    timer.wrap(downloader, 'open_remote', 'download')
+
+    engine = ReportEngine(
+        config['workbook'], config['download_dir'], config['sheets'], True, config['workers'],
+        metadata_only=config['metadata_only'], excel_processor=excel_processor, open_excel=False,
+        downloader=downloader, schedule=config['schedule'], save_mode=config['save_mode']
+    )
+    started = time.perf_counter()
+    success, message = engine.run()
+    wall = time.perf_counter() - started
+
+    own_rss, children_rss = _peak_rss_mb()
+    return {
+        'success': success,
+        'message': message,
+        'wall_seconds': wall,
+        'rows': len(engine.processed),
+        'failed_rows': sum(1 for row in engine.processed if row['error'] is not None),
+        'stage_seconds': timer.seconds,
+        'stage_calls': timer.calls,
+        'peak_rss_mb': own_rss,
+        'peak_rss_children_mb': children_rss,
+        # エンジン自身が記録した計測値（TTFB、分析時間、待ち時間など）
+        'engine_metrics': engine.metrics.summary(),
+    }
+
+
+def run_benchmark(args):
+    sys.path.insert(0, BENCH_DIR)
+    from drive_server import DriveStandIn
+    from fixtures import make_audio_files, make_workbook
+
+    with tempfile.TemporaryDirectory(prefix='m4a_report_bench_') as work_dir:
+        files = make_audio_files(args.files, m4a_payload=args.m4a_payload_kb * 1024)
+        workbook = os.path.join(work_dir, 'bench.xlsx')
+        links = make_workbook(
+            workbook, list(files), sheets=args.sheets, rows=args.rows, link_density=args.link_density
+        )
+        sheets = [f"Sheet{index + 1}" for index in range(args.sheets)]
+
+        with DriveStandIn(files, latency=args.latency, throttle=args.throttle, confirm=args.confirm,
+                      error_rate=args.error_rate) as server:
+            config = {
+                'workbook': workbook,
+                'download_dir': os.path.join(work_dir, 'downloads'),
+                'sheets': sheets,
+                'workers': args.workers,
+                'metadata_only': args.metadata_only,
+                'schedule': args.schedule,
+                'save_mode': args.save_mode,
+                'base_url': server.base_url,
+            }
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', json.dumps(config)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            bytes_sent = server.bytes_sent
+            requests = server.requests
+
+    unique_files = min(links, len(files))
+    wall = result['wall_seconds']
+    result.update({
+        'links': links,
+        'unique_files': unique_files,
+        'http_requests': requests,
+        'bytes_transferred': bytes_sent,
+        'files_per_second': unique_files / wall if wall else None,
+        'mb_per_second': bytes_sent / 1024 ** 2 / wall if wall else None,
+        'settings': {
+            'files': args.files, 'sheets': args.sheets, 'rows': args.rows, 'link_density': args.link_density,
+            'latency': args.latency, 'throttle': args.throttle, 'confirm': args.confirm, 'error_rate': args.error_rate,
+            'workers': args.workers, 'metadata_only': args.metadata_only, 'schedule': args.schedule,
+            'save_mode': args.save_mode,
+        },
+    })
+    return result
+
+
+def print_report(result):
+    print(f"結果: {'成功' if result['success'] else '失敗'} ({result['message']})")
+    print(f"リンク数: {result['links']} / ファイル数: {result['unique_files']} / 失敗行: {result['failed_rows']}")
+    print(f"所要時間: {result['wall_seconds']:.2f}s")
+    print(f"スループット: {result['files_per_second']:.1f} files/s, {result['mb_per_second']:.2f} MB/s "
+          f"({result['bytes_transferred'] / 1024 ** 2:.1f} MB, {result['http_requests']} リクエスト)")
+    print(f"再試行: {result['engine_metrics']['retries']} 回")
+    if result['peak_rss_mb'] is not None:
+        print(f"ピークRSS: {result['peak_rss_mb']:.1f} MB (分析用プロセス: {result['peak_rss_children_mb']:.1f} MB)")
+    print("段階ごとの時間（ダウンロードは全スレッドの合計）:")
+    for stage, seconds in result['stage_seconds'].items():
+        print(f"  {stage:<14} {seconds:8.3f}s  ({result['stage_calls'][stage]} 回)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="パイプライン全体のベンチマーク")
+    parser.add_argument('--files', type=int, default=200, help="ダウンロード対象のファイル数")
+    parser.add_argument('--sheets', type=int, default=2, help="シート数")
+    parser.add_argument('--rows', type=int, default=200, help="シートごとの行数")
+    parser.add_argument('--link-density', type=float, default=0.8, help="リンクを入れる行の割合")
+    parser.add_argument('--m4a-payload-kb', type=int, default=256, help="M4Aファイルの音声データ部分の大きさ（KB）")
+    parser.add_argument('--latency', type=float, default=0.02, help="リクエストごとの遅延（秒）")
+    parser.add_argument('--throttle', type=int, default=0, help="接続ごとの転送速度の上限（バイト/秒、0は無制限）")
+    parser.add_argument('--confirm', default='cookie', choices=('cookie', 'form', 'none'), help="確認ページの形式")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="サーバーが429を返すリクエストの割合")
+    parser.add_argument('--workers', type=int, default=8, help="最大同時ダウンロード数")
+    parser.add_argument('--schedule', default='sheet', choices=('sheet', 'largest', 'smallest'),
+                        help="ダウンロード順の方針")
+    parser.add_argument('--save-mode', default='workbook', choices=('workbook', 'patch'),
+                        help="Excelの保存方法")
+    parser.add_argument('--metadata-only', action='store_true', help="再生時間のみ取得するモードで計測する")
+    parser.add_argument('--save', help="結果をJSONで保存するパス（基準値として使える）")
+    parser.add_argument('--baseline', help="比較する基準値のJSON")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="許容する性能低下の割合")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(json.loads(args.child))))
+        return 0
+
+    result = run_benchmark(args)
+    print_report(result)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if not result['success'] or result['failed_rows']:
+        return 1
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        limit = baseline['files_per_second'] * (1 - args.tolerance)
+        print(f"基準値: {baseline['files_per_second']:.1f} files/s（下限 {limit:.1f} files/s）")
+        if result['files_per_second'] < limit:
+            print("性能が基準値より低下しています")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
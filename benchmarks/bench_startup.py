@@ -0,0 +1,113 @@
+"""起動時間のベンチマーク
+
+次の2つを、Pythonの起動を含めた別プロセスで計測し、目標時間（予算）と比較する。
+- time-to-window: アプリを起動してからメインウィンドウが表示され、イベントループが動き始めるまで
+- time-to-first-byte: CLIのモジュールを読み込み、ダウンロードの最初の1バイトを受信するまで（ローカルのHTTPサーバーを使用）
+
+使い方:
+    python benchmarks/bench_startup.py [--repeat 5]
+
+いずれかが予算を超えた場合、またはウィンドウ表示時点で重いライブラリが読み込まれている場合は終了コード1を返す。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from drive_server import DriveStandIn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 目標時間（秒）
+TIME_TO_WINDOW_BUDGET = 1.0
+TIME_TO_FIRST_BYTE_BUDGET = 1.0
+
+# ウィンドウ表示までに読み込まれてはいけないライブラリ（処理を実行するときに読み込む）
+HEAVY_MODULES = ('openpyxl', 'polars', 'mutagen', 'requests')
+
+WINDOW_SCRIPT = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+from ui import MainWindow
+
+def report():
+    print(json.dumps({{
+        'elapsed': time.time() - float(os.environ['BENCH_T0']),
+        'heavy': [name for name in {heavy!r} if name in sys.modules],
+    }}))
+    app.quit()
+
+app = QApplication(sys.argv)
+window = MainWindow()
+window.show()
+QTimer.singleShot(0, report)
+app.exec_()
+"""
+
+FIRST_BYTE_SCRIPT = """
+import json, os, sys, tempfile, time
+sys.path.insert(0, {root!r})
+import cli
+from downloader import GDriveDownloader
+from file_processor import FileProcessor
+
+processor = FileProcessor(tempfile.mkdtemp(), downloader=GDriveDownloader(base_url={url!r}))
+response = processor.downloader.open('bench', headers={{'Range': 'bytes=0-0'}})
+response.raw.read(1)
+print(json.dumps({{'elapsed': time.time() - float(os.environ['BENCH_T0'])}}))
+"""
+
+
+def _run_child(script):
+    """スクリプトを別プロセスで実行し、出力されたJSONを返す（経過時間はプロセス起動前から計測）"""
+    env = dict(os.environ)
+    # ディスプレイのないLinuxでもウィンドウを作成できるようにする
+    if sys.platform.startswith('linux') and not env.get('DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    env['BENCH_T0'] = repr(time.time())
+    output = subprocess.run(
+        [sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(script, repeat):
+    results = [_run_child(script) for _ in range(repeat)]
+    return statistics.median(result['elapsed'] for result in results), results[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="起動時間のベンチマーク")
+    parser.add_argument('--repeat', type=int, default=5, help="計測回数（中央値を使う）")
+    args = parser.parse_args(argv)
+
+    ok = True
+    # 1バイトのファイルを返すだけのダウンロードURLの代わり
+    with DriveStandIn({'bench': ('bench.mp3', b'\x00')}, confirm='none') as server:
+        window_time, window_result = measure(
+            WINDOW_SCRIPT.format(root=ROOT, heavy=HEAVY_MODULES), args.repeat
+        )
+        first_byte_time, _ = measure(FIRST_BYTE_SCRIPT.format(root=ROOT, url=server.base_url), args.repeat)
+
+    for label, elapsed, budget in (
+        ('time-to-window', window_time, TIME_TO_WINDOW_BUDGET),
+        ('time-to-first-byte', first_byte_time, TIME_TO_FIRST_BYTE_BUDGET),
+    ):
+        status = 'OK' if elapsed <= budget else 'OVER BUDGET'
+        ok = ok and elapsed <= budget
+        print(f"{label}: {elapsed:.3f}s (予算 {budget:.1f}s) {status}")
+
+    if window_result['heavy']:
+        ok = False
+        print(f"ウィンドウ表示時に読み込まれているライブラリ: {', '.join(window_result['heavy'])}")
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Excelへの保存がファイルの属性と内容を保つかの確認（ネットワーク不要）
+
+テスト用のExcelファイルにセルの変更とresultsシートを保存モード（workbook・patch）ごとに保存し、次のことを確認する。
+- パーミッションと所有者が保存前と変わらない
+- ハードリンクされたファイルは同じinodeのまま更新され、リンク先からも新しい内容が見える
+- 変更したセルとresultsシートの内容が読み戻せる
+- patchでは、途中でworkbookに切り替わらず、変更していないシートのパーツがそのままコピーされる
+- xlsx_writer.copy_member で書き直したファイルの全メンバーのCRCが正しく、内容が元と一致する
+  （圧縮済みのデータのままのコピーと、展開・再圧縮してのコピーの両方。前者はこのPythonで使う場合のみ）
+
+使い方:
+    python benchmarks/check_save.py
+
+問題があった場合は終了コード1を返す。
+"""
+import os
+import stat
+import sys
+import tempfile
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import xlsx_writer  # noqa: E402
+from excel_processor import SAVE_PATCH, SAVE_WORKBOOK, ExcelProcessor  # noqa: E402
+
+# 既定（umask）と異なるパーミッションにして、保存で変わらないことを確かめる
+FILE_MODE = 0o664
+URL = "https://drive.google.com/file/d/{}/view"
+# 変更しないシート（メモ）のパーツ
+UNCHANGED_PART = "xl/worksheets/sheet2.xml"
+
+
+def make_workbook(path, rows=20):
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+    ws.append(["見出し"] * 12)
+    for index in range(rows):
+        ws.append([f"行{index}"] + [None] * 8 + [URL.format(f"id{index}"), None, None])
+    wb.create_sheet("メモ").append(["変更しないシート"])
+    wb.save(path)
+
+
+def save_once(path, save_mode):
+    """セルの変更とresultsシートを保存し、(成功したかどうか, エラーメッセージ)を返す"""
+    import polars as pl
+
+    processor = ExcelProcessor(path, save_mode=save_mode)
+    success, error_msg = processor.load_excel()
+    if not success:
+        return False, error_msg
+    for row_num in (2, 5):
+        processor.update_cell_with_hyperlink("Sheet1", row_num, f"file{row_num}.mp3", URL.format(row_num), "01:23")
+    processor.save_results(pl.DataFrame({"シート名": ["Sheet1", "Sheet1"], "行番号": [2, 5]}))
+    success, error_msg = processor.save_excel()
+    if success and processor.save_mode != save_mode:
+        return False, f"保存モードが{save_mode}から{processor.save_mode}に切り替わりました"
+    return success, error_msg
+
+
+def check_contents(path):
+    import openpyxl
+
+    problems = []
+    wb = openpyxl.load_workbook(path)
+    ws = wb["Sheet1"]
+    for row_num in (2, 5):
+        if ws.cell(row_num, 10).value != f"file{row_num}.mp3" or ws.cell(row_num, 12).value != "01:23":
+            problems.append(f"{row_num}行目の変更が保存されていません")
+    if ws.cell(3, 1).value != "行1" or wb["メモ"].cell(1, 1).value != "変更しないシート":
+        problems.append("変更していないセルの内容が変わりました")
+    rows = [[cell.value for cell in row] for row in wb["results"].iter_rows()]
+    if rows != [["シート名", "行番号"], ["Sheet1", 2], ["Sheet1", 5]]:
+        problems.append(f"resultsシートの内容が違います: {rows}")
+    return problems
+
+
+def check_zip(path):
+    """zipの全メンバーを読み、CRCが一致しないメンバーがあれば問題として返す"""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            bad = zf.testzip()
+    except zipfile.BadZipFile as e:
+        return [f"zipとして読めません: {str(e)}"]
+    return [f"CRCが一致しません: {bad}"] if bad else []
+
+
+def check_copy_member(work_dir, raw_copy):
+    """全メンバーをcopy_memberで書き直し、CRCと内容が元のファイルと一致するかを確認する
+
+    raw_copyがFalseの場合は、対応するPythonのバージョンの範囲を空にして、展開・再圧縮でのコピーを確認する。
+    """
+    source = os.path.join(work_dir, "copy_source.xlsx")
+    copied = os.path.join(work_dir, "copy.xlsx")
+    if not os.path.exists(source):
+        make_workbook(source, rows=2000)
+    with open(source, 'rb') as f_in, open(copied, 'wb') as f_out:
+        f_out.write(f_in.read())
+
+    def rewrite(src, dst):
+        for info in src.infolist():
+            xlsx_writer.copy_member(src, dst, info)
+        # コピーの後に通常の書き込みをしても、中央ディレクトリが正しいこと
+        xlsx_writer.write_member(dst, "docProps/check.xml", lambda f: f.write(b"<check/>"))
+
+    versions = xlsx_writer.RAW_COPY_PYTHON_VERSIONS
+    if not raw_copy:
+        xlsx_writer.RAW_COPY_PYTHON_VERSIONS = ((0, 0), (0, 0))
+    try:
+        xlsx_writer.rewrite_zip(copied, rewrite)
+    finally:
+        xlsx_writer.RAW_COPY_PYTHON_VERSIONS = versions
+    problems = check_zip(copied)
+    if problems:
+        return problems
+    with zipfile.ZipFile(source) as original, zipfile.ZipFile(copied) as zf:
+        if zf.namelist() != original.namelist() + ["docProps/check.xml"]:
+            problems.append("メンバーの一覧が元と違います")
+        for info in original.infolist():
+            copied_info = zf.getinfo(info.filename)
+            if zf.read(info.filename) != original.read(info.filename):
+                problems.append(f"内容が元と違います: {info.filename}")
+            elif raw_copy and copied_info.compress_size != info.compress_size:
+                problems.append(f"圧縮済みのデータのままコピーされていません: {info.filename}")
+    return problems
+
+
+def check_mode(work_dir, save_mode):
+    """1つの保存方法を確認し、問題のリストを返す"""
+    problems = []
+    path = os.path.join(work_dir, f"{save_mode}.xlsx")
+    link_path = os.path.join(work_dir, f"{save_mode}_link.xlsx")
+    make_workbook(path)
+    os.chmod(path, FILE_MODE)
+    before = os.stat(path)
+    os.link(path, link_path)
+    with zipfile.ZipFile(path) as zf:
+        unchanged_part = zf.read(UNCHANGED_PART)
+
+    success, error_msg = save_once(path, save_mode)
+    if not success:
+        return [f"保存に失敗しました: {error_msg}"]
+
+    after = os.stat(path)
+    if stat.S_IMODE(after.st_mode) != FILE_MODE:
+        problems.append(f"パーミッションが変わりました: {oct(FILE_MODE)} -> {oct(stat.S_IMODE(after.st_mode))}")
+    if (after.st_uid, after.st_gid) != (before.st_uid, before.st_gid):
+        problems.append("所有者が変わりました")
+    if after.st_ino != before.st_ino or not os.path.samefile(path, link_path):
+        problems.append("ハードリンクが切れました")
+    problems.extend(check_zip(path))
+    problems.extend(check_contents(path))
+    if save_mode == SAVE_PATCH:
+        with zipfile.ZipFile(path) as zf:
+            if zf.read(UNCHANGED_PART) != unchanged_part:
+                problems.append(f"変更していないシートのパーツが変わりました: {UNCHANGED_PART}")
+
+    # ハードリンクのないファイルでも、パーミッションが変わらないこと
+    os.remove(link_path)
+    success, error_msg = save_once(path, save_mode)
+    if not success:
+        problems.append(f"2回目の保存に失敗しました: {error_msg}")
+    elif stat.S_IMODE(os.stat(path).st_mode) != FILE_MODE:
+        problems.append(f"2回目の保存でパーミッションが変わりました: {oct(stat.S_IMODE(os.stat(path).st_mode))}")
+    return problems
+
+
+def main():
+    failed = False
+    with tempfile.TemporaryDirectory(prefix='m4a_report_save_') as work_dir:
+        for save_mode in (SAVE_WORKBOOK, SAVE_PATCH):
+            problems = check_mode(work_dir, save_mode)
+            print(f"{save_mode}: 問題 {len(problems)} 件")
+            for problem in problems:
+                print(f"  {problem}")
+            failed = failed or bool(problems)
+
+        for raw_copy in (True, False):
+            copy_kind = "圧縮済みのまま" if raw_copy else "展開・再圧縮"
+            if raw_copy and not xlsx_writer.raw_copy_supported():
+                print(f"copy_member（{copy_kind}）: Python {sys.version.split()[0]} では使わないため省略")
+                continue
+            problems = check_copy_member(work_dir, raw_copy)
+            print(f"copy_member（{copy_kind}）: 問題 {len(problems)} 件")
+            for problem in problems:
+                print(f"  {problem}")
+            failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
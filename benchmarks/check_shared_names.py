@@ -0,0 +1,109 @@
+"""同じファイル名の別ファイルを、実行をまたいで正しく保存・再利用できるかの確認（ネットワーク不要）
+
+ローカルのGoogleドライブ代替サーバー（drive_server.py）で、ファイル名が同じで内容の異なるファイルIDを用意し、
+同じダウンロード先フォルダでReportEngineを繰り返し実行する。各実行で次のことを確認する。
+- 結果の各行が、そのファイルID自身の内容のファイルを指している（別のファイルで上書きされていない）
+- 2回目以降はキャッシュを使い、ファイルを再ダウンロードしない
+
+使い方:
+    python benchmarks/check_shared_names.py --ids 3 --runs 3
+
+問題があった場合は終了コード1を返す。
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+
+from fixtures import make_mp3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from downloader import GDriveDownloader  # noqa: E402
+from report_engine import ReportEngine  # noqa: E402
+
+SHARED_NAME = "rec.mp3"
+
+
+def make_workbook(path, file_ids):
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Sheet1"
+    ws.append(["見出し"] * 12)
+    for file_id in file_ids:
+        ws.append([None] * 9 + [f"https://drive.google.com/file/d/{file_id}/view", None, None])
+    wb.save(path)
+
+
+def run_once(workbook, download_dir, base_url, file_ids, expected):
+    """1回実行し、(問題のリスト, ダウンロードしたファイル数)を返す"""
+    downloader = GDriveDownloader(base_url=base_url)
+    engine = ReportEngine(
+        workbook, download_dir, ["Sheet1"], False, 2, open_excel=False, downloader=downloader
+    )
+    try:
+        success, message = engine.run()
+    finally:
+        engine.close()
+        downloader.close()
+    if not success:
+        return [f"実行に失敗しました: {message}"], 0
+
+    problems = []
+    for row_num, file_id in enumerate(file_ids, start=2):
+        info = engine.file_processor.file_info.get(("Sheet1", row_num))
+        if info is None or not info['file_path']:
+            problems.append(f"{file_id}: 結果がありません")
+            continue
+        with open(info['file_path'], 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if digest != expected[file_id]:
+            problems.append(f"{file_id}: 別のファイルの内容を指しています ({os.path.basename(info['file_path'])})")
+    downloaded = sum(1 for row in engine.metrics.files.values() if row.get('cached') is False)
+    return problems, downloaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="同じファイル名の別ファイルの保存・再利用の確認")
+    parser.add_argument('--ids', type=int, default=3, help="同じファイル名にするファイルIDの数")
+    parser.add_argument('--runs', type=int, default=3, help="実行回数")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from drive_server import DriveStandIn
+
+    # 再生時間（＝内容）はファイルIDごとに変える
+    files = {f"shared{index}": (SHARED_NAME, make_mp3(30 + index * 60)) for index in range(max(2, args.ids))}
+    expected = {file_id: hashlib.sha256(data).hexdigest() for file_id, (_, data) in files.items()}
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix='m4a_report_names_') as work_dir, DriveStandIn(files) as server:
+        download_dir = os.path.join(work_dir, 'downloads')
+        for run in range(1, args.runs + 1):
+            # 実行ごとにファイルの順番を変え、キャッシュ済みのファイルと新しいファイルが混ざる場合も確認する
+            file_ids = list(files)[:run] if run < len(files) else list(files)
+            file_ids = file_ids[run % len(file_ids):] + file_ids[:run % len(file_ids)]
+            workbook = os.path.join(work_dir, f'run{run}.xlsx')
+            make_workbook(workbook, file_ids)
+            problems, downloaded = run_once(workbook, download_dir, server.base_url, file_ids, expected)
+            new_ids = len(file_ids) - min(run - 1, len(files))
+            if run > 1 and downloaded > max(0, new_ids):
+                problems.append(f"キャッシュ済みのファイルを再ダウンロードしました（{downloaded} 件）")
+            print(f"{run} 回目: {len(file_ids)} 件, ダウンロード {downloaded} 件, 問題 {len(problems)} 件")
+            for problem in problems:
+                print(f"  {problem}")
+            failed = failed or bool(problems)
+
+        print("保存されたファイル:", ", ".join(sorted(
+            name for name in os.listdir(download_dir) if name.endswith('.mp3')
+        )))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
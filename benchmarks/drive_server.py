@@ -0,0 +1,192 @@
+"""Googleドライブのダウンロード（drive.google.com/uc?export=download）を模したローカルHTTPサーバー
+
+ベンチマーク用。次の動作を再現する。
+- 確認ページ: download_warningのCookieを返す形式（cookie）、HTMLフォームの形式（form）、確認なし（none）
+- Content-Dispositionのfilename*（UTF-8）によるファイル名
+- Rangeによる部分取得
+- 応答前の遅延（latency）と、接続ごとの転送速度の上限（throttle）
+- 一定の割合で返す制限エラー（429 Too Many Requests、error_rate）
+"""
+import html
+import http.server
+import random
+import threading
+import time
+import urllib.parse
+
+CONFIRM_MODES = ('cookie', 'form', 'none')
+# 転送速度の上限を適用する単位（バイト）
+_THROTTLE_CHUNK = 16 * 1024
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        file_id = query.get('id', [''])[0]
+        stand_in._count_request()
+
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+
+        if file_id not in stand_in.files:
+            self._send_page(404, b"<html>not found</html>")
+            return
+
+        if stand_in.error_rate and stand_in._should_fail():
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        file_name, data = stand_in.files[file_id]
+        if stand_in.confirm != 'none' and 'confirm' not in query:
+            self._send_confirm_page(file_id)
+            return
+
+        start, stop = 0, len(data)
+        range_header = self.headers.get('Range')
+        if range_header:
+            first, _, last = range_header.split('=', 1)[1].partition('-')
+            start = int(first)
+            if last:
+                stop = min(int(last) + 1, len(data))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        self.send_response(206 if range_header else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header(
+            "Content-Disposition",
+            f'attachment; filename="download"; filename*=UTF-8\'\'{urllib.parse.quote(file_name)}'
+        )
+        self.send_header("Content-Length", str(stop - start))
+        if range_header:
+            self.send_header("Content-Range", f"bytes {start}-{stop - 1}/{len(data)}")
+        self.end_headers()
+        self._send_body(memoryview(data)[start:stop])
+
+    def _send_confirm_page(self, file_id):
+        if self.server.stand_in.confirm == 'cookie':
+            page = b"<html><body>Google Drive can't scan this file for viruses.</body></html>"
+            self.send_response(200)
+            self.send_header("Set-Cookie", f"download_warning_{file_id}=bench; Path=/")
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+            return
+
+        action = html.escape(f"http://{self.headers.get('Host')}/uc", quote=True)
+        page = (
+            f'<html><body><form id="download-form" action="{action}" method="get">'
+            f'<input type="hidden" name="id" value="{html.escape(file_id)}">'
+            f'<input type="hidden" name="export" value="download">'
+            f'<input type="hidden" name="confirm" value="t">'
+            f'</form></body></html>'
+        ).encode('utf-8')
+        self._send_page(200, page)
+
+    def _send_page(self, status, page):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def _send_body(self, body):
+        stand_in = self.server.stand_in
+        if not stand_in.throttle:
+            self.wfile.write(body)
+            stand_in._count_bytes(len(body))
+            return
+
+        # 接続ごとにthrottle（バイト/秒）を超えないように送る
+        started = time.monotonic()
+        sent = 0
+        for offset in range(0, len(body), _THROTTLE_CHUNK):
+            chunk = body[offset:offset + _THROTTLE_CHUNK]
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            stand_in._count_bytes(len(chunk))
+            wait = sent / stand_in.throttle - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+
+class DriveStandIn:
+    """Googleドライブの代わりに使うローカルサーバー
+
+    Args:
+        files: {ファイルID: (ファイル名, 内容のバイト列)}
+        latency: 各リクエストの応答前に待つ秒数
+        throttle: 接続ごとの転送速度の上限（バイト/秒、0は無制限）
+        confirm: 確認ページの形式（'cookie', 'form', 'none'）
+        error_rate: 429を返すリクエストの割合
+    """
+
+    def __init__(self, files=None, latency=0.0, throttle=0, confirm='cookie', error_rate=0.0, seed=0):
+        if confirm not in CONFIRM_MODES:
+            raise ValueError(f"confirmは{CONFIRM_MODES}のいずれかを指定してください: {confirm}")
+        self.files = dict(files or {})
+        self.latency = latency
+        self.throttle = throttle
+        self.confirm = confirm
+        self.error_rate = error_rate
+        self.errors = 0
+        self._random = random.Random(seed)
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        """GDriveDownloaderのbase_urlに渡すURL"""
+        return f"http://127.0.0.1:{self._server.server_port}/uc?export=download"
+
+    def start(self):
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def _should_fail(self):
+        with self._lock:
+            if self._random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def _count_bytes(self, size):
+        with self._lock:
+            self.bytes_sent += size
@@ -0,0 +1,94 @@
+"""ベンチマーク用のテストデータ（音声ファイルとExcelファイル）を生成する"""
+import random
+import struct
+
+# MPEG1 Layer3 128kbps 44.1kHz ステレオのフレーム（417バイト、1152サンプル）
+_MP3_FRAME_HEADER = b'\xff\xfb\x90\x00'
+_MP3_FRAME_SIZE = 417
+_MP3_SAMPLES_PER_FRAME = 1152
+_MP3_SAMPLE_RATE = 44100
+
+
+def _atom(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def _full_atom(kind, body):
+    """version 0・flags 0のフルボックス"""
+    return _atom(kind, b'\0\0\0\0' + body)
+
+
+def make_mp3(seconds, xing=True):
+    """固定ビットレートのMP3を生成する（先頭にXingヘッダーのフレームを置く）"""
+    frames = max(1, int(seconds * _MP3_SAMPLE_RATE / _MP3_SAMPLES_PER_FRAME))
+    silent = _MP3_FRAME_HEADER + b'\0' * (_MP3_FRAME_SIZE - len(_MP3_FRAME_HEADER))
+    out = b''
+    if xing:
+        # サイド情報（32バイト）の後にXingヘッダー（フレーム数・バイト数あり）
+        body = b'\0' * 32 + b'Xing' + struct.pack('>III', 0x3, frames, frames * _MP3_FRAME_SIZE)
+        out += _MP3_FRAME_HEADER + body + b'\0' * (_MP3_FRAME_SIZE - len(_MP3_FRAME_HEADER) - len(body))
+    return out + silent * frames
+
+
+def make_m4a(seconds, payload_size=64 * 1024, rate=44100):
+    """再生時間だけが正しい最小限のM4A（ftyp・moov・mdat）を生成する"""
+    mvhd = _full_atom(b'mvhd', struct.pack('>IIII', 0, 0, 1000, int(seconds * 1000)) + b'\0' * 80)
+    mdhd = _full_atom(b'mdhd', struct.pack('>IIII', 0, 0, rate, int(seconds * rate)) + b'\0' * 4)
+    hdlr = _full_atom(b'hdlr', b'\0' * 4 + b'soun' + b'\0' * 12 + b'SoundHandler\0')
+    trak = _atom(b'trak', _full_atom(b'tkhd', b'\0' * 80) + _atom(b'mdia', mdhd + hdlr + _atom(b'minf', b'')))
+    moov = _atom(b'moov', mvhd + trak)
+    ftyp = _atom(b'ftyp', b'M4A \0\0\0\0M4A mp42isom')
+    return ftyp + moov + _atom(b'mdat', b'\x01' * payload_size)
+
+
+def make_audio_files(count, mp3_ratio=0.5, min_seconds=30, max_seconds=600, m4a_payload=64 * 1024, seed=0):
+    """ダウンロード対象のファイルを生成する
+
+    Returns:
+        {ファイルID: (ファイル名, 内容のバイト列)}
+    """
+    rng = random.Random(seed)
+    files = {}
+    for index in range(count):
+        seconds = rng.uniform(min_seconds, max_seconds)
+        file_id = f"bench{index:06d}"
+        if rng.random() < mp3_ratio:
+            files[file_id] = (f"音声_{index}.mp3", make_mp3(seconds))
+        else:
+            files[file_id] = (f"音声_{index}.m4a", make_m4a(seconds, m4a_payload))
+    return files
+
+
+def make_workbook(path, file_ids, sheets=1, rows=100, link_density=1.0, filled_l_ratio=0.0, seed=0):
+    """J列にGoogleドライブの共有リンクを並べたExcelファイルを生成する
+
+    Args:
+        file_ids: リンク先のファイルIDのリスト（行数が多い場合は繰り返し使う＝重複リンクになる）
+        sheets: シート数
+        rows: シートごとのデータ行数
+        link_density: リンクを入れる行の割合
+        filled_l_ratio: L列（再生時間）に値が入っている行の割合
+
+    Returns:
+        生成したリンクの数
+    """
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    links = 0
+    for sheet_index in range(sheets):
+        sheet = workbook.create_sheet(f"Sheet{sheet_index + 1}")
+        sheet.append([f"列{column}" for column in range(1, 13)])
+        for row in range(rows):
+            values = [f"データ{row}"] + [None] * 11
+            if rng.random() < link_density:
+                file_id = file_ids[links % len(file_ids)]
+                values[9] = f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
+                links += 1
+                if rng.random() < filled_l_ratio:
+                    values[11] = "00:00"
+            sheet.append(values)
+    workbook.save(path)
+    return links
@@ -20,7 +20,7 @@ pyinstaller --name m4a_report \
   --hidden-import PyQt5.QtGui \
   --hidden-import openpyxl \
   --hidden-import polars \
-  --hidden-import gdown \
+  --hidden-import requests \
   --hidden-import mutagen \
   main.py
 
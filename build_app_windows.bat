@@ -6,7 +6,7 @@ pip install pyinstaller
 pip install PyQt5
 pip install openpyxl
 pip install polars
-pip install gdown
+pip install requests
 pip install mutagen
 
 REM 以前のビルドファイルを削除
@@ -18,7 +18,7 @@ REM PyInstallerでビルド
 echo "アプリケーションをexe化しています..."
 pyinstaller --name m4a_report ^
   --windowed ^
-  --onefile ^
+  --onedir ^
   --add-data "【※サイト構築用※】音声テンプレ.xlsx;." ^
   --add-data "m4a;m4a" ^
   --hidden-import PyQt5.QtCore ^
@@ -26,11 +26,11 @@ pyinstaller --name m4a_report ^
   --hidden-import PyQt5.QtGui ^
   --hidden-import openpyxl ^
   --hidden-import polars ^
-  --hidden-import gdown ^
+  --hidden-import requests ^
   --hidden-import mutagen ^
   main.py
 
 REM ビルド完了メッセージ
 echo "ビルドが完了しました！"
-echo "アプリケーションは dist/m4a_report.exe にあります"
+echo "アプリケーションは dist\m4a_report\m4a_report.exe にあります"
 pause
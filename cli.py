@@ -0,0 +1,187 @@
+"""コマンドラインから複数のExcelファイルをまとめて処理する（PyQt5は読み込まない）
+
+使い方:
+    python cli.py "reports/*.xlsx" --download-dir downloads --sheets Sheet1 --output result.json
+"""
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from download_schedule import DEFAULT_SCHEDULE, SCHEDULE_POLICIES
+from excel_processor import DEFAULT_SAVE_MODE, SAVE_MODES, ExcelProcessor
+from result_table import EXPORT_FORMATS
+from report_engine import DEFAULT_CACHE_MAX_GB, DEFAULT_MAX_WORKERS, ReportEngine
+
+# 終了コード
+EXIT_OK = 0
+EXIT_FAILED = 1  # 失敗したExcelファイルがある
+EXIT_USAGE = 2  # 引数の誤り（argparseと同じ）
+
+
+def expand_workbooks(patterns):
+    """ファイルパスまたはglobパターンのリストを、重複のないExcelファイルのリストに展開する"""
+    workbooks = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if path not in workbooks:
+                workbooks.append(path)
+    return workbooks
+
+
+def process_workbook(excel_file, args, downloader=None):
+    """1つのExcelファイルを処理し、結果を辞書で返す
+
+    downloaderを渡すと、その接続プールを使う（複数のExcelファイルで共有するため）。
+    """
+    started = time.time()
+    result = {
+        'workbook': excel_file, 'success': False, 'message': None, 'sheets': [],
+        'succeeded': 0, 'failed': 0, 'rows': [],
+    }
+
+    excel_processor = ExcelProcessor(excel_file)
+    if args.sheets:
+        sheets = args.sheets
+    else:
+        # シートの指定がなければすべてのシートを対象にする
+        success, error_msg = excel_processor.load_sheet_names()
+        if not success:
+            result['message'] = error_msg
+            return result
+        sheets = excel_processor.get_sheets()
+    result['sheets'] = sheets
+
+    def on_progress(percent, message):
+        print(f"[{os.path.basename(excel_file)}] {percent}% {message}", file=sys.stderr)
+
+    engine = ReportEngine(
+        excel_file, args.download_dir, sheets, not args.no_skip_l_column, args.workers,
+        force_refresh=args.force_refresh, cache_max_gb=args.cache_max_gb, metadata_only=args.metadata_only,
+        excel_processor=excel_processor, resume=args.resume, open_excel=False, progress_callback=on_progress,
+        write_report=args.report, metrics_in_results=args.metrics_in_results, schedule=args.schedule,
+        export_format=args.export, save_mode=args.save_mode, downloader=downloader
+    )
+    try:
+        return _run_engine(engine, result, args, started)
+    finally:
+        # キャッシュのSQLite接続を閉じる（Excelファイルごとに開くため）
+        engine.close()
+
+
+def _run_engine(engine, result, args, started):
+    """ReportEngineを実行（--planの場合は見積もり）し、結果をresultに書き込んで返す"""
+    if args.plan:
+        # ダウンロードせずに見積もりだけを出力する
+        plan, error_msg = engine.plan()
+        result['success'] = plan is not None
+        result['message'] = plan.describe() if plan is not None else error_msg
+        if plan is not None:
+            result['plan'] = plan.summary()
+            result['invalid_links'] = plan.invalid_links
+        result['elapsed'] = round(time.time() - started, 3)
+        return result
+
+    success, message = engine.run()
+
+    result['success'] = success
+    result['message'] = message
+    result['rows'] = engine.processed
+    result['succeeded'] = sum(1 for row in engine.processed if row['error'] is None)
+    result['failed'] = sum(1 for row in engine.processed if row['error'] is not None)
+    result['elapsed'] = round(time.time() - started, 3)
+    result['metrics'] = engine.metrics.summary()
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Googleドライブ共有リンクのファイルをダウンロードして再生時間をExcelに書き込む（GUIなし）"
+    )
+    parser.add_argument('workbooks', nargs='+', help="処理するExcelファイル（globパターン可）")
+    parser.add_argument('-d', '--download-dir', required=True, help="ダウンロードしたファイルの保存先")
+    parser.add_argument('-s', '--sheets', action='append',
+                        help="処理対象のシート名（複数指定可、省略時はすべてのシート）")
+    parser.add_argument('--no-skip-l-column', action='store_true',
+                        help="L列(再生時間)に値がある行もスキップしない")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_MAX_WORKERS, help="最大同時ダウンロード数")
+    parser.add_argument('--schedule', choices=tuple(SCHEDULE_POLICIES), default=DEFAULT_SCHEDULE,
+                        help="ダウンロード順（sheet: シート・行の順、largest: 大きいファイルから、"
+                             "smallest: 小さいファイルから。sheet以外は事前にファイルサイズを確認する）")
+    parser.add_argument('--force-refresh', action='store_true', help="キャッシュを使わずに再ダウンロードする")
+    parser.add_argument('--cache-max-gb', type=int, default=DEFAULT_CACHE_MAX_GB,
+                        help="ダウンロードキャッシュの上限（GB、0は無制限）")
+    parser.add_argument('--metadata-only', action='store_true',
+                        help="再生時間のみ取得する（ファイルはダウンロードしない）")
+    parser.add_argument('--plan', action='store_true',
+                        help="ダウンロードせずに見積もる（リンク数、重複・無効なURL、キャッシュ済みのファイル、ダウンロード量）")
+    parser.add_argument('--resume', action='store_true', help="前回の続きから再開する")
+    parser.add_argument('--report', action='store_true',
+                        help="Excelファイルの隣に実行レポート（段階ごとの所要時間・転送速度）をJSON/CSVで保存する")
+    parser.add_argument('--metrics-in-results', action='store_true',
+                        help="結果シートにダウンロード時間・転送速度・分析時間を追加する")
+    parser.add_argument('--export', choices=EXPORT_FORMATS,
+                        help="結果シートと同じ内容を、Excelファイルの隣にParquetまたはCSVでも保存する")
+    parser.add_argument('--save-mode', choices=tuple(SAVE_MODES), default=DEFAULT_SAVE_MODE,
+                        help="Excelの保存方法（workbook: openpyxlでワークブック全体を保存、"
+                             "patch: 変更したシートのセルとハイパーリンクだけを書き換え、他の部分はそのままコピーする）")
+    parser.add_argument('-o', '--output', default='-',
+                        help="結果のJSONの出力先（既定は標準出力、ログは標準エラー出力に出す）")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    workbooks = expand_workbooks(args.workbooks)
+    if not workbooks:
+        print("処理対象のExcelファイルが見つかりませんでした。", file=sys.stderr)
+        return EXIT_USAGE
+
+    # requestsは読み込みに時間がかかるため、引数の確認が終わってからインポートする
+    from downloader import GDriveDownloader
+
+    # 各モジュールのprintによるログは標準エラー出力に回し、標準出力はJSONだけにする
+    results = []
+    # 接続プールはすべてのExcelファイルで共有し、最後に1回だけ閉じる
+    downloader = GDriveDownloader()
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            for excel_file in workbooks:
+                print(f"処理開始: {excel_file}")
+                try:
+                    result = process_workbook(excel_file, args, downloader)
+                except Exception as e:
+                    result = {
+                        'workbook': excel_file, 'success': False, 'message': f"エラー: {str(e)}",
+                        'succeeded': 0, 'failed': 0, 'rows': [],
+                    }
+                print(f"処理終了: {excel_file} - {result['message']}")
+                results.append(result)
+    finally:
+        downloader.close()
+
+    report = {
+        # 保存まで完了し、かつ失敗した行がない場合だけ成功とする
+        'success': all(result['success'] and result['failed'] == 0 for result in results),
+        'workbooks': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+    return EXIT_OK if report['success'] else EXIT_FAILED
+
+
+if __name__ == "__main__":
+    # PyInstallerでexe化した場合に分析用のプロセスプールを起動するため
+    multiprocessing.freeze_support()
+    sys.exit(main())
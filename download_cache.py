@@ -0,0 +1,264 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_FILE_NAME = ".m4a_report_cache.sqlite3"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def compute_file_hash(file_path):
+    """ファイル内容のSHA-256を計算する"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadCache:
+    """ダウンロード済みファイルの情報をファイルIDごとに保存するマニフェスト
+
+    download_dir内のSQLiteファイルに保存し、実行をまたいで再利用する。
+    """
+
+    def __init__(self, download_dir):
+        self.download_dir = download_dir
+        os.makedirs(download_dir, exist_ok=True)
+        self.db_path = os.path.join(download_dir, CACHE_FILE_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY,
+                rel_path TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                content_hash TEXT,
+                duration REAL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        # 同じ内容のファイルを探すための索引
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_content_hash ON files (content_hash)")
+        # 保存先のパスを保存したファイルID（キャッシュが無効になった後も残し、別のファイルIDが同じ名前で上書きしないようにする）
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS paths (
+                rel_path TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL
+            )"""
+        )
+        # ダウンロードせずに取得したファイルのメタデータ（DriveMetadataが有効期限付きで使う）
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS metadata (
+                file_id TEXT PRIMARY KEY,
+                file_name TEXT,
+                size INTEGER,
+                mime_type TEXT,
+                fetched_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, file_id):
+        """有効なキャッシュがあればその情報を返す（ファイルが変更・削除されていればNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rel_path, file_name, size, mtime, content_hash, duration FROM files WHERE file_id = ?",
+                (file_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        rel_path, file_name, size, mtime, content_hash, duration = row
+        file_path = os.path.join(self.download_dir, rel_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.remove(file_id)
+            return None
+
+        # サイズと更新日時が一致しない場合は無効とみなす
+        if stat.st_size != size or abs(stat.st_mtime - mtime) > 1e-3:
+            self.remove(file_id)
+            return None
+
+        with self._lock:
+            self._conn.execute("UPDATE files SET last_used = ? WHERE file_id = ?", (time.time(), file_id))
+            self._conn.commit()
+
+        return {
+            'file_id': file_id,
+            'file_path': file_path,
+            'file_name': file_name,
+            'size': size,
+            'mtime': mtime,
+            'content_hash': content_hash,
+            'duration': duration,
+        }
+
+    def put(self, file_id, file_path, duration=None, content_hash=None):
+        """ダウンロードしたファイルを登録する"""
+        stat = os.stat(file_path)
+        if content_hash is None:
+            content_hash = compute_file_hash(file_path)
+        rel_path = os.path.relpath(file_path, self.download_dir)
+        with self._lock:
+            # 同じパスを指す別のファイルIDの情報は、内容が同じ（重複をまとめたもの）でなければ古くなっている
+            self._conn.execute(
+                "DELETE FROM files WHERE rel_path = ? AND file_id != ? AND content_hash IS NOT ?",
+                (rel_path, file_id, content_hash)
+            )
+            self._conn.execute(
+                """INSERT OR REPLACE INTO files
+                   (file_id, rel_path, file_name, size, mtime, content_hash, duration, last_used)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (file_id, rel_path, os.path.basename(file_path), stat.st_size, stat.st_mtime,
+                 content_hash, duration, time.time())
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO paths (rel_path, file_id) VALUES (?, ?)", (rel_path, file_id)
+            )
+            self._conn.commit()
+
+    def owner_of(self, file_path):
+        """file_pathにファイルを保存したファイルIDを返す（記録がなければNone）
+
+        GDriveDownloaderが保存先を決めるときに、既存のファイルを置き換えてよいかの判断に使う。
+        """
+        rel_path = os.path.relpath(file_path, self.download_dir)
+        with self._lock:
+            row = self._conn.execute("SELECT file_id FROM paths WHERE rel_path = ?", (rel_path,)).fetchone()
+        return row[0] if row else None
+
+    def find_by_hash(self, content_hash, exclude_file_id=None):
+        """同じ内容のキャッシュ済みファイルのパスを返す（有効なものがなければNone）"""
+        if not content_hash:
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_id FROM files WHERE content_hash = ? AND file_id != ?",
+                (content_hash, exclude_file_id or '')
+            ).fetchall()
+        for (other_id,) in rows:
+            cached = self.get(other_id)
+            if cached and cached['content_hash'] == content_hash:
+                return cached['file_path']
+        return None
+
+    def link_duplicate(self, file_path, existing_path):
+        """file_pathを、同じ内容の既存ファイルへのハードリンクに置き換える
+
+        ハードリンクを作成できない場合（対応していないファイルシステムなど）は、重複したファイルを削除して既存のファイルを使う。
+
+        Returns:
+            置き換え後に使うファイルのパス
+        """
+        if os.path.samefile(file_path, existing_path):
+            return file_path
+        link_path = file_path + ".link"
+        try:
+            os.link(existing_path, link_path)
+            os.replace(link_path, file_path)
+            return file_path
+        except OSError as e:
+            try:
+                os.remove(link_path)
+            except OSError:
+                pass
+            print(f"ハードリンクを作成できないため、既存のファイルを使います: {str(e)}")
+            os.remove(file_path)
+            return existing_path
+
+    def set_duration(self, file_id, duration):
+        """分析済みの再生時間（秒）を保存する"""
+        with self._lock:
+            self._conn.execute("UPDATE files SET duration = ? WHERE file_id = ?", (duration, file_id))
+            self._conn.commit()
+
+    def get_metadata(self, file_id):
+        """保存済みのメタデータを(ファイル名, サイズ, MIMEタイプ, 取得日時)で返す（なければNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_name, size, mime_type, fetched_at FROM metadata WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put_metadata(self, file_id, file_name, size, mime_type):
+        """取得したメタデータを保存する"""
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO metadata (file_id, file_name, size, mime_type, fetched_at)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (file_id, file_name, size, mime_type, time.time())
+            )
+            self._conn.commit()
+
+    def remove(self, file_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            self._conn.commit()
+
+    def total_size(self):
+        """ディスク上のファイル単位の合計サイズ（同じファイルを使う複数のエントリーは1回だけ数える）"""
+        return sum(group['size'] for group in self._disk_files())
+
+    def _disk_files(self):
+        """エントリーをディスク上のファイル（inode、見つからなければパス）ごとにまとめたリスト
+
+        ハードリンクや、複数のファイルIDが同じパスを使うエントリーは1つにまとめ、最後に使われた日時はその中で最も新しいものにする。
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT file_id, rel_path, size, last_used FROM files").fetchall()
+
+        groups = {}
+        for file_id, rel_path, size, last_used in rows:
+            file_path = os.path.join(self.download_dir, rel_path)
+            try:
+                stat = os.stat(file_path)
+                key = (stat.st_dev, stat.st_ino)
+            except OSError:
+                key = file_path
+            group = groups.setdefault(key, {'size': size, 'last_used': last_used, 'file_ids': [], 'paths': set()})
+            group['last_used'] = max(group['last_used'], last_used)
+            group['file_ids'].append(file_id)
+            group['paths'].add(file_path)
+        return list(groups.values())
+
+    def evict(self, max_bytes):
+        """合計サイズがmax_bytes以下になるまで、最後に使われた日時が古い順にファイルを削除する
+
+        同じ内容をまとめたファイル（ハードリンク、または複数のファイルIDが同じパスを使うもの）は1つのファイルとして数える
+        （_disk_filesを参照）。削除する場合はそのファイルを使うエントリーをまとめて削除するので、
+        他のエントリーが使っているファイルだけを消すことはない。
+
+        Returns:
+            削除したファイル数（ディスク上のファイル単位）
+        """
+        groups = self._disk_files()
+        total = sum(group['size'] for group in groups)
+        evicted = 0
+        for group in sorted(groups, key=lambda group: group['last_used']):
+            if total <= max_bytes:
+                break
+            try:
+                for file_path in group['paths']:
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+            except OSError as e:
+                print(f"キャッシュ削除エラー: {str(e)}")
+                continue
+            for file_id in group['file_ids']:
+                self.remove(file_id)
+            total -= group['size']
+            evicted += 1
+
+        return evicted
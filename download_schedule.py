@@ -0,0 +1,40 @@
+# ダウンロード順の方針
+SCHEDULE_SHEET_ORDER = 'sheet'  # シート・行の順（サイズの事前取得をしない）
+SCHEDULE_LARGEST_FIRST = 'largest'  # 大きいファイルから（並列ダウンロード全体の所要時間を短くする）
+SCHEDULE_SMALLEST_FIRST = 'smallest'  # 小さいファイルから（途中結果を早く得る）
+SCHEDULE_POLICIES = {
+    SCHEDULE_SHEET_ORDER: "シート・行の順",
+    SCHEDULE_LARGEST_FIRST: "大きいファイルから",
+    SCHEDULE_SMALLEST_FIRST: "小さいファイルから",
+}
+DEFAULT_SCHEDULE = SCHEDULE_SHEET_ORDER
+
+
+def fetch_sizes(file_processor, link_groups, max_workers):
+    """リンクグループごとのファイルサイズを並列に取得する（ダウンロード前の事前確認）
+
+    取得できなくてもダウンロード時に改めてエラーになるので、ここでは順番の決定にだけ影響させる。
+
+    Returns:
+        {ファイルID: サイズ（バイト）}（サイズを取得できなかったファイルは含まない）
+    """
+    file_ids = [file_processor.extract_file_id(group[0]['url']) for group in link_groups]
+    metadata = file_processor.resolve_metadata([file_id for file_id in file_ids if file_id], max_workers)
+    return {file_id: size for file_id, (_, size, _) in metadata.items() if size is not None}
+
+
+def order_link_groups(link_groups, sizes, policy, extract_file_id):
+    """方針に従ってリンクグループを並べ替えたリストを返す
+
+    サイズが分からないファイルは最も大きいものとして扱う（大きいファイルから処理する場合は先頭、小さいファイルからの場合は末尾）。
+    同じサイズのファイルは元の順番を保つ。
+    """
+    if policy == SCHEDULE_SHEET_ORDER:
+        return list(link_groups)
+    if policy not in SCHEDULE_POLICIES:
+        raise ValueError(f"ダウンロード順の方針は{tuple(SCHEDULE_POLICIES)}のいずれかを指定してください: {policy}")
+
+    def size_of(group):
+        return sizes.get(extract_file_id(group[0]['url']), float('inf'))
+
+    return sorted(link_groups, key=size_of, reverse=(policy == SCHEDULE_LARGEST_FIRST))
@@ -0,0 +1,378 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from retry_policy import DownloadError
+
+GDRIVE_DOWNLOAD_URL = "https://drive.google.com/uc?export=download"
+
+# 接続プールの大きさ（同時ダウンロード数より大きくしておく）
+DEFAULT_POOL_SIZE = 32
+# ディスクへの書き込み単位（1 MiB）
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# 転送が途中で切れた場合に、同じ実行内で続きから再開する回数
+DEFAULT_RESUME_ATTEMPTS = 3
+PART_SUFFIX = ".part"
+# 転送中のファイルを置くステージングディレクトリ（保存先ディレクトリ内に作成する）
+STAGING_DIR_NAME = ".staging"
+
+_CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+# 大きいファイルで表示される確認ページのフォーム要素
+_FORM_ACTION_RE = re.compile(r'<form[^>]+id="download-form"[^>]+action="([^"]+)"')
+_HIDDEN_INPUT_RE = re.compile(r'<input[^>]+type="hidden"[^>]+name="([^"]+)"[^>]+value="([^"]*)"')
+# ダウンロード回数の上限に達したときのページ（英語・日本語）
+_QUOTA_PAGE_RE = re.compile(r'Quota exceeded|Too many users have viewed or downloaded|ダウンロードの割り当てを超えています')
+
+
+def parse_content_disposition(cd):
+    """Content-Dispositionヘッダーからファイル名を取り出す（見つからない場合はNone）"""
+    if not cd:
+        return None
+
+    # UTF-8エンコードされたfilename*を優先する
+    filename_star = re.search(r'filename\*=UTF-8\'\'([^;]+)', cd, re.IGNORECASE)
+    if filename_star:
+        try:
+            return os.path.basename(urllib.parse.unquote(filename_star.group(1).strip()))
+        except Exception as e:
+            print(f"Decoding error: {e}")
+
+    # 通常のfilename
+    filename = re.search(r'filename="([^"]+)"', cd, re.IGNORECASE)
+    if filename:
+        return os.path.basename(filename.group(1))
+
+    return None
+
+
+def parse_content_type(content_type):
+    """Content-TypeヘッダーからMIMEタイプ（charsetなどのパラメーターを除く）を取り出す（見つからない場合はNone）"""
+    return (content_type or '').split(';')[0].strip().lower() or None
+
+
+def parse_content_range(content_range):
+    """Content-Rangeヘッダーから(開始位置, 全体サイズ)を取り出す（全体サイズ不明の場合はNone）"""
+    match = _CONTENT_RANGE_RE.match(content_range or '')
+    if not match:
+        return None, None
+    total = match.group(3)
+    return int(match.group(1)), (int(total) if total != '*' else None)
+
+
+class PartialReadUnsupported(RuntimeError):
+    """サーバーが範囲取得に対応していない、または全体サイズが分からず、ファイルの一部だけを読み取れない"""
+
+
+class RemoteFile:
+    """Rangeリクエストで任意の位置を読み取れるリモートファイル"""
+
+    def __init__(self, session, url, size, file_name, head, timeout, mime_type=None):
+        self.session = session
+        self.url = url  # 確認ページ通過後のURL
+        self.size = size
+        self.file_name = file_name
+        self.mime_type = mime_type
+        self.head = head  # 最初の範囲取得で得た先頭部分
+        self.timeout = timeout
+
+    def read_at(self, offset, size):
+        """offsetからsizeバイトを取得する"""
+        end = min(offset + size, self.size) - 1
+        if end < offset:
+            return b''
+        response = self.session.get(
+            self.url, headers={'Range': f'bytes={offset}-{end}'}, stream=True, timeout=self.timeout
+        )
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise PartialReadUnsupported("サーバーが範囲取得に対応していません")
+            return response.content
+        finally:
+            response.close()
+
+
+class GDriveDownloader:
+    """Googleドライブのファイルを共有の接続プール経由でダウンロードする"""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, timeout=60,
+                 base_url=GDRIVE_DOWNLOAD_URL, resume_attempts=DEFAULT_RESUME_ATTEMPTS):
+        self.base_url = base_url
+        self.chunk_size = chunk_size
+        self.resume_attempts = resume_attempts
+        # この実行中に割り当て済みの保存先パス（同名ファイルの並列ダウンロードで上書きし合わないため）
+        self._claimed_paths = {}  # パス -> ファイルID
+        self._claim_lock = threading.Lock()
+        self.timeout = timeout
+
+        # Keep-Aliveの接続を全ダウンロードで使い回す
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def open(self, file_id, headers=None):
+        """ダウンロード用のレスポンスを開く（確認ページがあれば自動で通過する）
+
+        呼び出し側でレスポンスを閉じること。
+        """
+        url = f"{self.base_url}&id={file_id}"
+        response = self.session.get(url, stream=True, headers=headers, timeout=self.timeout)
+
+        # 確認トークンを取得（大きいファイルの場合はCookieで渡される）
+        token = None
+        for key, value in response.cookies.items():
+            if key.startswith('download_warning'):
+                token = value
+                break
+
+        if token:
+            # 確認ページの本文は小さいので読み切って接続をプールに戻す
+            response.content
+            response.close()
+            return self.session.get(f"{url}&confirm={token}", stream=True, headers=headers, timeout=self.timeout)
+
+        # 新しい形式の確認ページ（HTMLフォーム）の場合
+        if 'text/html' in response.headers.get('Content-Type', '') and not response.headers.get('Content-Disposition'):
+            page = response.text
+            response.close()
+            if _QUOTA_PAGE_RE.search(page):
+                raise DownloadError(
+                    "ダウンロード回数の上限に達しています（時間をおいて再試行します）", retryable=True, throttled=True
+                )
+            # エラーページ（429・5xxなど）はHTTPErrorとして扱う
+            response.raise_for_status()
+            action = _FORM_ACTION_RE.search(page)
+            if not action:
+                raise RuntimeError("ダウンロード確認ページを解析できませんでした（共有設定を確認してください）")
+            params = dict(_HIDDEN_INPUT_RE.findall(page))
+            return self.session.get(action.group(1), params=params, stream=True, headers=headers, timeout=self.timeout)
+
+        return response
+
+    def open_remote(self, file_id, head_size=64 * 1024):
+        """ファイル全体を取得せずに読み取るためのRemoteFileを返す
+
+        最初の範囲取得で先頭head_sizeバイト、全体サイズ、ファイル名をまとめて取得する。
+        全体サイズが分からない場合はPartialReadUnsupportedを送出する（ファイル全体のダウンロードで処理できる）。
+        """
+        response = self.open(file_id, headers={'Range': f'bytes=0-{head_size - 1}'})
+        try:
+            response.raise_for_status()
+            file_name = parse_content_disposition(response.headers.get('Content-Disposition', ''))
+            if response.status_code == 206:
+                _, size = parse_content_range(response.headers.get('Content-Range'))
+                head = response.content
+            else:
+                # 範囲取得に対応していない場合は先頭だけ読んで打ち切る
+                length = response.headers.get('Content-Length')
+                size = int(length) if length and length.isdigit() else None
+                head = response.raw.read(head_size)
+            if size is None:
+                raise PartialReadUnsupported("ファイルサイズを取得できませんでした")
+            return RemoteFile(
+                self.session, response.url, size, file_name, head, self.timeout,
+                mime_type=parse_content_type(response.headers.get('Content-Type'))
+            )
+        finally:
+            response.close()
+
+    def fetch_metadata(self, file_id):
+        """本文をほとんど読まずに(ファイル名, 全体サイズ, MIMEタイプ)を取得する（分からない項目はNone）
+
+        先頭1バイトだけを範囲取得し、Content-Range（範囲取得に対応していない場合はContent-Length）から全体サイズを求める。
+        """
+        response = self.open(file_id, headers={'Range': 'bytes=0-0'})
+        try:
+            response.raise_for_status()
+            file_name = parse_content_disposition(response.headers.get('Content-Disposition', ''))
+            mime_type = parse_content_type(response.headers.get('Content-Type'))
+            if response.status_code == 206:
+                _, size = parse_content_range(response.headers.get('Content-Range'))
+                # 本文は1バイトだけなので読み切って接続をプールに戻す
+                response.content
+            else:
+                length = response.headers.get('Content-Length')
+                size = int(length) if length and length.isdigit() else None
+            return file_name, size, mime_type
+        finally:
+            response.close()
+
+    def fetch_filename(self, file_id):
+        """本文を読まずにファイル名だけを取得する"""
+        return self.fetch_metadata(file_id)[0]
+
+    def staging_dir(self, dest_dir, file_id):
+        """ファイルIDごとのステージングディレクトリのパスを返す"""
+        return os.path.join(dest_dir, STAGING_DIR_NAME, file_id)
+
+    def download(self, file_id, dest_dir=None, output_path=None, stats=None):
+        """ファイルをダウンロードして保存先のパスを返す（download_with_hashを参照）"""
+        return self.download_with_hash(file_id, dest_dir, output_path, stats)[0]
+
+    def download_with_hash(self, file_id, dest_dir=None, output_path=None, stats=None, tee=None, owner_of=None):
+        """ファイルをダウンロードして(保存先のパス, 内容のSHA-256)を返す
+
+        output_pathを省略した場合は、dest_dir内にContent-Dispositionのファイル名で保存する。
+        転送中は保存先と同じディレクトリ内のファイルID専用のステージングディレクトリにある
+        「.part」ファイルに書き込み、既存の.partがあればRangeリクエストで続きから再開する。
+        最終的なパスには、全体を受信し終えてからリネームで置き換える（同じファイルシステム内なのでコピーは発生しない）。
+
+        statsに辞書を渡すと、計測値（metadata_seconds: 応答ヘッダーまで、ttfb_seconds: 最初のデータまで、
+        bytes: 受信バイト数、download_seconds: 全体）を書き込む。
+
+        ハッシュは受信しながら計算するので、保存後にファイルを読み直すことはない
+        （.partから再開した場合だけ、受信済みの部分を1回読む）。
+
+        teeを渡すと、ファイルの先頭から順にすべてのデータをtee.write(チャンク)で渡す
+        （受信を最初からやり直すたびに、先にtee.start(ファイル名, 全体サイズ)を呼ぶ）。
+
+        owner_ofは保存先の名前が既存のファイルと重なったときに使う（_claim_pathを参照）。
+        """
+        started = time.perf_counter()
+        if dest_dir is None:
+            dest_dir = os.path.dirname(output_path)
+        staging_dir = self.staging_dir(dest_dir, file_id)
+        os.makedirs(staging_dir, exist_ok=True)
+        part_path = os.path.join(staging_dir, file_id + PART_SUFFIX)
+
+        attempt = 0
+        while True:
+            try:
+                final_path, content_hash = self._download_part(
+                    file_id, part_path, dest_dir, output_path, stats, started, tee, owner_of
+                )
+                break
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as e:
+                # 受信済みの部分は.partに残っているので、続きから再開する
+                attempt += 1
+                if attempt > self.resume_attempts:
+                    raise
+                print(f"転送が中断されました。続きから再開します ({attempt}/{self.resume_attempts}): {str(e)}")
+
+        os.replace(part_path, final_path)
+        self._remove_staging_dir(staging_dir)
+        if stats is not None:
+            stats['download_seconds'] = time.perf_counter() - started
+        return final_path, content_hash
+
+    def _claim_path(self, dest_dir, file_name, file_id, owner_of=None):
+        """保存先パスを割り当てる
+
+        別のファイルIDのものと重なる場合は「名前 (2).拡張子」のように連番を付ける。
+        この実行中に別のファイルIDへ割り当て済みの名前のほか、保存先に既にあるファイルも避ける
+        （以前の実行で保存した別のファイルを上書きしないため）。
+        owner_of（パスを受け取り、そのファイルを保存したファイルIDを返す関数）で同じファイルIDのものと分かる
+        既存のファイルは、そのまま置き換える。
+        """
+        stem, ext = os.path.splitext(file_name)
+        with self._claim_lock:
+            candidate = os.path.join(dest_dir, file_name)
+            n = 2
+            while not self._can_claim(candidate, file_id, owner_of):
+                candidate = os.path.join(dest_dir, f"{stem} ({n}){ext}")
+                n += 1
+            self._claimed_paths[candidate] = file_id
+        return candidate
+
+    def _can_claim(self, path, file_id, owner_of):
+        """pathをfile_idの保存先にできるかどうか（_claim_lockを取得した状態で呼ぶ）"""
+        claimed = self._claimed_paths.get(path)
+        if claimed is not None:
+            return claimed == file_id
+        if not os.path.lexists(path):
+            return True
+        # 持ち主が分からない既存のファイルは、別のファイルのものとして扱う
+        return owner_of is not None and owner_of(path) == file_id
+
+    def _remove_staging_dir(self, staging_dir):
+        """空になったステージングディレクトリを削除する"""
+        for path in (staging_dir, os.path.dirname(staging_dir)):
+            try:
+                os.rmdir(path)
+            except OSError:
+                # 他のダウンロードが使用中の場合は残す
+                break
+
+    def _download_part(self, file_id, part_path, dest_dir, output_path, stats=None, started=None, tee=None,
+                       owner_of=None):
+        """.partファイルへの書き込みを1回試み、完了時の(最終パス, 内容のSHA-256)を返す"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+
+        response = self.open(file_id, headers=headers)
+        if stats is not None:
+            # 確認ページの通過を含め、ファイル名などの情報（応答ヘッダー）が届くまでの時間
+            stats.setdefault('metadata_seconds', time.perf_counter() - started)
+        try:
+            if response.status_code == 416:
+                # 既存の.partが不正（サーバー側のファイルが変わった等）なので最初からやり直す
+                response.close()
+                os.remove(part_path)
+                offset = 0
+                response = self.open(file_id)
+
+            response.raise_for_status()
+
+            if output_path is None:
+                file_name = parse_content_disposition(response.headers.get('Content-Disposition', '')) or file_id
+                output_path = self._claim_path(dest_dir, file_name, file_id, owner_of)
+
+            if response.status_code == 206:
+                start, total = parse_content_range(response.headers.get('Content-Range'))
+                if start != offset:
+                    raise RuntimeError(f"再開位置が一致しません（要求: {offset}, 応答: {start}）")
+                mode = 'ab'
+            else:
+                # Rangeに対応していない応答の場合は最初から書き直す
+                offset = 0
+                length = response.headers.get('Content-Length')
+                total = int(length) if length and length.isdigit() else None
+                mode = 'wb'
+
+            if tee is not None:
+                tee.start(os.path.basename(output_path), total)
+
+            # 続きから受信する場合は、受信済みの部分をハッシュ（とtee）に含める
+            digest = hashlib.sha256()
+            if mode == 'ab':
+                with open(part_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        digest.update(chunk)
+                        if tee is not None:
+                            tee.write(chunk)
+
+            # 大きめの固定サイズのチャンクで逐次書き込む（書き込みながらハッシュを計算する）
+            written = offset
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+                        if tee is not None:
+                            tee.write(chunk)
+                        written += len(chunk)
+                        if stats is not None:
+                            stats.setdefault('ttfb_seconds', time.perf_counter() - started)
+                            stats['bytes'] = stats.get('bytes', 0) + len(chunk)
+        finally:
+            response.close()
+
+        if total is not None and written != total:
+            raise requests.exceptions.ChunkedEncodingError(
+                f"受信サイズが一致しません（{written}/{total}バイト）"
+            )
+
+        return output_path, digest.hexdigest()
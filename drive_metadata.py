@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 取得したメタデータを再利用する期間（秒）
+# 共有ファイルの名前や内容が変わることは少ないので、1日は問い合わせ直さない
+DEFAULT_METADATA_TTL = 24 * 60 * 60
+# まとめて問い合わせるときの同時リクエスト数の上限（ダウンローダーの接続プールより小さくしておく）
+DEFAULT_METADATA_WORKERS = 8
+
+
+class DriveMetadata:
+    """ファイルIDごとの(ファイル名, サイズ, MIMEタイプ)を問い合わせ、有効期限付きでキャッシュする
+
+    問い合わせはfetch（ファイルIDを受け取り(ファイル名, サイズ, MIMEタイプ)を返す関数）で行う。
+    取得した値はこの実行中はメモリ上に、storeがあれば（DownloadCache）実行をまたいでSQLiteにも保存する。
+    同じファイルIDを複数のスレッドが同時に問い合わせた場合も、通信は1回だけ行う。
+    問い合わせに失敗した場合はキャッシュせず、例外をそのまま送出する。
+    """
+
+    def __init__(self, fetch, store=None, ttl=DEFAULT_METADATA_TTL, refresh=False):
+        self.fetch = fetch
+        self.store = store
+        self.ttl = ttl
+        # Trueの場合は保存済みのメタデータを使わずに問い合わせ直す（この実行中に取得したものは使う）
+        self.refresh = refresh
+        self.requests = 0  # 実際に問い合わせた回数
+        self._entries = {}  # ファイルID -> (取得日時, (ファイル名, サイズ, MIMEタイプ))
+        self._pending = {}  # 問い合わせ中のファイルID -> threading.Event
+        self._lock = threading.Lock()
+
+    def cached(self, file_id):
+        """有効期限内のメタデータを返す（なければNone、通信はしない）"""
+        with self._lock:
+            entry = self._entries.get(file_id)
+        if entry is None and self.store is not None and not self.refresh:
+            row = self.store.get_metadata(file_id)
+            if row:
+                entry = (row[3], tuple(row[:3]))
+                with self._lock:
+                    self._entries.setdefault(file_id, entry)
+        if entry and time.time() - entry[0] <= self.ttl:
+            return entry[1]
+        return None
+
+    def put(self, file_id, file_name, size, mime_type):
+        """ダウンロードなど、別の処理で分かったメタデータを登録する"""
+        metadata = (file_name, size, mime_type)
+        with self._lock:
+            self._entries[file_id] = (time.time(), metadata)
+        if self.store is not None:
+            self.store.put_metadata(file_id, *metadata)
+        return metadata
+
+    def get(self, file_id):
+        """メタデータを返す（キャッシュになければ問い合わせる）"""
+        while True:
+            metadata = self.cached(file_id)
+            if metadata is not None:
+                return metadata
+            with self._lock:
+                event = self._pending.get(file_id)
+                if event is None:
+                    event = self._pending[file_id] = threading.Event()
+                    break
+            # 他のスレッドの問い合わせが終わるのを待ち、その結果を使う（失敗していれば自分で問い合わせる）
+            event.wait()
+
+        try:
+            file_name, size, mime_type = self.fetch(file_id)
+            with self._lock:
+                self.requests += 1
+            return self.put(file_id, file_name, size, mime_type)
+        finally:
+            with self._lock:
+                del self._pending[file_id]
+            event.set()
+
+    def resolve_many(self, file_ids, max_workers=DEFAULT_METADATA_WORKERS):
+        """複数のファイルIDのメタデータをまとめて取得する
+
+        キャッシュにないものだけを、最大max_workers件ずつ並列に問い合わせる（同じファイルIDは1回だけ）。
+
+        Returns:
+            {ファイルID: (ファイル名, サイズ, MIMEタイプ)}（取得できなかったファイルは含まない）
+        """
+        results = {}
+        missing = []
+        for file_id in dict.fromkeys(file_ids):
+            metadata = self.cached(file_id)
+            if metadata is not None:
+                results[file_id] = metadata
+            else:
+                missing.append(file_id)
+        if not missing:
+            return results
+
+        def fetch(file_id):
+            try:
+                return file_id, self.get(file_id)
+            except Exception as e:
+                print(f"ファイルの情報を取得できませんでした: {file_id}: {str(e)}")
+                return file_id, None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as pool:
+            for file_id, metadata in pool.map(fetch, missing):
+                if metadata is not None:
+                    results[file_id] = metadata
+        return results
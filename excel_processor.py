@@ -1,24 +1,97 @@
-from openpyxl import load_workbook
-from openpyxl.worksheet.hyperlink import Hyperlink
+import os
+import zipfile
 import utils
+import xlsx_reader
+
+# openpyxl・polars（xlsx_writer）は読み込みに時間がかかるため、使う処理の中でインポートする
+# （シート名の一覧を表示するだけなら読み込まない）
+
+RESULTS_SHEET_NAME = 'results'
+RESULTS_COLUMN_WIDTH = 20
+
+# 保存の方法
+SAVE_WORKBOOK = 'workbook'  # openpyxlでワークブック全体を読み込み、全体を書き出す
+SAVE_PATCH = 'patch'  # 変更したシートのXMLだけを書き換え、他のパーツはそのままコピーする
+SAVE_MODES = {
+    SAVE_WORKBOOK: "ワークブック全体を保存",
+    SAVE_PATCH: "変更したセルだけ書き換える",
+}
+DEFAULT_SAVE_MODE = SAVE_WORKBOOK
 
 
 class ExcelProcessor:
-    def __init__(self, excel_file_path):
+    def __init__(self, excel_file_path, save_mode=DEFAULT_SAVE_MODE):
         self.excel_file_path = excel_file_path
+        # SAVE_PATCHの場合はワークブック全体を読み込まず、セルの変更を保存時にシートのXMLへ直接書き込む
+        # （形式が想定外で書き込めない場合は、その時点でSAVE_WORKBOOKに切り替える）
+        self.save_mode = save_mode
         self.workbook = None
         self.sheets = []
+        self._workbook_signature = None  # 読み込んだ時点のファイルのサイズと更新日時
+        self._sheets_signature = None
+        self._results_df = None  # resultsシートに書き込むデータ（save_excel()で書き出す）
+        self._patches = {}  # SAVE_PATCHで保存していないセルの変更 {シート名: {行番号: (ファイル名, URL, 再生時間)}}
+
+    def file_signature(self):
+        """ディスク上のファイルが変更されたかを判定するための(サイズ, 更新日時)"""
+        stat = os.stat(self.excel_file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def is_workbook_current(self):
+        """読み込み済みのワークブックがディスク上のファイルと同じ内容かどうか"""
+        if self.workbook is None:
+            return False
+        try:
+            return self._workbook_signature == self.file_signature()
+        except OSError:
+            return False
+
+    def load_sheet_names(self):
+        """ワークブック全体を読み込まず、xlsx内のブック定義（workbook.xml）だけからシート名を取得する"""
+        try:
+            # ファイルが開かれているかチェック
+            if utils.is_excel_file_open(self.excel_file_path):
+                return False, "Excelファイルが開かれています。閉じてから処理を実行してください。"
+
+            signature = self.file_signature()
+            if self._sheets_signature == signature:
+                return True, None
+
+            with zipfile.ZipFile(self.excel_file_path) as zf:
+                self.sheets = [name for name, _ in xlsx_reader.read_sheet_parts(zf)]
+            self._sheets_signature = signature
+            return True, None
+        except Exception as e:
+            return False, f"Excelファイル読み込みエラー: {str(e)}"
 
     def load_excel(self):
-        """Excelファイルを読み込み、シート情報を取得する"""
+        """Excelファイルを読み込み、シート情報を取得する
+
+        読み込み済みでディスク上のファイルが変更されていなければ、読み込み直さずに再利用する。
+        SAVE_PATCHの場合は、シート名の一覧だけを読み込む。
+        """
+        if self.save_mode == SAVE_PATCH:
+            self._patches = {}
+            self._results_df = None
+            return self.load_sheet_names()
+
         try:
             # ファイルが開かれているかチェック
             if utils.is_excel_file_open(self.excel_file_path):
                 return False, "Excelファイルが開かれています。閉じてから処理を実行してください。"
 
+            if self.is_workbook_current():
+                return True, None
+
             # Excelファイルを読み込む
+            from openpyxl import load_workbook
+
+            signature = self.file_signature()
             self.workbook = load_workbook(self.excel_file_path)
+            self._results_df = None
             self.sheets = self.workbook.sheetnames
+            self._workbook_signature = signature
+            self._sheets_signature = signature
             return True, None
         except Exception as e:
             return False, f"Excelファイル読み込みエラー: {str(e)}"
@@ -44,9 +117,8 @@ class ExcelProcessor:
                         cell_j = row[9]  # J列（インデックスは0から始まるので9）
                         cell_value = cell_j.value
 
-                        # L列の値をチェック
-                        cell_l = row[11]
-                        cell_l_value = cell_l.value
+                        # L列の値をチェック（L列まで存在しない行は空とみなす）
+                        cell_l_value = row[11].value if len(row) >= 12 else None
                         if check_l_column and cell_l_value:
                             continue  # L列に値がある場合はスキップ
 
@@ -67,8 +139,33 @@ class ExcelProcessor:
 
         return links_data
 
+    def scan_links(self, target_sheets, check_l_column=True):
+        """ワークブック全体を読み込まずに、J列とL列だけを逐次読み取ってリンクを収集する
+
+        get_links_from_sheetsと同じ形式のリストを返す。load_excel()の前に呼び出せる。
+
+        Returns:
+            (リンク情報のリスト, エラーメッセージ)
+        """
+        try:
+            # ファイルが開かれているかチェック
+            if utils.is_excel_file_open(self.excel_file_path):
+                return [], "Excelファイルが開かれています。閉じてから処理を実行してください。"
+
+            return xlsx_reader.scan_links(self.excel_file_path, target_sheets, check_l_column), None
+        except Exception as e:
+            return [], f"Excelファイル読み込みエラー: {str(e)}"
+
     def update_cell_with_hyperlink(self, sheet_name, row_num, file_name, url, duration=None):
-        """セルをハイパーリンク付きテキストに更新する"""
+        """セルをハイパーリンク付きテキストに更新する（SAVE_PATCHの場合は保存時に書き込む）"""
+        if self.save_mode == SAVE_PATCH:
+            self._patches.setdefault(sheet_name, {})[row_num] = (file_name, url, duration)
+            return
+        self._update_workbook_cell(sheet_name, row_num, file_name, url, duration)
+
+    def _update_workbook_cell(self, sheet_name, row_num, file_name, url, duration):
+        from openpyxl.worksheet.hyperlink import Hyperlink
+
         sheet = self.workbook[sheet_name]
         cell = sheet.cell(row=row_num, column=10)  # J列
 
@@ -83,71 +180,118 @@ class ExcelProcessor:
             duration_cell.value = duration
 
     def save_results_to_sheet(self, results_df):
-        """結果を新しいシートに保存する"""
-        if not results_df.empty:
-            # 既存のresultsシートを削除（存在する場合）
-            if 'results' in self.workbook.sheetnames:
-                del self.workbook['results']
-
-            # 新しいresultsシートを作成
-            results_sheet = self.workbook.create_sheet('results')
-
-            # ヘッダーを設定
-            headers = results_df.columns.tolist()
-            for col_idx, header in enumerate(headers, 1):
-                results_sheet.cell(row=1, column=col_idx).value = header
-
-            # データを書き込み
-            for row_idx, row in enumerate(results_df.itertuples(), 2):
-                for col_idx, value in enumerate(row[1:], 1):
-                    results_sheet.cell(row=row_idx, column=col_idx).value = value
-
-            # 列幅を自動調整（簡易的な実装）
-            for col_idx in range(1, len(headers) + 1):
-                results_sheet.column_dimensions[chr(64 + col_idx)].width = 20
+        """結果を新しいシートに保存する（save_resultsと同じ一括書き込みを使う）"""
+        if not results_df.is_empty():
+            self.save_results(results_df)
 
     def save_excel(self):
-        """Excelファイルを保存する"""
+        """Excelファイルを保存する
+
+        resultsシートの行データはopenpyxlのセルを通さず、保存の中でXMLとして直接書き込む。
+        SAVE_PATCHの場合は、変更したシートのパーツだけを書き換える。
+        """
         try:
-            self.workbook.save(self.excel_file_path)
+            if self.save_mode == SAVE_PATCH:
+                self._save_patch()
+            else:
+                self._save_workbook()
             return True, None
         except Exception as e:
+            # メモリ上の変更がディスクに反映されていないので、次回は読み込み直す
+            self._workbook_signature = None
             return False, f"Excelファイル保存エラー: {str(e)}"
 
+    def _save_workbook(self):
+        if self._results_df is not None and RESULTS_SHEET_NAME in self.workbook.sheetnames:
+            import xlsx_writer
+
+            pl_df = self._results_df
+            xlsx_writer.save_workbook(self.workbook, self.excel_file_path, {
+                RESULTS_SHEET_NAME: lambda f: xlsx_writer.write_sheet_xml(f, pl_df, column_width=RESULTS_COLUMN_WIDTH)
+            })
+        else:
+            self.workbook.save(self.excel_file_path)
+        # 保存した内容はメモリ上のワークブックと同じなので、次回の実行でも再利用できる
+        self._workbook_signature = self.file_signature()
+        self._sheets_signature = self._workbook_signature
+
+    def _save_patch(self):
+        """セルの変更とresultsシートを、xlsx内の該当するパーツだけを書き換えて保存する"""
+        import xlsx_patch
+        import xlsx_writer
+
+        sheet_writers = {}
+        if self._results_df is not None:
+            pl_df = self._results_df
+            sheet_writers[RESULTS_SHEET_NAME] = (
+                lambda f: xlsx_writer.write_sheet_xml(f, pl_df, column_width=RESULTS_COLUMN_WIDTH)
+            )
+        try:
+            xlsx_patch.patch_workbook(self.excel_file_path, self._patches, sheet_writers)
+        except xlsx_patch.PatchUnsupported as e:
+            print(f"変更したセルだけを書き換えられないため、ワークブック全体を保存します: {str(e)}")
+            self._switch_to_workbook()
+            self.save_mode = SAVE_WORKBOOK
+            self._save_workbook()
+            return
+
+        self._patches = {}
+        self._results_df = None
+        if sheet_writers and RESULTS_SHEET_NAME not in self.sheets:
+            self.sheets = self.sheets + [RESULTS_SHEET_NAME]
+        # ディスク上のファイルが変わったので、読み込み済みのワークブックは使わない
+        self._workbook_signature = None
+        self._sheets_signature = self.file_signature()
+
+    def _switch_to_workbook(self):
+        """ワークブック全体を読み込み、保存していないセルの変更とresultsシートを反映する"""
+        from openpyxl import load_workbook
+
+        signature = self.file_signature()
+        self.workbook = load_workbook(self.excel_file_path)
+        self.sheets = self.workbook.sheetnames
+        self._workbook_signature = signature
+        self._sheets_signature = signature
+        for sheet_name, rows in self._patches.items():
+            for row_num, (file_name, url, duration) in rows.items():
+                self._update_workbook_cell(sheet_name, row_num, file_name, url, duration)
+        self._patches = {}
+        if self._results_df is not None:
+            self._reset_results_sheet()
+
     def save_results(self, pl_df):
-        """Polarsを使用して結果をresultsシートに保存する"""
+        """Polarsのデータフレームをresultsシートに保存する
+
+        セルは作らず、データフレームを保持しておき、save_excel()でシートのXMLとして一括で書き出す。
+        """
         try:
-            # resultsシートの取得または作成
-            if 'results' in self.workbook.sheetnames:
-                # 既存のシートを取得
-                results_sheet = self.workbook['results']
-                print("既存のresultsシートを上書きします")
+            if self.save_mode == SAVE_PATCH:
+                if RESULTS_SHEET_NAME in self.sheets:
+                    print("既存のresultsシートを上書きします")
+                else:
+                    print("新しいresultsシートを作成しました")
             else:
-                # 新しいシートを作成
-                results_sheet = self.workbook.create_sheet('results')
-                print("新しいresultsシートを作成しました")
-
-            # ヘッダーを設定
-            headers = pl_df.columns
-            for col_idx, header in enumerate(headers, 1):
-                results_sheet.cell(row=1, column=col_idx).value = header
-
-            # Polarsデータフレームをリストに変換して一気に書き込み
-            data_rows = pl_df.rows()
-            for row_idx, row_data in enumerate(data_rows, 2):
-                for col_idx, value in enumerate(row_data, 1):
-                    results_sheet.cell(row=row_idx, column=col_idx).value = value
-
-            # 列幅を自動調整
-            for col_idx in range(1, len(headers) + 1):
-                results_sheet.column_dimensions[chr(64 + col_idx)].width = 20
-
-            print(f"{len(data_rows)}行のデータを書き込みました")
+                self._reset_results_sheet()
+
+            self._results_df = pl_df
+            print(f"{pl_df.height}行のデータを書き込みました")
             return True, None
         except Exception as e:
             print(f"結果シート作成エラー: {str(e)}")
             return False, f"結果保存エラー: {str(e)}"
 
+    def _reset_results_sheet(self):
+        """ワークブックのresultsシートを空にする（なければ作る）"""
+        if RESULTS_SHEET_NAME in self.workbook.sheetnames:
+            # 前回の行が残らないように、同じ位置に空のシートを作り直す
+            index = self.workbook.sheetnames.index(RESULTS_SHEET_NAME)
+            del self.workbook[RESULTS_SHEET_NAME]
+            self.workbook.create_sheet(RESULTS_SHEET_NAME, index)
+            print("既存のresultsシートを上書きします")
+        else:
+            self.workbook.create_sheet(RESULTS_SHEET_NAME)
+            print("新しいresultsシートを作成しました")
+
     def open_excel(self):
         """処理後にExcelファイルを開く"""
         utils.open_excel_file(self.excel_file_path)
@@ -1,20 +1,95 @@
+import mimetypes
 import os
 import re
-import gdown
-from mutagen.mp3 import MP3
-from mutagen.mp4 import MP4
-import polars as pl
-import requests
-import urllib.parse
-import shutil
-import glob
+import threading
+import time
+
+from audio_probe import BlockReader, ProbeError, StreamingProbe, file_duration, probe_duration, sniff_kind
+from download_cache import DownloadCache
+from drive_metadata import DEFAULT_METADATA_TTL, DriveMetadata
+from result_table import ResultTable
+from retry_policy import RetryPolicy
+
+# mutagen・polars・requests（downloader）は読み込みに時間がかかるため、使う処理の中でインポートする
+# （起動時や、分析用プロセスの起動時に余計なライブラリを読み込まないため）
+
+
+def format_duration(duration):
+    """秒数を分:秒形式の文字列に変換する"""
+    mins = int(duration // 60)
+    secs = int(duration % 60)
+    return f"{mins:02d}:{secs:02d}"
+
+
+def read_duration(file_path):
+    """音声ファイルの再生時間（秒）を返す（m4a/mp3以外はNone）
+
+    まずメモリマップしたファイルのヘッダー部分だけを読んで求め（audio_probe.file_duration）、
+    確実に判定できない場合だけmutagenで解析する。
+    プロセスプールからも呼び出せるよう、モジュールレベルの関数にしている。
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext in ('.mp3', '.m4a'):
+        try:
+            return file_duration(file_path, file_ext[1:])
+        except ProbeError:
+            pass
+
+    # ファイル形式に応じて適切なライブラリで分析
+    if file_ext == '.mp3':
+        from mutagen.mp3 import MP3
+        return MP3(file_path).info.length  # 秒単位
+    if file_ext == '.m4a':
+        from mutagen.mp4 import MP4
+        return MP4(file_path).info.length  # 秒単位
+    return None
+
+
+def timed_read_duration(file_path):
+    """read_durationの結果と、分析にかかった時間（秒）を返す（プロセスプール用）"""
+    started = time.perf_counter()
+    duration = read_duration(file_path)
+    return duration, time.perf_counter() - started
 
 
 class FileProcessor:
-    def __init__(self, download_dir):
+    def __init__(self, download_dir, downloader=None, use_cache=True, force_refresh=False, retry_policy=None,
+                 metadata_ttl=DEFAULT_METADATA_TTL):
         self.download_dir = download_dir
-        self.file_info = {}  # ダウンロードした音声ファイルの情報を保持する辞書
-        self.sheet_row_map = {}  # シート名と行番号のマッピング
+        # 全ダウンロードで共有する接続プール付きのダウンローダー
+        # 渡されたダウンローダーは呼び出し側が閉じる（closeで閉じるのは自分で作成したものだけ）
+        self._owns_downloader = downloader is None
+        if downloader is None:
+            from downloader import GDriveDownloader
+            downloader = GDriveDownloader()
+        self.downloader = downloader
+        # 実行をまたいで再利用するダウンロードキャッシュ（ファイルIDごと）
+        self.cache = DownloadCache(download_dir) if use_cache else None
+        self.force_refresh = force_refresh  # Trueの場合はキャッシュを無視して再ダウンロードする
+        # ダウンロードせずに取得したファイル名・サイズ・MIMEタイプ（ファイルIDごとに有効期限付きで再利用する）
+        self.metadata = DriveMetadata(
+            self._fetch_remote_metadata, store=self.cache, ttl=metadata_ttl, refresh=force_refresh
+        )
+        # ダウンロードした音声ファイルの情報（(シート名, 行番号)をキーにした辞書のように参照できる列形式の表）
+        self.file_info = ResultTable()
+        self.content_hashes = {}  # ファイルID -> 内容のSHA-256（ダウンロード時に計算したもの）
+        self.metrics = None  # 計測値の記録先（RunMetrics、Noneの場合は記録しない）
+        # 429・5xxなどの一時的な失敗の再試行方法と、同時ダウンロード数の調整（AdaptiveLimiter、Noneの場合は調整しない）
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.limiter = None
+        self._lock = threading.Lock()  # 並列ダウンロード時の共有辞書の保護用
+
+    def close(self):
+        """キャッシュのSQLite接続と、自分で作成したダウンローダーの接続プールを閉じる
+
+        ダウンロード結果（file_info）は閉じた後も参照できる。
+        """
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+            self.metadata.store = None
+        if self._owns_downloader:
+            self.downloader.close()
 
     def extract_file_id(self, url):
         """Google Driveの共有URLからファイルIDを抽出する"""
@@ -24,162 +99,285 @@ class FileProcessor:
             return match.group(1)
         return None
 
+    def group_links_by_file_id(self, links_data):
+        """リンクをファイルIDごとにまとめる（同じファイルは1回だけダウンロードするため）
+
+        出現順を保ったグループのリストを返す。ファイルIDを抽出できないURLは
+        それぞれ単独のグループとなる。
+        """
+        groups = {}
+        for link_info in links_data:
+            file_id = self.extract_file_id(link_info['url'])
+            key = file_id if file_id else ('invalid', link_info['sheet_name'], link_info['row_num'])
+            groups.setdefault(key, []).append(link_info)
+        return list(groups.values())
+
+    def share_file_info(self, file_path, sheet_name, row_num, targets):
+        """1回のダウンロード結果を、同じファイルを参照する他の行にも反映する
+
+        Args:
+            file_path: ダウンロード済みファイルのパス
+            sheet_name, row_num: 実際にダウンロード・分析を行った行
+            targets: 結果を共有する(シート名, 行番号)のリスト
+        """
+        with self._lock:
+            file_index = self.file_info.file_index(sheet_name, row_num)
+            if file_index is None:
+                return
+            for target_sheet, target_row in targets:
+                self.file_info.set_row(target_sheet, target_row, file_index)
+
+    @property
+    def sheet_row_map(self):
+        """ファイルパス（保存しない場合はファイル名）と、そのファイルを参照する(シート名, 行番号)のリストの対応"""
+        with self._lock:
+            return self.file_info.rows_by_file()
+
     def get_gdrive_filename(self, file_id):
         """Googleドライブからファイル名を取得する"""
-        url = f"https://drive.google.com/uc?export=download&id={file_id}"
-        session = requests.Session()
-        response = session.get(url, stream=True)
-        cd = response.headers.get('Content-Disposition', '')
-        print(f"Content-Disposition: {cd}")  # デバッグ出力
-
-        # UTF-8エンコードされたfilename*を探す
-        filename_star = re.search(r'filename\*=UTF-8\'\'([^;]+)', cd)
-        if filename_star:
-            try:
-                # URLデコードして返す
-                decoded = urllib.parse.unquote(filename_star.group(1))
-                print(f"Decoded filename*: {decoded}")
-                return decoded
-            except Exception as e:
-                print(f"Decoding error: {e}")
-
-        # 通常のfilename
-        filename = re.search(r'filename="([^"]+)"', cd)
-        if filename:
-            try:
-                decoded = filename.group(1)
-                print(f"Decoded filename: {decoded}")
-                return decoded
-            except Exception as e:
-                print(f"Decoding error: {e}")
-
-        # 両方見つからない場合はfile_idを返す
-        return file_id
+        file_name, _, _ = self.fetch_metadata(file_id)
+        # 見つからない場合はfile_idを返す
+        return file_name or file_id
 
-    def download_with_requests(self, file_id, output_path):
-        """requestsを使用してGoogle Driveからファイルをダウンロードする"""
-        url = f"https://drive.google.com/uc?export=download&id={file_id}"
-        session = requests.Session()
+    def fetch_metadata(self, file_id):
+        """ダウンロードせずに(ファイル名, サイズ, MIMEタイプ)を取得する（分からない項目はNone）
 
-        # 初回リクエスト - 大きいファイルの場合は確認ページが表示される
-        response = session.get(url, stream=True)
+        ダウンロード済みのファイルがあれば、通信せずにローカルのファイルから求める。
+        それ以外は有効期限内に取得したメタデータを使い、なければファイルごとに1回だけ問い合わせる。
+        """
+        local = self._local_metadata(file_id)
+        if local:
+            return local
+        return self.metadata.get(file_id)
 
-        # 確認トークンを取得（大きいファイルの場合）
-        token = None
-        for key, value in response.cookies.items():
-            if key.startswith('download_warning'):
-                token = value
-                break
+    def resolve_metadata(self, file_ids, max_workers):
+        """複数のファイルのメタデータをまとめて取得する（fetch_metadataを参照）
 
-        if token:
-            # 確認トークンがある場合は、それを使って再リクエスト
-            url = f"{url}&confirm={token}"
-            response = session.get(url, stream=True)
+        Returns:
+            {ファイルID: (ファイル名, サイズ, MIMEタイプ)}（取得できなかったファイルは含まない）
+        """
+        results = {}
+        remote_ids = []
+        for file_id in file_ids:
+            local = self._local_metadata(file_id)
+            if local:
+                results[file_id] = local
+            else:
+                remote_ids.append(file_id)
+        results.update(self.metadata.resolve_many(remote_ids, max_workers))
+        return results
 
-        # ファイルに保存
-        with open(output_path, 'wb') as f:
-            shutil.copyfileobj(response.raw, f)
+    def _local_metadata(self, file_id):
+        """ダウンロード済みのファイルから(ファイル名, サイズ, MIMEタイプ)を求める（なければNone）"""
+        cached = self.cache.get(file_id) if self.cache and not self.force_refresh else None
+        if not cached:
+            return None
+        file_path = cached['file_path']
+        return os.path.basename(file_path), os.path.getsize(file_path), mimetypes.guess_type(file_path)[0]
 
-        return output_path
+    def _fetch_remote_metadata(self, file_id):
+        """先頭1バイトの範囲取得でメタデータを問い合わせる（DriveMetadataから呼ばれる）"""
+        return self._call_with_retry(file_id, lambda: self.downloader.fetch_metadata(file_id))
 
-    def download_file(self, url, sheet_name, row_num):
-        """Googleドライブからファイルをダウンロードしてローカルストレージに保存"""
+    def download_with_requests(self, file_id, output_path):
+        """requestsを使用してGoogle Driveからファイルをダウンロードする"""
+        return self.downloader.download(file_id, output_path=output_path)
+
+    def fetch_file(self, url):
+        """ダウンロードだけを行い、分析はしない（パイプラインの1段目）
+
+        ダウンロード中に受信したデータからも再生時間を求める（StreamingProbe）。
+        求められた場合は、保存後にファイルを読み直して解析する必要はない。
+
+        Returns:
+            (ファイルID, ファイルパス, キャッシュ済みまたはダウンロード中に求めた再生時間（秒）またはNone, エラーメッセージ)
+        """
         file_id = self.extract_file_id(url)
         if not file_id:
-            return None, f"無効なURL: {url}"
+            return None, None, None, f"無効なURL: {url}"
 
         try:
             os.makedirs(self.download_dir, exist_ok=True)
 
-            # ダウンロード前のm4a/mp3ファイル一覧を取得
-            before_files = set(glob.glob("*.m4a") + glob.glob("*.mp3"))
+            # キャッシュに有効なファイルがあればダウンロードしない
+            cached = self.cache.get(file_id) if self.cache else None
 
-            # gdownでダウンロード（output指定なし）
-            output_file = gdown.download(
-                # f"https://drive.google.com/uc?id={file_id}",
-                url,
-                quiet=False,
-                fuzzy=True
-            )
-            print(f"gdownダウンロード結果: {output_file}")
-
-            # ダウンロード後のm4a/mp3ファイル一覧を取得
-            after_files = set(glob.glob("*.m4a") + glob.glob("*.mp3"))
-            new_files = after_files - before_files
-
-            if new_files:
-                downloaded_file = list(new_files)[0]
-                # 保存先ディレクトリに移動
-                dest_path = os.path.join(self.download_dir, os.path.basename(downloaded_file))
-                shutil.move(downloaded_file, dest_path)
-                file_path = dest_path
-                file_name = os.path.basename(file_path)
-                print(f"保存されたファイル名: {file_name}")
-
-                # シート名と行番号の情報を保存
-                if file_path not in self.sheet_row_map:
-                    self.sheet_row_map[file_path] = []
-                self.sheet_row_map[file_path].append((sheet_name, row_num))
-
-                # m4aまたはmp3ファイルの場合は分析を実行
-                if os.path.splitext(file_name)[1].lower() in ('.m4a', '.mp3'):
-                    self.analyze_audio_file(file_path, sheet_name, row_num)
-
-                return file_path, None
+            if cached and not self.force_refresh:
+                output_file = cached['file_path']
+                cached_duration = cached['duration']
+                content_hash = cached['content_hash']
+                print(f"キャッシュを使用: {output_file}")
+                self.record_metrics(file_id, file_name=os.path.basename(output_file), cached=True)
             else:
-                return None, "ダウンロード失敗"
+                # 共有セッションで保存先ディレクトリ内のステージング領域にダウンロードし、完了後にリネームする
+                # 再ダウンロードの場合は以前のファイルを置き換える
+                stats = {}
+                probe = StreamingProbe()
+                output_file, content_hash = self._call_with_retry(
+                    file_id,
+                    lambda: self.downloader.download_with_hash(
+                        file_id, self.download_dir, output_path=cached['file_path'] if cached else None, stats=stats,
+                        tee=probe, owner_of=self.cache.owner_of if self.cache else None
+                    )
+                )
+                cached_duration = probe.duration
+                print(f"ダウンロード結果: {output_file}")
+                self.record_metrics(file_id, file_name=os.path.basename(output_file), cached=False, **stats)
+                if cached_duration is not None:
+                    self.record_metrics(file_id, analysis_seconds=probe.seconds, streamed=True)
+                if self.cache:
+                    # 別のファイルIDで同じ内容のファイルを保存済みなら、ディスク上では1つにまとめる
+                    existing = self.cache.find_by_hash(content_hash, exclude_file_id=file_id)
+                    if existing:
+                        output_file = self.cache.link_duplicate(output_file, existing)
+                        print(f"同じ内容のファイルがあるため1つにまとめました: {output_file} ({os.path.basename(existing)})")
+                    self.cache.put(file_id, output_file, content_hash=content_hash)
+
+            with self._lock:
+                self.content_hashes[file_id] = content_hash
+
+            if output_file and os.path.splitext(output_file)[1].lower() in ('.m4a', '.mp3'):
+                print(f"保存されたファイル名: {os.path.basename(output_file)}")
+                return file_id, output_file, cached_duration, None
+            else:
+                return file_id, None, None, "ダウンロード失敗"
 
         except Exception as e:
             print(f"ダウンロードエラー: {str(e)}")
-            return None, f"エラー: {str(e)}"
+            return file_id, None, None, f"エラー: {str(e)}"
 
-    def analyze_audio_file(self, file_path, sheet_name, row_num):
-        """音声ファイルを分析し、再生時間などの情報を取得"""
-        file_name = os.path.basename(file_path)
-        file_ext = os.path.splitext(file_name)[1].lower()
+    def download_file(self, url, sheet_name, row_num):
+        """Googleドライブからファイルをダウンロードしてローカルストレージに保存"""
+        file_id, file_path, duration, error = self.fetch_file(url)
+        if not file_path:
+            return None, error
+
+        if duration is not None:
+            # キャッシュ済み、またはダウンロード中に求めた再生時間を使う
+            self.register_file(file_id, file_path, sheet_name, row_num, duration)
+        else:
+            # m4aまたはmp3ファイルの場合は分析を実行
+            self.analyze_audio_file(file_path, sheet_name, row_num, file_id=file_id)
+        return file_path, None
 
+    def analyze_audio_file(self, file_path, sheet_name, row_num, file_id=None):
+        """音声ファイルを分析し、再生時間などの情報を取得
+
+        file_idが指定され、キャッシュに再生時間が保存されていれば再解析しない。
+        """
         try:
-            # ファイル形式に応じて適切なライブラリで分析
-            if file_ext == '.mp3':
-                audio = MP3(file_path)
-                duration = audio.info.length  # 秒単位
-            elif file_ext == '.m4a':
-                audio = MP4(file_path)
-                duration = audio.info.length  # 秒単位
-            else:
-                return
+            duration = None
+            if file_id and self.cache and not self.force_refresh:
+                cached = self.cache.get(file_id)
+                if cached and cached['file_path'] == file_path:
+                    duration = cached['duration']
+
+            if duration is None:
+                duration = read_duration(file_path)
+                if duration is None:
+                    return
 
-            # 秒数から分:秒形式の文字列に変換
-            mins = int(duration // 60)
-            secs = int(duration % 60)
-            duration_str = f"{mins:02d}:{secs:02d}"
-
-            # ファイル情報を辞書に格納
-            key = (sheet_name, row_num)
-            self.file_info[key] = {
-                'file_name': file_name,
-                'file_path': file_path,
-                'duration': duration_str,
-                'sheet_name': sheet_name,
-                'row_num': row_num
-            }
+            self.register_file(file_id, file_path, sheet_name, row_num, duration)
 
         except Exception as e:
             print(f"音声ファイル分析エラー: {str(e)}")
 
+    def register_file(self, file_id, file_path, sheet_name, row_num, duration):
+        """分析済みのファイルを行に紐付けて記録する（再生時間はキャッシュにも保存する）"""
+        if file_id and self.cache and duration is not None:
+            self.cache.set_duration(file_id, duration)
+        with self._lock:
+            content_hash = self.content_hashes.get(file_id)
+        self._record_file_info(sheet_name, row_num, os.path.basename(file_path), file_path, duration, content_hash)
+
+    def probe_file(self, url, sheet_name, row_num):
+        """ファイル全体をダウンロードせず、ヘッダー部分だけを範囲取得して再生時間を求める（再生時間のみモード）
+
+        ヘッダーから求められない場合や、サーバーが範囲取得に対応していない（全体サイズが分からない）場合は、
+        通常のダウンロードにフォールバックする。
+
+        Returns:
+            (ファイル名またはファイルパス, エラーメッセージ)
+        """
+        from downloader import PartialReadUnsupported
+
+        file_id = self.extract_file_id(url)
+        if not file_id:
+            return None, f"無効なURL: {url}"
+
+        # ダウンロード済みのファイルがあればそれを使う
+        if self.cache and not self.force_refresh and self.cache.get(file_id):
+            return self.download_file(url, sheet_name, row_num)
+
+        try:
+            started = time.perf_counter()
+            remote = self._call_with_retry(file_id, lambda: self.downloader.open_remote(file_id))
+            metadata_seconds = time.perf_counter() - started
+            # 範囲取得で分かったメタデータは、次回以降の見積もりやファイル名の取得で使う
+            self.metadata.put(file_id, remote.file_name, remote.size, remote.mime_type)
+            file_name = remote.file_name or file_id
+            kind = sniff_kind(remote.head, file_name)
+            if os.path.splitext(file_name)[1].lower() not in ('.m4a', '.mp3') or kind is None:
+                return None, "ダウンロード失敗"
+
+            reader = BlockReader(remote.read_at, remote.size, head=remote.head)
+            duration = probe_duration(reader.read_at, remote.size, kind)
+            self.record_metrics(
+                file_id, file_name=file_name, cached=False, metadata_seconds=metadata_seconds,
+                analysis_seconds=time.perf_counter() - started - metadata_seconds
+            )
+        except ProbeError as e:
+            print(f"ヘッダーから再生時間を取得できませんでした。ファイル全体をダウンロードします: {str(e)}")
+            return self.download_file(url, sheet_name, row_num)
+        except PartialReadUnsupported as e:
+            print(f"ファイルの一部だけを取得できないため、ファイル全体をダウンロードします: {str(e)}")
+            return self.download_file(url, sheet_name, row_num)
+        except Exception as e:
+            print(f"ダウンロードエラー: {str(e)}")
+            return None, f"エラー: {str(e)}"
+
+        print(f"ヘッダーから再生時間を取得: {file_name}")
+        # ローカルには保存しないのでファイルパスは空にする
+        self._record_file_info(sheet_name, row_num, file_name, '', duration)
+        return file_name, None
+
+    def _call_with_retry(self, file_id, func):
+        """再試行できる失敗（429・5xx・接続エラーなど）は、待ってから再試行する"""
+        def on_retry(attempt, wait, error):
+            print(f"一時的なエラーのため {wait:.1f} 秒後に再試行します "
+                  f"({attempt}/{self.retry_policy.max_attempts - 1}): {file_id}: {str(error)}")
+            self.record_metrics(file_id, retries=attempt)
+
+        return self.retry_policy.call(func, limiter=self.limiter, on_retry=on_retry)
+
+    def record_metrics(self, file_id, **values):
+        """ファイルごとの計測値を記録する（metricsが設定されていない場合は何もしない）"""
+        if self.metrics is not None:
+            self.metrics.record_file(file_id, **values)
+
+    def _record_file_info(self, sheet_name, row_num, file_name, file_path, duration, content_hash=None):
+        """分析結果をファイル情報の表に格納する"""
+        with self._lock:
+            file_index = self.file_info.add_file(file_name, file_path, format_duration(duration), content_hash)
+            self.file_info.set_row(sheet_name, row_num, file_index)
+
+    def restore_file_info(self, sheet_name, row_num, file_name, file_path, duration, content_hash=None):
+        """前回の実行で処理済みの行の情報を復元する（進捗ジャーナルからの再開用）
+
+        Args:
+            duration: "分:秒"形式の再生時間
+        """
+        with self._lock:
+            file_index = self.file_info.add_file(file_name, file_path, duration, content_hash)
+            self.file_info.set_row(sheet_name, row_num, file_index)
+
+    def evict_cache(self, max_bytes):
+        """キャッシュの合計サイズがmax_bytesを超えていれば古いファイルから削除する"""
+        if not self.cache:
+            return 0
+        return self.cache.evict(max_bytes)
+
     def get_file_info_dataframe(self):
         """ファイル情報を保持するDataFrameを作成"""
-        data = []
-        for key, info in self.file_info.items():
-            data.append({
-                'シート名': info['sheet_name'],
-                '行番号': info['row_num'],
-                'ファイル名': info['file_name'],
-                '再生時間': info['duration'],
-                'ファイルパス': info['file_path']
-            })
-
-        if data:
-            return pl.DataFrame(data)
-        else:
-            return pl.DataFrame(schema={'シート名': pl.Utf8, '行番号': pl.Int64, 'ファイル名': pl.Utf8, '再生時間': pl.Utf8, 'ファイルパス': pl.Utf8})
+        with self._lock:
+            return self.file_info.to_dataframe()
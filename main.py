@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 from PyQt5.QtWidgets import QApplication
 from ui import MainWindow
@@ -12,4 +13,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # PyInstallerでexe化した場合に分析用のプロセスプールを起動するため
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,139 @@
+import os
+import queue
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from file_processor import timed_read_duration
+
+
+class DownloadPipeline:
+    """ダウンロードと音声分析を並行して進めるパイプライン
+
+    1段目はスレッドプールでダウンロードし、完了したファイルから順に
+    2段目のプロセスプールで再生時間を解析する（ダウンロード中に再生時間を求められたファイルは解析しない）。結果はrun()を呼び出したスレッド
+    （Excelを更新するスレッド）に、リンクグループの順番どおり（ordered=Falseの場合は完了した順）に返す。
+    ダウンロードはリンクグループの順番に開始する。
+    """
+
+    def __init__(self, file_processor, max_workers, analysis_workers=None, metadata_only=False):
+        self.file_processor = file_processor
+        self.max_workers = max(1, max_workers)
+        self.analysis_workers = analysis_workers or os.cpu_count() or 1
+        self.metadata_only = metadata_only
+
+    def run(self, link_groups, ordered=True):
+        """各リンクグループの処理を開始し、(グループ, ファイルパス, エラーメッセージ)を返すジェネレーターを返す
+
+        ordered=Trueの場合はリンクグループの順番どおりに、Falseの場合は完了した順に返す。
+
+        ダウンロードは呼び出した時点で始まるので、結果を読み始める前に別の準備（ワークブックの読み込みなど）ができる。
+        ファイル情報の記録（file_info）は結果を読み出すスレッドで行う。
+        途中でジェネレーターを閉じると、未着手のダウンロードは取り消される。
+        結果を読まずに中止する場合はshutdown()を呼ぶこと。
+        """
+        self._download_pool = download_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._analysis_pool = analysis_pool = (
+            None if self.metadata_only else ProcessPoolExecutor(max_workers=self.analysis_workers)
+        )
+
+        results = []
+        self._download_futures = download_futures = []
+        for group in link_groups:
+            result = Future()
+            results.append(result)
+            if self.metadata_only:
+                first = group[0]
+                future = download_pool.submit(
+                    self.file_processor.probe_file, first['url'], first['sheet_name'], first['row_num']
+                )
+                future.add_done_callback(lambda f, result=result: self._resolve_probe(f, result))
+            else:
+                future = download_pool.submit(self.file_processor.fetch_file, group[0]['url'])
+                future.add_done_callback(
+                    lambda f, result=result: self._on_downloaded(f, result, analysis_pool)
+                )
+            download_futures.append(future)
+
+        return self._collect(link_groups, results, ordered)
+
+    def shutdown(self):
+        """未着手のダウンロードを取り消し、実行中の処理の完了を待ってプールを停止する"""
+        for future in self._download_futures:
+            future.cancel()
+        self._download_pool.shutdown(wait=True)
+        if self._analysis_pool is not None:
+            self._analysis_pool.shutdown(wait=True)
+
+    def _collect(self, link_groups, results, ordered):
+        """結果をリンクグループの順番どおり、または完了した順に返す"""
+        try:
+            pairs = zip(link_groups, results) if ordered else self._as_completed(link_groups, results)
+            for group, result in pairs:
+                first = group[0]
+                kind, payload = result.result()
+                if kind == 'done':
+                    file_path, error = payload
+                else:
+                    file_id, file_path, duration = payload
+                    # 分析結果の記録はこのスレッドで行う
+                    self.file_processor.register_file(
+                        file_id, file_path, first['sheet_name'], first['row_num'], duration
+                    )
+                    error = None
+                yield group, file_path, error
+        finally:
+            self.shutdown()
+
+    @staticmethod
+    def _as_completed(link_groups, results):
+        """(グループ, 結果)を結果が確定した順に返す"""
+        completed = queue.Queue()
+        for group, result in zip(link_groups, results):
+            result.add_done_callback(lambda f, group=group: completed.put((group, f)))
+        for _ in range(len(results)):
+            yield completed.get()
+
+    def _resolve_probe(self, future, result):
+        try:
+            result.set_result(('done', future.result()))
+        except BaseException as e:
+            result.set_result(('done', (None, f"エラー: {str(e)}")))
+
+    def _on_downloaded(self, future, result, analysis_pool):
+        """ダウンロード完了時に呼ばれ、必要なら分析をプロセスプールに投入する"""
+        if future.cancelled():
+            result.cancel()
+            return
+        try:
+            file_id, file_path, cached_duration, error = future.result()
+        except BaseException as e:
+            result.set_result(('done', (None, f"エラー: {str(e)}")))
+            return
+
+        if not file_path:
+            result.set_result(('done', (None, error)))
+        elif cached_duration is not None:
+            result.set_result(('analyzed', (file_id, file_path, cached_duration)))
+        else:
+            try:
+                analysis = analysis_pool.submit(timed_read_duration, file_path)
+            except RuntimeError:
+                # プール停止後（中断時）は分析しない
+                result.cancel()
+                return
+            analysis.add_done_callback(
+                lambda f: self._on_analyzed(f, result, file_id, file_path)
+            )
+
+    def _on_analyzed(self, future, result, file_id, file_path):
+        try:
+            duration, seconds = future.result()
+        except BaseException as e:
+            # 分析に失敗してもダウンロード自体は成功として扱う（再生時間は不明）
+            print(f"音声ファイル分析エラー: {str(e)}")
+            result.set_result(('done', (file_path, None)))
+            return
+        self.file_processor.record_metrics(file_id, analysis_seconds=seconds)
+        if duration is None:
+            result.set_result(('done', (file_path, None)))
+        else:
+            result.set_result(('analyzed', (file_id, file_path, duration)))
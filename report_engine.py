@@ -0,0 +1,401 @@
+import os
+import time
+
+from download_schedule import DEFAULT_SCHEDULE, SCHEDULE_SHEET_ORDER, fetch_sizes, order_link_groups
+from excel_processor import DEFAULT_SAVE_MODE, ExcelProcessor
+from file_processor import FileProcessor
+from pipeline import DownloadPipeline
+from result_table import export_path_for, write_export
+from retry_policy import AdaptiveLimiter
+from run_journal import RunJournal
+from run_metrics import RESULTS_COLUMNS, RunMetrics, report_paths_for
+from run_plan import build_plan
+
+# 同時ダウンロード数の既定値
+DEFAULT_MAX_WORKERS = 8
+# ダウンロードキャッシュの上限（GB、0は無制限）
+DEFAULT_CACHE_MAX_GB = 0
+# 途中経過をExcelに保存する間隔（秒）
+DEFAULT_CHECKPOINT_INTERVAL = 300
+
+
+class ReportEngine:
+    """1つのExcelファイルについて、リンクの収集からダウンロード・分析・保存までを行う
+
+    画面（PyQt5）に依存しないので、GUIのワーカースレッドとコマンドラインの両方から使う。
+    進捗は、progress_callback(進捗率, メッセージ)とfile_callback(シート名, 行番号, ファイル名, 結果)で通知する。
+    スループットや残り時間の見込みは、ファイルを1件反映するごとにmetrics_callback(集計値の辞書)で通知する。
+    """
+
+    def __init__(self, excel_file, download_dir, selected_sheets, check_l_column, max_workers=DEFAULT_MAX_WORKERS,
+                 force_refresh=False, cache_max_gb=DEFAULT_CACHE_MAX_GB, metadata_only=False, excel_processor=None,
+                 resume=False, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, open_excel=True,
+                 progress_callback=None, file_callback=None, downloader=None, metrics_callback=None,
+                 write_report=False, metrics_in_results=False, retry_policy=None, schedule=DEFAULT_SCHEDULE,
+                 export_format=None, save_mode=DEFAULT_SAVE_MODE, plan=None):
+        self.excel_file = excel_file
+        self.download_dir = download_dir
+        self.selected_sheets = selected_sheets
+        self.check_l_column = check_l_column
+        self.max_workers = max(1, max_workers)
+        self.force_refresh = force_refresh
+        self.cache_max_gb = cache_max_gb
+        self.metadata_only = metadata_only  # Trueの場合はファイルを保存せず再生時間だけを取得する
+        # 作成済みのExcelプロセッサがあれば引き継ぐ（読み込み済みのワークブックを再利用するため）
+        if excel_processor is not None and excel_processor.excel_file_path == excel_file:
+            self.excel_processor = excel_processor
+        else:
+            self.excel_processor = None
+        self.resume = resume  # Trueの場合は進捗ジャーナルから前回の続きを再開する
+        self.checkpoint_interval = checkpoint_interval
+        self.open_excel = open_excel  # Trueの場合は完了後にExcelファイルを開く
+        self.progress_callback = progress_callback
+        self.file_callback = file_callback
+        self.downloader = downloader  # 省略時はFileProcessorが既定のダウンローダーを作成する
+        self.metrics_callback = metrics_callback
+        self.write_report = write_report  # Trueの場合はExcelファイルの隣に実行レポート（JSON, CSV）を書き出す
+        self.metrics_in_results = metrics_in_results  # Trueの場合は結果シートに計測値の列を追加する
+        self.retry_policy = retry_policy  # 省略時はFileProcessorの既定の再試行方法を使う
+        # ダウンロード順の方針（download_schedule.SCHEDULE_POLICIES）
+        # シート・行の順以外では、事前にファイルサイズを取得して並べ替え、進捗と残り時間をバイト数で求める
+        self.schedule = schedule
+        # 'parquet'または'csv'の場合は、結果シートと同じ内容をExcelファイルの隣にも書き出す
+        self.export_format = export_format
+        # Excelの保存方法（excel_processor.SAVE_MODES）
+        # 'patch'の場合はワークブック全体を読み込まず、変更したシートのXMLだけを書き換える
+        self.save_mode = save_mode
+        # 事前に作った見積もり（run_plan.RunPlan）。条件が同じでExcelファイルが変更されていなければ、
+        # リンクの収集とファイルサイズの確認をやり直さずに使う
+        self.work_plan = plan
+        self.metrics = RunMetrics()
+        self._row_file_ids = {}  # (シート名, 行番号) -> ファイルID（計測値を結果シートに追加するため）
+        self.file_processor = None
+        self.journal = None
+        self.processed = []  # 処理した行ごとの結果（シート名、行番号、URL、ファイル名、再生時間、エラー）
+
+    def _report_progress(self, percent, message):
+        if self.progress_callback:
+            self.progress_callback(percent, message)
+
+    def _report_file(self, link_info, file_name, duration, error, status):
+        self.processed.append({
+            'sheet_name': link_info['sheet_name'],
+            'row_num': link_info['row_num'],
+            'url': link_info['url'],
+            'file_name': file_name,
+            'duration': duration,
+            'error': error,
+        })
+        if self.file_callback:
+            self.file_callback(link_info['sheet_name'], link_info['row_num'], file_name or link_info['url'], status)
+
+    def close(self):
+        """FileProcessorが開いたキャッシュのSQLite接続と接続プールを閉じる（処理結果は閉じた後も参照できる）"""
+        if self.file_processor is not None:
+            self.file_processor.close()
+
+    def _create_file_processor(self):
+        # 見積もりの後に実行する場合などは、前のFileProcessorを閉じてから作り直す
+        self.close()
+        file_processor = FileProcessor(
+            self.download_dir, downloader=self.downloader, force_refresh=self.force_refresh,
+            retry_policy=self.retry_policy
+        )
+        file_processor.metrics = self.metrics
+        return file_processor
+
+    def plan(self):
+        """ダウンロードせずに処理内容を見積もる（ドライラン）
+
+        リンクの収集、重複・無効なURLの集計、キャッシュの確認、ファイルサイズの事前取得だけを行う。
+        返した見積もりをplanに渡して実行すると、リンクの収集とサイズの確認をやり直さない。
+
+        Returns:
+            (RunPlan またはNone, エラーメッセージ)
+        """
+        if self.excel_processor is None:
+            self.excel_processor = ExcelProcessor(self.excel_file)
+        self.file_processor = self._create_file_processor()
+        self._report_progress(0, "処理対象のリンクとファイルサイズを確認中...")
+        with self.metrics.stage('plan'):
+            plan, error_msg = build_plan(
+                self.excel_processor, self.file_processor, self.selected_sheets, self.check_l_column,
+                self.max_workers
+            )
+        if plan is not None:
+            self.work_plan = plan
+        return plan, error_msg
+
+    def _usable_plan(self):
+        """今回の実行にそのまま使える見積もり（なければNone）"""
+        if self.work_plan is None:
+            return None
+        try:
+            signature = self.excel_processor.file_signature()
+        except OSError:
+            return None
+        if not self.work_plan.matches(self.excel_file, self.selected_sheets, self.check_l_column, signature):
+            self._report_progress(0, "見積もりの後にExcelファイルまたは設定が変更されたため、リンクを収集し直します")
+            return None
+        return self.work_plan
+
+    def run(self):
+        """処理を実行する
+
+        Returns:
+            (成功したかどうか, 結果メッセージ)
+        """
+        # Excelプロセッサの初期化
+        if self.excel_processor is None:
+            self.excel_processor = ExcelProcessor(self.excel_file)
+        self.excel_processor.save_mode = self.save_mode
+
+        plan = self._usable_plan()
+        if plan is not None:
+            links_data = list(plan.links)
+            self._report_progress(0, f"見積もり時に収集したリンクを使用します（{len(links_data)}件）")
+        else:
+            # 選択されたシートからリンクを取得（J列とL列だけを逐次読み取る）
+            with self.metrics.stage('scan'):
+                links_data, error_msg = self.excel_processor.scan_links(self.selected_sheets, self.check_l_column)
+            if error_msg:
+                return False, error_msg
+
+        # 再開する場合は、前回の実行で処理済みの行をジャーナルから読み込んでスキップする
+        self.journal = RunJournal(self.excel_file)
+        restored = {}
+        if self.resume:
+            restored = {
+                key: record for key, record in self.journal.load().items()
+                if record['sheet_name'] in self.selected_sheets
+            }
+            links_data = [
+                link_info for link_info in links_data
+                if (link_info['sheet_name'], link_info['row_num']) not in restored
+            ]
+
+        total_links = len(links_data)
+
+        if total_links == 0 and not restored:
+            return False, "処理対象のファイルリンクが見つかりませんでした。"
+
+        # ファイルプロセッサの初期化
+        self.file_processor = self._create_file_processor()
+        # サーバーから制限（429・503など）を受けたら同時ダウンロード数を減らし、成功が続けば元に戻す
+        self.file_processor.limiter = AdaptiveLimiter(self.max_workers)
+        self.journal.start(resume=self.resume)
+
+        # 同じファイルIDのリンクをまとめ、ファイルごとに1回だけダウンロードする
+        link_groups = self.file_processor.group_links_by_file_id(links_data)
+        total_files = len(link_groups)
+        duplicate_count = total_links - total_files
+        self.metrics.total_files = total_files
+
+        # ファイルサイズを事前に取得し、方針に従ってダウンロード順を決める
+        # 再生時間のみモードはヘッダー部分しか取得しないので、サイズによる並べ替えはしない
+        sizes = {}
+        if self.schedule != SCHEDULE_SHEET_ORDER and not self.metadata_only:
+            if plan is not None:
+                # 見積もり時に取得したサイズを使う
+                sizes = dict(plan.sizes)
+            else:
+                self._report_progress(0, f"ファイルサイズを確認中... ({total_files}件)")
+                with self.metrics.stage('size_scan'):
+                    sizes = fetch_sizes(self.file_processor, link_groups, self.max_workers)
+            link_groups = order_link_groups(
+                link_groups, sizes, self.schedule, self.file_processor.extract_file_id
+            )
+            self.metrics.total_bytes = sum(sizes.values())
+            for file_id, size in sizes.items():
+                self.metrics.record_file(file_id, size=size)
+
+        self._report_progress(
+            0,
+            f"処理中... (0/{total_files}, 重複リンク: {duplicate_count}件, 同時ダウンロード数: {self.max_workers})"
+        )
+        # ダウンロードと分析をパイプラインで並行して実行する
+        # 結果はこのスレッドへ返るので、Excelの更新はこのスレッドでのみ行う（openpyxlはスレッドセーフではないため）
+        # サイズ順に並べ替えた場合は、大きいファイルの完了を待たずに済むよう完了した順に受け取る
+        pipeline = DownloadPipeline(self.file_processor, self.max_workers, metadata_only=self.metadata_only)
+        results = pipeline.run(link_groups, ordered=not sizes)
+
+        # ダウンロードと並行して、セル更新用にワークブック全体を読み込む（変更部分だけを保存する場合はシート名だけ）
+        with self.metrics.stage('load_excel'):
+            success, error_msg = self.excel_processor.load_excel()
+        if not success:
+            pipeline.shutdown()
+            self.journal.close()
+            return False, error_msg
+
+        if restored:
+            with self.metrics.stage('restore'):
+                self._restore_rows(restored)
+            self._report_progress(0, f"前回の進捗から {len(restored)} 行を復元しました")
+
+        last_checkpoint = time.monotonic()
+        failed_files = 0
+        waiting_since = time.perf_counter()
+        try:
+            for done_count, (group, file_path, error) in enumerate(results, 1):
+                # ダウンロード・分析の完了を待っていた時間
+                self.metrics.add_stage_time('wait', time.perf_counter() - waiting_since)
+                first = group[0]
+                file_id = self.file_processor.extract_file_id(first['url'])
+                for link_info in group:
+                    self._row_file_ids[(link_info['sheet_name'], link_info['row_num'])] = file_id
+                self.metrics.file_done(sizes.get(file_id))
+
+                progress_percent = self.metrics.progress_percent()
+                self._report_progress(progress_percent, f"処理中... ({done_count}/{total_files})")
+
+                if file_path:
+                    file_name = os.path.basename(file_path)
+
+                    # 同じファイルを参照する他の行にも結果を反映
+                    self.file_processor.share_file_info(
+                        file_path, first['sheet_name'], first['row_num'],
+                        [(link_info['sheet_name'], link_info['row_num']) for link_info in group[1:]]
+                    )
+
+                    # 再生時間を取得（ファイル情報から）
+                    duration = None
+                    key = (first['sheet_name'], first['row_num'])
+                    if key in self.file_processor.file_info:
+                        duration = self.file_processor.file_info[key].get('duration')
+
+                    update_started = time.perf_counter()
+                    for link_info in group:
+                        sheet_name = link_info['sheet_name']
+                        row_num = link_info['row_num']
+
+                        # ハイパーリンクを更新（再生時間も含めて）
+                        self.excel_processor.update_cell_with_hyperlink(
+                            sheet_name, row_num, file_name, link_info['url'], duration
+                        )
+                        self.journal.append(
+                            sheet_name, row_num, link_info['url'],
+                            self.file_processor.extract_file_id(link_info['url']), file_name, file_path, duration,
+                            self.file_processor.content_hashes.get(file_id)
+                        )
+                        self._report_file(
+                            link_info, file_name, duration, None, f"成功 (再生時間: {duration or '不明'})"
+                        )
+                    update_seconds = time.perf_counter() - update_started
+                    self.metrics.add_stage_time('cell_update', update_seconds)
+                    self.metrics.record_file(file_id, rows=len(group), cell_update_seconds=update_seconds)
+                    self._report_metrics()
+
+                    # 一定時間ごとに途中経過をExcelに保存する
+                    if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                        with self.metrics.stage('checkpoint'):
+                            self._checkpoint(progress_percent)
+                        last_checkpoint = time.monotonic()
+                else:
+                    # 再試行しても失敗したファイルは行ごとに記録し、残りの処理は続ける
+                    failed_files += 1
+                    self.metrics.record_file(file_id, rows=len(group), error=error)
+                    self._report_metrics()
+                    for link_info in group:
+                        self._report_file(link_info, None, None, error, f"失敗: {error}")
+                waiting_since = time.perf_counter()
+        finally:
+            results.close()
+
+        # キャッシュが上限を超えていれば古いファイルから削除
+        if self.cache_max_gb > 0:
+            with self.metrics.stage('evict'):
+                evicted = self.file_processor.evict_cache(self.cache_max_gb * 1024 ** 3)
+            if evicted:
+                self._report_progress(90, f"キャッシュ上限を超えたため {evicted} 件の古いファイルを削除しました")
+
+        # 結果をシートに保存
+        file_info_df = self.file_processor.get_file_info_dataframe()
+        if file_info_df.height > 0:
+            if self.metrics_in_results:
+                file_info_df = self._add_metrics_columns(file_info_df)
+            with self.metrics.stage('save_results'):
+                success, error_msg = self.excel_processor.save_results(file_info_df)
+            if not success:
+                self._report_progress(90, f"結果シートの作成に失敗: {error_msg}")
+            if self.export_format:
+                with self.metrics.stage('export'):
+                    self._export_results(file_info_df)
+        else:
+            self._report_progress(90, "分析結果がありません。結果シートは作成されません。")
+
+        # Excelファイルを保存
+        with self.metrics.stage('save_excel'):
+            success, error_msg = self.excel_processor.save_excel()
+        self.metrics.finish()
+        self._write_report()
+        if success:
+            # すべての結果をExcelに保存できたので、進捗ジャーナルは不要
+            self.journal.remove()
+            # Excelファイルを開く
+            if self.open_excel:
+                self.excel_processor.open_excel()
+            if failed_files:
+                return True, f"処理が完了しました。（{failed_files} 件のファイルは取得できませんでした）"
+            return True, "処理が完了しました。"
+        else:
+            self.journal.close()
+            return False, f"{error_msg}（「前回の続きから再開する」で処理済みの行を復元できます）"
+
+    def _report_metrics(self):
+        """集計値を通知する"""
+        if self.metrics_callback:
+            self.metrics_callback(self.metrics.snapshot())
+
+    def _write_report(self):
+        """実行レポートを書き出す（失敗しても処理結果には影響させない）"""
+        if not self.write_report:
+            return
+        json_path, csv_path = report_paths_for(self.excel_file)
+        try:
+            self.metrics.write_report(json_path, csv_path)
+            self._report_progress(100, f"実行レポートを保存しました: {json_path}")
+        except OSError as e:
+            self._report_progress(100, f"実行レポートの保存に失敗しました: {str(e)}")
+
+    def _export_results(self, df):
+        """結果をParquetまたはCSVで書き出す（失敗しても処理結果には影響させない）"""
+        path = export_path_for(self.excel_file, self.export_format)
+        try:
+            write_export(df, path, self.export_format)
+            self._report_progress(90, f"結果を書き出しました: {path}")
+        except Exception as e:
+            self._report_progress(90, f"結果の書き出しに失敗しました: {str(e)}")
+
+    def _add_metrics_columns(self, df):
+        """結果のDataFrameに、行ごとのファイルの計測値の列を追加する"""
+        import polars as pl
+
+        files = {record['file_id']: record for record in self.metrics.file_rows()}
+        columns = {name: [] for _, name in RESULTS_COLUMNS}
+        for sheet_name, row_num in zip(df['シート名'].to_list(), df['行番号'].to_list()):
+            record = files.get(self._row_file_ids.get((sheet_name, row_num)), {})
+            for field, name in RESULTS_COLUMNS:
+                value = record.get(field)
+                columns[name].append(round(value, 3) if value is not None else None)
+        return df.with_columns([pl.Series(name, values, dtype=pl.Float64) for name, values in columns.items()])
+
+    def _restore_rows(self, restored):
+        """ジャーナルに記録された処理済みの行を、ワークブックと結果に反映する"""
+        for record in restored.values():
+            sheet_name, row_num = record['sheet_name'], record['row_num']
+            if sheet_name not in self.excel_processor.sheets:
+                continue
+            self.excel_processor.update_cell_with_hyperlink(
+                sheet_name, row_num, record['file_name'], record['url'], record['duration']
+            )
+            self.file_processor.restore_file_info(
+                sheet_name, row_num, record['file_name'], record['file_path'], record['duration'],
+                record.get('content_hash')
+            )
+
+    def _checkpoint(self, progress_percent):
+        """ジャーナルを確定させ、ここまでのセル更新をExcelに保存する（失敗しても処理は続ける）"""
+        self.journal.checkpoint()
+        success, error_msg = self.excel_processor.save_excel()
+        if not success:
+            self._report_progress(progress_percent, f"途中保存に失敗しました（処理は続行します）: {error_msg}")
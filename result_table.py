@@ -0,0 +1,162 @@
+from array import array
+
+# 結果の列（列名, polarsの型名）
+RESULT_COLUMNS = (
+    ('シート名', 'Utf8'),
+    ('行番号', 'Int64'),
+    ('ファイル名', 'Utf8'),
+    ('再生時間', 'Utf8'),
+    ('ファイルパス', 'Utf8'),
+    ('SHA-256', 'Utf8'),
+)
+
+# 結果をワークブックの外に書き出す形式
+EXPORT_FORMATS = ('parquet', 'csv')
+
+
+def export_path_for(excel_file_path, export_format):
+    """Excelファイルと同じフォルダに置く結果ファイル（Parquet, CSV）のパス"""
+    return f"{excel_file_path}.results.{export_format}"
+
+
+def write_export(df, path, export_format):
+    """結果のDataFrameをParquetまたはCSVで書き出す"""
+    if export_format == 'parquet':
+        df.write_parquet(path)
+    elif export_format == 'csv':
+        # Excelで開いても文字化けしないようBOM付きで書き出す
+        df.write_csv(path, include_bom=True)
+    else:
+        raise ValueError(f"出力形式は{EXPORT_FORMATS}のいずれかを指定してください: {export_format}")
+
+
+def _int_series(name, values, dtype):
+    """整数の配列（array）からSeriesを作る（numpyがあれば要素ごとの変換をせずにバッファから作る）"""
+    import polars as pl
+
+    try:
+        import numpy as np
+    except ImportError:
+        return pl.Series(name, values, dtype=dtype)
+    # 元の配列はこの後も追記されるので、バッファをそのまま共有せずに複製する（memcpy 1回分）
+    return pl.Series(name, np.frombuffer(values, dtype=np.dtype(values.typecode)).copy(), dtype=dtype)
+
+
+class ResultTable:
+    """処理結果を列ごとのバッファで保持する
+
+    ファイルごとの値（ファイル名、パス、再生時間、ハッシュ）は1回だけ保持し、
+    行はシート番号・行番号・ファイル番号の整数の配列で持つ。同じファイルを参照する行が多くても、
+    文字列を行ごとに持たない。(シート名, 行番号)をキーにした辞書のようにも参照できる。
+    """
+
+    def __init__(self):
+        self._sheet_names = []
+        self._sheet_ids = {}
+        # ファイルごとの列
+        self._file_names = []
+        self._file_paths = []
+        self._durations = []
+        self._hashes = []
+        self._file_ids = {}  # (ファイル名, パス, 再生時間, ハッシュ) -> ファイル番号
+        # 行ごとの列
+        self._row_sheets = array('I')
+        self._row_nums = array('i')
+        self._row_files = array('I')
+        self._positions = {}  # シート番号 << 32 | 行番号 -> 行の位置
+
+    def __len__(self):
+        return len(self._row_nums)
+
+    def __contains__(self, key):
+        return self._position(*key) is not None
+
+    def __getitem__(self, key):
+        info = self.get(key)
+        if info is None:
+            raise KeyError(key)
+        return info
+
+    def get(self, key, default=None):
+        """(シート名, 行番号)の結果を辞書で返す（file_name, file_path, duration, content_hash, sheet_name, row_num）"""
+        sheet_name, row_num = key
+        position = self._position(sheet_name, row_num)
+        if position is None:
+            return default
+        file_index = self._row_files[position]
+        return {
+            'file_name': self._file_names[file_index],
+            'file_path': self._file_paths[file_index],
+            'duration': self._durations[file_index],
+            'content_hash': self._hashes[file_index],
+            'sheet_name': sheet_name,
+            'row_num': row_num,
+        }
+
+    def add_file(self, file_name, file_path, duration, content_hash=None):
+        """ファイルの値を登録してファイル番号を返す（同じ値のファイルは同じ番号になる）
+
+        Args:
+            duration: "分:秒"形式の再生時間
+        """
+        key = (file_name, file_path, duration, content_hash)
+        file_index = self._file_ids.get(key)
+        if file_index is None:
+            file_index = self._file_ids[key] = len(self._file_names)
+            self._file_names.append(file_name)
+            self._file_paths.append(file_path)
+            self._durations.append(duration)
+            self._hashes.append(content_hash)
+        return file_index
+
+    def set_row(self, sheet_name, row_num, file_index):
+        """行にファイルを対応付ける（既にある行は上書きする）"""
+        sheet_id = self._sheet_ids.get(sheet_name)
+        if sheet_id is None:
+            sheet_id = self._sheet_ids[sheet_name] = len(self._sheet_names)
+            self._sheet_names.append(sheet_name)
+        key = sheet_id << 32 | row_num
+        position = self._positions.get(key)
+        if position is None:
+            self._positions[key] = len(self._row_nums)
+            self._row_sheets.append(sheet_id)
+            self._row_nums.append(row_num)
+            self._row_files.append(file_index)
+        else:
+            self._row_files[position] = file_index
+
+    def file_index(self, sheet_name, row_num):
+        """行に対応付けたファイル番号（行がなければNone）"""
+        position = self._position(sheet_name, row_num)
+        return None if position is None else self._row_files[position]
+
+    def rows_by_file(self):
+        """{ファイルパス（保存しない場合はファイル名）: [(シート名, 行番号), ...]}"""
+        rows = {}
+        for sheet_id, row_num, file_index in zip(self._row_sheets, self._row_nums, self._row_files):
+            key = self._file_paths[file_index] or self._file_names[file_index]
+            rows.setdefault(key, []).append((self._sheet_names[sheet_id], row_num))
+        return rows
+
+    def to_dataframe(self):
+        """polarsのDataFrameに変換する（文字列の列は、ファイル・シートごとの値を番号で引いて作る）"""
+        import polars as pl
+
+        sheet_ids = _int_series('sheet_id', self._row_sheets, pl.UInt32)
+        file_ids = _int_series('file_id', self._row_files, pl.UInt32)
+        file_columns = (self._file_names, self._durations, self._file_paths, self._hashes)
+        names = [name for name, _ in RESULT_COLUMNS]
+        return pl.DataFrame([
+            pl.Series(names[0], self._sheet_names, dtype=pl.Utf8).gather(sheet_ids),
+            _int_series(names[1], self._row_nums, pl.Int64),
+            *[
+                pl.Series(name, values, dtype=pl.Utf8).gather(file_ids)
+                for name, values in zip(names[2:], file_columns)
+            ],
+        ])
+
+    def _position(self, sheet_name, row_num):
+        sheet_id = self._sheet_ids.get(sheet_name)
+        if sheet_id is None:
+            return None
+        return self._positions.get(sheet_id << 32 | row_num)
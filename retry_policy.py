@@ -0,0 +1,158 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# 再試行の既定値
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 1.0  # 秒
+DEFAULT_MAX_DELAY = 60.0  # 秒
+# 同時実行数を半分にした後、次に半分にできるまでの時間（秒）
+# 同時に実行中のダウンロードがまとめて制限を受けても、1回分の減少として扱うため
+DECREASE_COOLDOWN = 2.0
+
+# 混雑・制限を表すHTTPステータス（同時実行数を減らして再試行する）
+THROTTLE_STATUSES = {429, 503}
+# 一時的な障害を表すHTTPステータス（同時実行数はそのままで再試行する）
+RETRYABLE_STATUSES = {408, 500, 502, 504}
+
+
+class DownloadError(Exception):
+    """ダウンロードの失敗
+
+    retryableがTrueなら時間をおいて再試行でき、throttledがTrueならサーバー側の制限（混雑）によるもの。
+    """
+
+    def __init__(self, message, retryable=False, throttled=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value):
+    """Retry-Afterヘッダー（秒数）を秒に変換する（日付形式などは無視する）"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """例外を分類して(再試行できるか, 制限によるものか, Retry-Afterの秒数)を返す"""
+    if isinstance(error, DownloadError):
+        return error.retryable, error.throttled, error.retry_after
+
+    import requests
+
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        retry_after = _parse_retry_after(error.response.headers.get('Retry-After'))
+        if status in THROTTLE_STATUSES:
+            return True, True, retry_after
+        return status in RETRYABLE_STATUSES, False, retry_after
+
+    if isinstance(error, (requests.exceptions.ConnectionError,
+                          requests.exceptions.ChunkedEncodingError,
+                          requests.exceptions.Timeout)):
+        return True, False, None
+
+    # 無効なリンク・権限がない・形式が違うなどは再試行しても結果が変わらない
+    return False, False, None
+
+
+class AdaptiveLimiter:
+    """AIMD方式で同時実行数を調整する
+
+    成功するたびに上限を少しずつ増やし（加算的増加）、サーバーから制限を受けたら半分にする（乗算的減少）。
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(self.max_limit)
+        self.active = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    @contextmanager
+    def slot(self):
+        """同時実行数の枠を1つ確保する（空くまで待つ）"""
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            # 上限いっぱいまで同時に成功すると、おおよそ1増える
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease < DECREASE_COOLDOWN:
+                return
+            self._last_decrease = now
+            self.limit = max(float(self.min_limit), self.limit / 2)
+
+
+class RetryPolicy:
+    """再試行できる失敗を、ジッター付きの指数バックオフで再試行する"""
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        """attempt回目の失敗の後に待つ秒数（0から上限までの一様乱数、Retry-Afterがあればそれ以上）"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def call(self, func, limiter=None, on_retry=None):
+        """funcを実行し、再試行できる失敗なら待ってから再試行する
+
+        limiterを渡すと、実行中は同時実行数の枠を確保し、結果に応じて同時実行数を調整する
+        （待っている間は枠を解放する）。on_retry(試行回数, 待ち時間, 例外)は再試行の前に呼ばれる。
+        """
+        attempt = 0
+        while True:
+            with limiter.slot() if limiter else _no_limit():
+                try:
+                    result = func()
+                except Exception as e:
+                    error = e
+                    retryable, throttled, retry_after = classify_error(e)
+                    if throttled and limiter:
+                        limiter.on_throttle()
+                    attempt += 1
+                    if not retryable or attempt >= self.max_attempts:
+                        raise
+                else:
+                    if limiter:
+                        limiter.on_success()
+                    return result
+
+            wait = self.delay(attempt, retry_after)
+            if on_retry:
+                on_retry(attempt, wait, error)
+            time.sleep(wait)
+
+
+@contextmanager
+def _no_limit():
+    yield
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+
+JOURNAL_SUFFIX = ".progress.jsonl"
+
+
+def journal_path_for(excel_file_path):
+    """Excelファイルと同じフォルダに置く進捗ジャーナルのパス"""
+    return excel_file_path + JOURNAL_SUFFIX
+
+
+class RunJournal:
+    """処理済みの行を1行ずつ追記する進捗ジャーナル（JSON Lines形式）
+
+    途中でクラッシュしても、それまでに完了した行を再開時に復元できるようにする。
+    各レコードは書き込みごとにフラッシュし、checkpoint()でディスクへの書き込みを確定する。
+    """
+
+    def __init__(self, excel_file_path):
+        self.path = journal_path_for(excel_file_path)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self):
+        """ジャーナルに記録済みのレコードを{(シート名, 行番号): レコード}の辞書で返す
+
+        書き込み途中で終了した最後の行など、読み取れない行は無視する。
+        """
+        records = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        records[(record['sheet_name'], record['row_num'])] = record
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
+    def start(self, resume=False):
+        """記録を開始する（resume=Falseの場合は以前の記録を破棄する）"""
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+
+    def append(self, sheet_name, row_num, url, file_id, file_name, file_path, duration, content_hash=None):
+        """完了した1行分の結果を追記する
+
+        Args:
+            duration: L列に書き込んだ再生時間（"分:秒"形式）
+        """
+        record = {
+            'sheet_name': sheet_name,
+            'row_num': row_num,
+            'url': url,
+            'file_id': file_id,
+            'file_name': file_name,
+            'file_path': file_path,
+            'duration': duration,
+            'content_hash': content_hash,
+        }
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+
+    def checkpoint(self):
+        """追記済みの内容をディスクに確定させる"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """処理が完了してExcelに保存できた後に、ジャーナルを削除する"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
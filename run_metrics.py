@@ -0,0 +1,157 @@
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# ファイルごとの計測項目（CSVの列順）
+FILE_FIELDS = (
+    'file_id', 'file_name', 'rows', 'cached', 'size', 'metadata_seconds', 'ttfb_seconds',
+    'download_seconds', 'bytes', 'mb_per_second', 'streamed', 'analysis_seconds', 'cell_update_seconds', 'retries', 'error',
+)
+
+# 結果シートに追加する列（計測項目, 列名）
+RESULTS_COLUMNS = (
+    ('download_seconds', 'ダウンロード時間(秒)'),
+    ('mb_per_second', '転送速度(MB/s)'),
+    ('analysis_seconds', '分析時間(秒)'),
+)
+
+
+def report_paths_for(excel_file_path):
+    """Excelファイルと同じフォルダに置く実行レポート（JSON, CSV）のパス"""
+    return excel_file_path + ".report.json", excel_file_path + ".report.csv"
+
+
+class RunMetrics:
+    """1回の実行の段階ごとの所要時間と、ファイルごとの計測値を集計する
+
+    段階（リンク収集、ワークブック読み込み、保存など）はstage()で計測し、
+    ファイルごとの値（ダウンロード、分析、セル更新）はrecord_file()で記録する。
+    ダウンロード用のスレッドからも呼ばれるため、更新はロックで保護する。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = {}  # 段階名 -> 所要時間（秒）
+        self.files = {}  # ファイルID -> 計測値の辞書
+        self.total_files = 0
+        self.done_files = 0
+        # 事前に取得したファイルサイズの合計（0の場合は残り時間をファイル数から見積もる）
+        self.total_bytes = 0
+        self.done_bytes = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """with文の中の処理時間を段階nameの時間として加算する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - started)
+
+    def add_stage_time(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_file(self, file_id, **values):
+        """ファイルごとの計測値を記録する（秒数の項目は加算、それ以外は上書き）"""
+        if not file_id:
+            return
+        with self._lock:
+            record = self.files.setdefault(file_id, {'file_id': file_id})
+            for key, value in values.items():
+                if value is None:
+                    continue
+                if key.endswith('_seconds') and key in record:
+                    record[key] += value
+                else:
+                    record[key] = value
+
+    def file_done(self, size=0):
+        """結果を反映し終えたファイルを1件数える（sizeは事前に取得したファイルサイズ）"""
+        with self._lock:
+            self.done_files += 1
+            self.done_bytes += size or 0
+
+    def progress_percent(self):
+        """進捗率（ファイルサイズが分かっていればバイト数、分からなければファイル数の割合）"""
+        with self._lock:
+            if self.total_bytes:
+                return min(100, int(self.done_bytes * 100 / self.total_bytes))
+            return int(self.done_files * 100 / self.total_files) if self.total_files else 0
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def snapshot(self):
+        """画面表示用の集計値（スループットと残り時間の見込み）を返す"""
+        with self._lock:
+            done = self.done_files
+            total = self.total_files
+            done_bytes = self.done_bytes
+            total_bytes = self.total_bytes
+            transferred = sum(record.get('bytes', 0) for record in self.files.values())
+        elapsed = self.elapsed()
+        files_per_second = done / elapsed if elapsed > 0 else 0.0
+        if total_bytes:
+            # ファイルの大きさがばらつく場合でも見積もりがずれないよう、処理済みのバイト数から求める
+            bytes_per_second = done_bytes / elapsed if elapsed > 0 else 0.0
+            remaining_bytes = max(total_bytes - done_bytes, 0)
+            eta = remaining_bytes / bytes_per_second if bytes_per_second > 0 else None
+        else:
+            remaining = max(total - done, 0)
+            eta = remaining / files_per_second if files_per_second > 0 else None
+        return {
+            'done_files': done,
+            'total_files': total,
+            'done_bytes': done_bytes,
+            'total_bytes': total_bytes,
+            'elapsed_seconds': elapsed,
+            'bytes': transferred,
+            'files_per_second': files_per_second,
+            'mb_per_second': transferred / 1024 ** 2 / elapsed if elapsed > 0 else 0.0,
+            'eta_seconds': eta,
+        }
+
+    def file_rows(self):
+        """ファイルごとの計測値のリスト（転送速度を計算して追加する）"""
+        with self._lock:
+            records = [dict(record) for record in self.files.values()]
+        for record in records:
+            seconds = record.get('download_seconds')
+            if record.get('bytes') and seconds:
+                record['mb_per_second'] = record['bytes'] / 1024 ** 2 / seconds
+        return records
+
+    def summary(self):
+        """段階ごとの時間と全体の集計値"""
+        files = self.file_rows()
+        summary = self.snapshot()
+        summary['stages'] = dict(self.stages)
+        for field in ('metadata_seconds', 'ttfb_seconds', 'download_seconds', 'analysis_seconds',
+                      'cell_update_seconds'):
+            values = [record[field] for record in files if field in record]
+            summary[f'total_{field}'] = sum(values)
+            summary[f'mean_{field}'] = sum(values) / len(values) if values else None
+        summary['cached_files'] = sum(1 for record in files if record.get('cached'))
+        summary['streamed_files'] = sum(1 for record in files if record.get('streamed'))
+        summary['retries'] = sum(record.get('retries', 0) for record in files)
+        summary['failed_files'] = sum(1 for record in files if record.get('error'))
+        return summary
+
+    def write_report(self, json_path, csv_path):
+        """実行レポートをJSON（集計値とファイルごとの値）とCSV（ファイルごとの値）で書き出す"""
+        files = self.file_rows()
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'summary': self.summary(), 'files': files}, f, ensure_ascii=False, indent=2)
+        # Excelで開いても文字化けしないようBOM付きで書き出す
+        with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FILE_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(files)
@@ -0,0 +1,114 @@
+import time
+
+from download_schedule import fetch_sizes
+
+
+def format_bytes(size):
+    """バイト数を読みやすい単位の文字列にする"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class RunPlan:
+    """ダウンロード前の見積もり（ドライラン）の結果
+
+    処理対象のリンクとファイルIDごとのグループ、無効なURL、キャッシュ済みのファイル、ファイルサイズを保持する。
+    ReportEngineに渡すと、Excelファイルが変更されておらず対象のシートと設定が同じであれば、
+    リンクの収集とファイルサイズの確認をやり直さずにそのまま作業リストとして使う。
+    """
+
+    def __init__(self, excel_file, selected_sheets, check_l_column, signature, links, link_groups, file_ids,
+                 cached_file_ids, sizes, seconds):
+        self.excel_file = excel_file
+        self.selected_sheets = list(selected_sheets)
+        self.check_l_column = check_l_column
+        self.signature = signature  # 見積もり時点のExcelファイルの(サイズ, 更新日時)
+        self.links = links  # ExcelProcessor.scan_linksと同じ形式のリンク情報のリスト
+        self.link_groups = link_groups  # FileProcessor.group_links_by_file_idと同じ形式
+        self.file_ids = file_ids  # グループごとのファイルID（無効なURLのグループはNone）
+        self.cached_file_ids = cached_file_ids  # ダウンロード済みで再利用できるファイルIDの集合
+        self.sizes = sizes  # {ファイルID: サイズ（バイト）}（取得できなかったファイルは含まない）
+        self.seconds = seconds
+
+    def matches(self, excel_file, selected_sheets, check_l_column, signature):
+        """同じ条件で作った見積もりで、その後Excelファイルが変更されていないかどうか"""
+        return (
+            self.excel_file == excel_file and self.selected_sheets == list(selected_sheets) and
+            self.check_l_column == check_l_column and self.signature == signature
+        )
+
+    @property
+    def invalid_links(self):
+        """ファイルIDを抽出できないURLのリンク情報"""
+        return [group[0] for group, file_id in zip(self.link_groups, self.file_ids) if file_id is None]
+
+    def summary(self):
+        """見積もりの集計値を辞書で返す"""
+        unique_ids = [file_id for file_id in self.file_ids if file_id]
+        pending_ids = [file_id for file_id in unique_ids if file_id not in self.cached_file_ids]
+        invalid_count = len(self.file_ids) - len(unique_ids)
+        return {
+            'links': len(self.links),
+            'unique_files': len(unique_ids),
+            'duplicate_links': len(self.links) - len(unique_ids) - invalid_count,
+            'invalid_links': invalid_count,
+            'cached_files': len(unique_ids) - len(pending_ids),
+            'files_to_download': len(pending_ids),
+            'estimated_bytes': sum(self.sizes.get(file_id, 0) for file_id in pending_ids),
+            'cached_bytes': sum(self.sizes.get(file_id, 0) for file_id in self.cached_file_ids),
+            'unknown_size_files': sum(1 for file_id in pending_ids if file_id not in self.sizes),
+            'seconds': round(self.seconds, 3),
+        }
+
+    def describe(self):
+        """見積もりの内容を画面・ログ向けの文章にする"""
+        summary = self.summary()
+        lines = [
+            f"リンク: {summary['links']} 件（重複 {summary['duplicate_links']} 件、無効なURL {summary['invalid_links']} 件）",
+            f"ファイル: {summary['unique_files']} 件（キャッシュ済み {summary['cached_files']} 件、"
+            f"ダウンロード予定 {summary['files_to_download']} 件）",
+            f"ダウンロード量の見込み: {format_bytes(summary['estimated_bytes'])}"
+            + (f"（サイズ不明 {summary['unknown_size_files']} 件）" if summary['unknown_size_files'] else ""),
+        ]
+        for link_info in self.invalid_links[:10]:
+            lines.append(f"無効なURL: シート「{link_info['sheet_name']}」の {link_info['row_num']} 行目: {link_info['url']}")
+        lines.append(f"見積もりにかかった時間: {self.seconds:.1f} 秒")
+        return "\n".join(lines)
+
+
+def build_plan(excel_processor, file_processor, selected_sheets, check_l_column, max_workers):
+    """ダウンロードせずに処理内容を見積もる
+
+    J列とL列だけを逐次読み取ってリンクを集め（L列に値がある行のスキップも同じ）、ファイルIDごとにまとめる。
+    キャッシュ済みのファイルはローカルのファイルから、それ以外はファイルの先頭1バイトの範囲取得で、サイズを求める。
+
+    Returns:
+        (RunPlan, エラーメッセージ)
+    """
+    started = time.perf_counter()
+    try:
+        # 読み取り中に変更された場合も見積もりを使わないよう、読み取る前の状態を記録する
+        signature = excel_processor.file_signature()
+    except OSError as e:
+        return None, f"Excelファイル読み込みエラー: {str(e)}"
+    links, error_msg = excel_processor.scan_links(selected_sheets, check_l_column)
+    if error_msg:
+        return None, error_msg
+
+    link_groups = file_processor.group_links_by_file_id(links)
+    file_ids = [file_processor.extract_file_id(group[0]['url']) for group in link_groups]
+    cached_file_ids = set()
+    if file_processor.cache and not file_processor.force_refresh:
+        cached_file_ids = {file_id for file_id in file_ids if file_id and file_processor.cache.get(file_id)}
+
+    valid_groups = [group for group, file_id in zip(link_groups, file_ids) if file_id]
+    sizes = fetch_sizes(file_processor, valid_groups, max_workers)
+
+    plan = RunPlan(
+        excel_processor.excel_file_path, selected_sheets, check_l_column, signature, links, link_groups, file_ids,
+        cached_file_ids, sizes, time.perf_counter() - started
+    )
+    return plan, None
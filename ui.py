@@ -1,99 +1,70 @@
-import os
 import sys
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout,
     QHBoxLayout, QLabel, QPushButton, QFileDialog,
     QCheckBox, QProgressBar, QTextEdit, QGroupBox,
-    QScrollArea, QMessageBox
+    QScrollArea, QMessageBox, QSpinBox, QComboBox
 )
 from PyQt5.QtCore import QThread, pyqtSignal
 
-from excel_processor import ExcelProcessor
-from file_processor import FileProcessor
+from download_schedule import DEFAULT_SCHEDULE, SCHEDULE_POLICIES
+from excel_processor import DEFAULT_SAVE_MODE, SAVE_MODES, ExcelProcessor
+from file_processor import format_duration
+from report_engine import (
+    DEFAULT_CACHE_MAX_GB, DEFAULT_CHECKPOINT_INTERVAL, DEFAULT_MAX_WORKERS, ReportEngine
+)
+
+# 同時ダウンロード数の上限
+MAX_WORKERS_LIMIT = 32
 
 
 class WorkerThread(QThread):
-    """バックグラウンドで処理を実行するためのスレッド"""
+    """バックグラウンドで処理を実行するためのスレッド（処理内容はReportEngineに任せる）"""
     update_progress = pyqtSignal(int, str)
     finished = pyqtSignal(bool, str)
     file_processed = pyqtSignal(str, int, str, str)  # シート名、行番号、ファイル名、結果
-
-    def __init__(self, excel_file, download_dir, selected_sheets, check_l_column):
+    metrics_updated = pyqtSignal(dict)  # スループットと残り時間の見込み（RunMetrics.snapshot()）
+    plan_ready = pyqtSignal(object)  # 見積もりの結果（run_plan.RunPlan）
+
+    def __init__(self, excel_file, download_dir, selected_sheets, check_l_column, max_workers=DEFAULT_MAX_WORKERS,
+                 force_refresh=False, cache_max_gb=DEFAULT_CACHE_MAX_GB, metadata_only=False, excel_processor=None,
+                 resume=False, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, write_report=True,
+                 metrics_in_results=False, schedule=DEFAULT_SCHEDULE, export_format=None,
+                 save_mode=DEFAULT_SAVE_MODE, plan=None, plan_only=False):
         super().__init__()
-        self.excel_file = excel_file
-        self.download_dir = download_dir
-        self.selected_sheets = selected_sheets
-        self.check_l_column = check_l_column
-        self.excel_processor = None
-        self.file_processor = None
+        self.plan_only = plan_only  # Trueの場合はダウンロードせずに見積もりだけを行う
+        self.engine = ReportEngine(
+            excel_file, download_dir, selected_sheets, check_l_column, max_workers,
+            force_refresh=force_refresh, cache_max_gb=cache_max_gb, metadata_only=metadata_only,
+            excel_processor=excel_processor, resume=resume, checkpoint_interval=checkpoint_interval,
+            progress_callback=self.update_progress.emit, file_callback=self.file_processed.emit,
+            metrics_callback=self.metrics_updated.emit, write_report=write_report,
+            metrics_in_results=metrics_in_results, schedule=schedule, export_format=export_format,
+            save_mode=save_mode, plan=plan
+        )
 
-    def run(self):
-        # Excelプロセッサの初期化
-        self.excel_processor = ExcelProcessor(self.excel_file)
-        success, error_msg = self.excel_processor.load_excel()
-
-        if not success:
-            self.finished.emit(False, error_msg)
-            return
-
-        # ファイルプロセッサの初期化
-        self.file_processor = FileProcessor(self.download_dir)
-
-        # 選択されたシートからリンクを取得
-        links_data = self.excel_processor.get_links_from_sheets(self.selected_sheets, self.check_l_column)
-        total_links = len(links_data)
-
-        if total_links == 0:
-            self.finished.emit(False, "処理対象のファイルリンクが見つかりませんでした。")
-            return
-
-        # 各リンクを処理
-        for i, link_info in enumerate(links_data):
-            sheet_name = link_info['sheet_name']
-            row_num = link_info['row_num']
-            url = link_info['url']
-
-            progress_percent = int((i / total_links) * 100)
-            self.update_progress.emit(progress_percent, f"処理中... ({i + 1}/{total_links})")
-
-            # ファイルをダウンロード
-            file_path, error = self.file_processor.download_file(url, sheet_name, row_num)
-
-            if file_path:
-                file_name = os.path.basename(file_path)
-
-                # 再生時間を取得（ファイル情報から）
-                duration = None
-                key = (sheet_name, row_num)
-                if key in self.file_processor.file_info:
-                    duration = self.file_processor.file_info[key].get('duration')
-
-                # ハイパーリンクを更新（再生時間も含めて）
-                self.excel_processor.update_cell_with_hyperlink(
-                    sheet_name, row_num, file_name, url, duration
-                )
-                self.file_processed.emit(sheet_name, row_num, file_name, f"成功 (再生時間: {duration or '不明'})")
-            else:
-                self.file_processed.emit(sheet_name, row_num, url, f"失敗: {error}")
-                break
-
-        # 結果をシートに保存
-        file_info_df = self.file_processor.get_file_info_dataframe()
-        if file_info_df.height > 0:
-            success, error_msg = self.excel_processor.save_results(file_info_df)
-            if not success:
-                self.update_progress.emit(90, f"結果シートの作成に失敗: {error_msg}")
-        else:
-            self.update_progress.emit(90, "分析結果がありません。結果シートは作成されません。")
+    @property
+    def excel_processor(self):
+        return self.engine.excel_processor
 
-        # Excelファイルを保存
-        success, error_msg = self.excel_processor.save_excel()
-        if success:
-            # Excelファイルを開く
-            self.excel_processor.open_excel()
-            self.finished.emit(True, "処理が完了しました。")
-        else:
-            self.finished.emit(False, error_msg)
+    @property
+    def file_processor(self):
+        return self.engine.file_processor
+
+    def run(self):
+        try:
+            if self.plan_only:
+                plan, error_msg = self.engine.plan()
+                if plan is None:
+                    self.finished.emit(False, error_msg)
+                    return
+                self.plan_ready.emit(plan)
+                self.finished.emit(True, plan.describe())
+                return
+            success, message = self.engine.run()
+            self.finished.emit(success, message)
+        finally:
+            self.engine.close()
 
 
 class MainWindow(QMainWindow):
@@ -104,6 +75,7 @@ class MainWindow(QMainWindow):
         self.selected_sheets = []
         self.sheet_checkboxes = []
         self.excel_processor = None
+        self.plan = None  # 最後に作った見積もり（実行時に条件が同じなら作業リストとして使う）
 
         self.init_ui()
 
@@ -154,9 +126,75 @@ class MainWindow(QMainWindow):
         self.check_l_column = QCheckBox("L列(再生時間)に値がある行をスキップする")
         self.check_l_column.setChecked(True)  # デフォルトでオン
 
+        # 再生時間のみ取得するモード
+        self.metadata_only = QCheckBox("再生時間のみ取得する（ファイルはダウンロードしない）")
+
+        # 中断した実行の再開
+        self.resume = QCheckBox("前回の続きから再開する（処理済みの行をスキップする）")
+
+        # 計測結果の出力
+        self.write_report = QCheckBox("実行レポート（段階ごとの所要時間・転送速度）をJSON/CSVで保存する")
+        self.write_report.setChecked(True)
+        self.metrics_in_results = QCheckBox("結果シートにダウンロード時間・転送速度・分析時間を追加する")
+
+        # 結果シートと同じ内容をワークブックの外にも保存する
+        export_layout = QHBoxLayout()
+        self.export_combo = QComboBox()
+        self.export_combo.addItem("保存しない", None)
+        self.export_combo.addItem("Parquet", 'parquet')
+        self.export_combo.addItem("CSV", 'csv')
+        export_layout.addWidget(QLabel("結果をファイルにも保存:"))
+        export_layout.addWidget(self.export_combo)
+
+        # Excelの保存方法（変更したセルだけ書き換えると、大きなワークブックでも保存が速い）
+        self.save_mode_combo = QComboBox()
+        for mode, label in SAVE_MODES.items():
+            self.save_mode_combo.addItem(label, mode)
+        self.save_mode_combo.setCurrentIndex(self.save_mode_combo.findData(DEFAULT_SAVE_MODE))
+        export_layout.addWidget(QLabel("保存方法:"))
+        export_layout.addWidget(self.save_mode_combo)
+        export_layout.addStretch(1)
+
+        # 同時ダウンロード数の設定
+        workers_layout = QHBoxLayout()
+        self.max_workers_spin = QSpinBox()
+        self.max_workers_spin.setRange(1, MAX_WORKERS_LIMIT)
+        self.max_workers_spin.setValue(DEFAULT_MAX_WORKERS)
+        workers_layout.addWidget(QLabel("最大同時ダウンロード数:"))
+        workers_layout.addWidget(self.max_workers_spin)
+        workers_layout.addStretch(1)
+
+        # ダウンロード順の方針（シート・行の順以外は事前にファイルサイズを確認する）
+        self.schedule_combo = QComboBox()
+        for policy, label in SCHEDULE_POLICIES.items():
+            self.schedule_combo.addItem(label, policy)
+        self.schedule_combo.setCurrentIndex(self.schedule_combo.findData(DEFAULT_SCHEDULE))
+        workers_layout.addWidget(QLabel("ダウンロード順:"))
+        workers_layout.addWidget(self.schedule_combo)
+
+        # ダウンロードキャッシュの設定
+        cache_layout = QHBoxLayout()
+        self.force_refresh = QCheckBox("キャッシュを使わずに再ダウンロードする")
+        self.cache_max_gb_spin = QSpinBox()
+        self.cache_max_gb_spin.setRange(0, 10000)
+        self.cache_max_gb_spin.setValue(DEFAULT_CACHE_MAX_GB)
+        self.cache_max_gb_spin.setSpecialValueText("無制限")
+        self.cache_max_gb_spin.setSuffix(" GB")
+        cache_layout.addWidget(self.force_refresh)
+        cache_layout.addStretch(1)
+        cache_layout.addWidget(QLabel("キャッシュ上限:"))
+        cache_layout.addWidget(self.cache_max_gb_spin)
+
         sheet_group_layout = QVBoxLayout()
         sheet_group_layout.addWidget(sheet_scroll)
         sheet_group_layout.addWidget(self.check_l_column)
+        sheet_group_layout.addWidget(self.metadata_only)
+        sheet_group_layout.addWidget(self.resume)
+        sheet_group_layout.addWidget(self.write_report)
+        sheet_group_layout.addWidget(self.metrics_in_results)
+        sheet_group_layout.addLayout(export_layout)
+        sheet_group_layout.addLayout(workers_layout)
+        sheet_group_layout.addLayout(cache_layout)
         sheet_group.setLayout(sheet_group_layout)
 
         # 処理状況表示エリア
@@ -166,24 +204,34 @@ class MainWindow(QMainWindow):
         self.progress_bar = QProgressBar()
         self.progress_bar.setValue(0)
 
+        # スループットと残り時間の見込み
+        self.metrics_label = QLabel("")
+
         self.status_text = QTextEdit()
         self.status_text.setReadOnly(True)
 
         progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.metrics_label)
         progress_layout.addWidget(self.status_text)
         progress_group.setLayout(progress_layout)
 
-        # 実行ボタン
+        # 見積もり・実行ボタン
+        buttons_layout = QHBoxLayout()
+        self.plan_btn = QPushButton("見積もり（ダウンロードしない）")
+        self.plan_btn.clicked.connect(self.plan_process)
+        self.plan_btn.setEnabled(False)
         self.execute_btn = QPushButton("実行")
         self.execute_btn.clicked.connect(self.execute_process)
         self.execute_btn.setEnabled(False)
+        buttons_layout.addWidget(self.plan_btn)
+        buttons_layout.addWidget(self.execute_btn, 1)
 
         # レイアウトに追加
         main_layout.addWidget(file_group)
         main_layout.addWidget(save_group)
         main_layout.addWidget(sheet_group, 1)  # シート選択エリアを拡大
         main_layout.addWidget(progress_group, 1)  # 処理状況表示エリアを拡大
-        main_layout.addWidget(self.execute_btn)
+        main_layout.addLayout(buttons_layout)
 
         main_widget.setLayout(main_layout)
         self.setCentralWidget(main_widget)
@@ -196,10 +244,11 @@ class MainWindow(QMainWindow):
         if file_path:
             self.excel_file = file_path
             self.file_label.setText(file_path)
+            self.plan = None
 
-            # シート情報を取得して表示
+            # シート情報を取得して表示（ワークブック全体は読み込まない）
             self.excel_processor = ExcelProcessor(file_path)
-            success, error_msg = self.excel_processor.load_excel()
+            success, error_msg = self.excel_processor.load_sheet_names()
 
             if success:
                 self.load_sheets()
@@ -248,33 +297,82 @@ class MainWindow(QMainWindow):
         self.check_execute_button()
 
     def check_execute_button(self):
-        # 実行ボタンの有効/無効を設定
-        self.execute_btn.setEnabled(
-            bool(self.excel_file) and
-            bool(self.download_dir) and
-            bool(self.selected_sheets)
-        )
-
-    def execute_process(self):
-        # 処理の実行
-        self.worker = WorkerThread(
+        # 見積もり・実行ボタンの有効/無効を設定
+        ready = bool(self.excel_file) and bool(self.download_dir) and bool(self.selected_sheets)
+        self.execute_btn.setEnabled(ready)
+        self.plan_btn.setEnabled(ready)
+
+    def create_worker(self, plan_only=False):
+        """画面の設定からワーカースレッドを作る"""
+        worker = WorkerThread(
             self.excel_file,
             self.download_dir,
             self.selected_sheets,
-            self.check_l_column.isChecked()
+            self.check_l_column.isChecked(),
+            self.max_workers_spin.value(),
+            self.force_refresh.isChecked(),
+            self.cache_max_gb_spin.value(),
+            self.metadata_only.isChecked(),
+            self.excel_processor,
+            self.resume.isChecked(),
+            write_report=self.write_report.isChecked(),
+            metrics_in_results=self.metrics_in_results.isChecked(),
+            schedule=self.schedule_combo.currentData(),
+            export_format=self.export_combo.currentData(),
+            save_mode=self.save_mode_combo.currentData(),
+            # 条件が変わっていれば、エンジンが見積もりを使わずにリンクを収集し直す
+            plan=None if plan_only else self.plan,
+            plan_only=plan_only
         )
-        self.worker.update_progress.connect(self.update_progress)
+        worker.update_progress.connect(self.update_progress)
+        return worker
+
+    def set_controls_enabled(self, enabled):
+        """処理中は設定を変更できないようにする"""
+        for widget in (
+            self.execute_btn, self.plan_btn, self.file_btn, self.save_btn, self.max_workers_spin,
+            self.schedule_combo, self.force_refresh, self.cache_max_gb_spin, self.metadata_only, self.resume,
+            self.write_report, self.metrics_in_results, self.export_combo, self.save_mode_combo,
+            *self.sheet_checkboxes
+        ):
+            widget.setEnabled(enabled)
+
+    def plan_process(self):
+        # ダウンロードせずに見積もる
+        self.worker = self.create_worker(plan_only=True)
+        self.worker.plan_ready.connect(self.plan_ready)
+        self.worker.finished.connect(self.plan_finished)
+
+        self.set_controls_enabled(False)
+        self.status_text.clear()
+        self.metrics_label.setText("")
+        self.status_text.append("見積もりを開始します...")
+        self.worker.start()
+
+    def plan_ready(self, plan):
+        self.plan = plan
+
+    def plan_finished(self, success, message):
+        self.set_controls_enabled(True)
+        if success:
+            self.status_text.append(message)
+            QMessageBox.information(self, "見積もり", message)
+        else:
+            self.status_text.append(f"エラー: {message}")
+            QMessageBox.critical(self, "エラー", message)
+
+    def execute_process(self):
+        # 処理の実行
+        self.worker = self.create_worker()
         self.worker.finished.connect(self.process_finished)
         self.worker.file_processed.connect(self.update_file_status)
+        self.worker.metrics_updated.connect(self.update_metrics)
 
         # UIの状態を更新
-        self.execute_btn.setEnabled(False)
-        self.file_btn.setEnabled(False)
-        self.save_btn.setEnabled(False)
-        for checkbox in self.sheet_checkboxes:
-            checkbox.setEnabled(False)
+        self.set_controls_enabled(False)
 
         self.status_text.clear()
+        self.metrics_label.setText("")
         self.status_text.append("処理を開始します...")
 
         # 処理開始
@@ -284,16 +382,24 @@ class MainWindow(QMainWindow):
         self.progress_bar.setValue(value)
         self.status_text.append(message)
 
+    def update_metrics(self, snapshot):
+        eta = snapshot['eta_seconds']
+        size_text = ""
+        if snapshot['total_bytes']:
+            size_text = (f"（{snapshot['done_bytes'] / 1024 ** 2:.1f}/"
+                         f"{snapshot['total_bytes'] / 1024 ** 2:.1f} MB）")
+        self.metrics_label.setText(
+            f"{snapshot['done_files']}/{snapshot['total_files']} ファイル{size_text}  "
+            f"{snapshot['files_per_second']:.1f} ファイル/秒  {snapshot['mb_per_second']:.2f} MB/秒  "
+            f"残り約 {format_duration(eta) if eta is not None else '--:--'}"
+        )
+
     def update_file_status(self, sheet_name, row_num, file_name, status):
         self.status_text.append(f"シート「{sheet_name}」の {row_num} 行目: {file_name} - {status}")
 
     def process_finished(self, success, message):
         # UIの状態を元に戻す
-        self.execute_btn.setEnabled(True)
-        self.file_btn.setEnabled(True)
-        self.save_btn.setEnabled(True)
-        for checkbox in self.sheet_checkboxes:
-            checkbox.setEnabled(True)
+        self.set_controls_enabled(True)
 
         # 結果を表示
         if success:
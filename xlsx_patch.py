@@ -0,0 +1,568 @@
+import html
+import posixpath
+import re
+
+import xlsx_writer
+from xlsx_reader import (
+    NS_PKG_REL, NS_REL, REL_TYPE_WORKSHEET, column_index, column_letter, find_workbook_part, read_sheet_parts,
+    rels_part_name,
+)
+
+# 書き換える列（J列: ファイル名とハイパーリンク、L列: 再生時間）
+LINK_COLUMN = 10
+DURATION_COLUMN = 12
+
+REL_TYPE_HYPERLINK = NS_REL + "/hyperlink"
+CONTENT_TYPES_PART = '[Content_Types].xml'
+CONTENT_TYPE_WORKSHEET = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+CONTENT_TYPE_RELS = "application/vnd.openxmlformats-package.relationships+xml"
+
+_CHUNK_SIZE = 1024 * 1024
+# 書き出しをまとめる大きさ（行ごとに圧縮処理を呼ばないため）
+_WRITE_BUFFER_SIZE = 1024 * 1024
+
+_ILLEGAL_XML_CHARS_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_CELL_REF_RE = re.compile(r'([A-Z]+)(\d+)$')
+
+# シートのXML（バイト列）に適用するパターン
+# Excelが書き出す一般的な形式（名前空間の接頭辞なし、行とセルにr属性あり）を前提とする
+_HEAD_RE = re.compile(rb'<(\w+:)?worksheet\b[^>]*>|<dimension\b[^>]*>|<sheetData\b[^>]*?(/?)>')
+_ROW_OR_END_RE = re.compile(rb'<row\b[^>]*?(/?)>|</sheetData>')
+_SHEET_DATA_END_RE = re.compile(rb'</sheetData>')
+_ROW_TAG_RE = re.compile(rb'<row\b([^>]*?)(/?)>')
+_ROW_NUM_RE = re.compile(rb'\sr="(\d+)"')
+_SPANS_ATTR_RE = re.compile(rb'\sspans="[^"]*"')
+_CELL_RE = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.DOTALL)
+_CELL_REF_ATTR_RE = re.compile(rb'\sr="([A-Z]+)(\d+)"')
+_STYLE_ATTR_RE = re.compile(rb'\ss="\d+"')
+_FORMULA_RE = re.compile(rb'<f\b')
+_HYPERLINK_RE = re.compile(rb'<hyperlink\b([^>]*?)(?:/>|>.*?</hyperlink>)', re.DOTALL)
+_REF_ATTR_RE = re.compile(rb'\sref="([^"]+)"')
+_REL_ID_ATTR_RE = re.compile(rb'\s\w+:id="([^"]+)"')
+_NS_REL_PREFIX_RE = re.compile(rb'\sxmlns:(\w+)="' + re.escape(NS_REL.encode('ascii')) + rb'"')
+_TAG_RE = re.compile(rb'<(/?)([A-Za-z_][\w.:-]*)[^>]*?(/?)>')
+# ワークシートの子要素のうち、hyperlinksより後ろに置くもの（スキーマで順番が決まっている）
+_AFTER_HYPERLINKS = {
+    b'printOptions', b'pageMargins', b'pageSetup', b'headerFooter', b'rowBreaks', b'colBreaks',
+    b'customProperties', b'cellWatches', b'ignoredErrors', b'smartTags', b'drawing', b'legacyDrawing',
+    b'legacyDrawingHF', b'drawingHF', b'picture', b'oleObjects', b'controls', b'webPublishItems', b'tableParts',
+    b'extLst',
+}
+
+# .rels・ブック定義・[Content_Types].xmlに適用するパターン
+_PREFIXED_PACKAGE_RE = re.compile(rb'<\w+:(?:Relationships|Relationship|Types|workbook|sheets)\b')
+_RELATIONSHIP_RE = re.compile(rb'<Relationship\b[^>]*?\sId="([^"]+)"[^>]*?/>')
+_RELATIONSHIPS_EMPTY_RE = re.compile(rb'<Relationships\b([^>]*?)/>')
+_SHEET_ID_ATTR_RE = re.compile(rb'<sheet\b[^>]*?\ssheetId="(\d+)"')
+_RELS_DEFAULT_RE = re.compile(rb'<Default\b[^>]*?\sExtension="rels"')
+
+
+class PatchUnsupported(Exception):
+    """ワークブックの形式が部分的な書き換えの前提に合わない（ワークブック全体の保存に切り替える）"""
+
+
+def _escape(text):
+    return html.escape(_ILLEGAL_XML_CHARS_RE.sub('', str(text)), quote=True)
+
+
+def _text_cell(ref, text, style=b''):
+    """文字列（インライン文字列）のセルのXML"""
+    return (
+        f'<c r="{ref}"'.encode('ascii') + style +
+        f' t="inlineStr"><is><t xml:space="preserve">{_escape(text)}</t></is></c>'.encode('utf-8')
+    )
+
+
+def _cell_updates(update):
+    """(ファイル名, URL, 再生時間)から、{列番号: 書き込む文字列}を返す（再生時間がなければL列は変更しない）"""
+    file_name, _, duration = update
+    values = {LINK_COLUMN: file_name}
+    if duration:
+        values[DURATION_COLUMN] = duration
+    return values
+
+
+def _new_row(row_num, update):
+    """シートにない行を新しく作る"""
+    cells = b''.join(
+        _text_cell(f"{column_letter(col)}{row_num}", text) for col, text in sorted(_cell_updates(update).items())
+    )
+    return f'<row r="{row_num}">'.encode('ascii') + cells + b'</row>'
+
+
+def _patch_row(row_xml, row_num, update):
+    """既存の行のJ列・L列のセルを置き換える（他のセルと書式はそのまま残す）"""
+    tag = _ROW_TAG_RE.match(row_xml)
+    body = b'' if tag.group(2) else row_xml[tag.end():-len(b'</row>')]
+
+    cells = {}
+    covered = 0
+    for match in _CELL_RE.finditer(body):
+        if body[covered:match.start()].strip():
+            raise PatchUnsupported(f"{row_num}行目にセル以外の要素があります")
+        covered = match.end()
+        ref = _CELL_REF_ATTR_RE.search(match.group(1))
+        if not ref or int(ref.group(2)) != row_num:
+            raise PatchUnsupported(f"{row_num}行目にr属性のないセルがあります")
+        cells[column_index(ref.group(1).decode('ascii'))] = match
+    if body[covered:].strip():
+        raise PatchUnsupported(f"{row_num}行目にセル以外の要素があります")
+
+    xml = {col: match.group(0) for col, match in cells.items()}
+    for col, text in _cell_updates(update).items():
+        ref = f"{column_letter(col)}{row_num}"
+        style = b''
+        existing = cells.get(col)
+        if existing is not None:
+            if existing.group(2) and _FORMULA_RE.search(existing.group(2)):
+                # 数式（共有数式の基準セルを含む）を消すと他のセルに影響するため、ここでは扱わない
+                raise PatchUnsupported(f"{ref}に数式があります")
+            style_attr = _STYLE_ATTR_RE.search(existing.group(1))
+            if style_attr:
+                style = style_attr.group(0)
+        xml[col] = _text_cell(ref, text, style)
+
+    # 列の範囲（spans）は省略できる属性なので、セルを追加しても食い違わないように削除する
+    attrs = _SPANS_ATTR_RE.sub(b'', tag.group(1))
+    return b'<row' + attrs + b'>' + b''.join(xml[col] for col in sorted(xml)) + b'</row>'
+
+
+def _expand_dimension(tag, rows, max_col):
+    """dimension要素の範囲を、書き込む行と列が含まれるように広げる"""
+    ref = _REF_ATTR_RE.search(tag)
+    if not ref:
+        return tag
+    first, _, last = ref.group(1).decode('ascii').partition(':')
+    first_match = _CELL_REF_RE.match(first)
+    last_match = _CELL_REF_RE.match(last or first)
+    if not first_match or not last_match:
+        return tag
+    new_ref = (
+        f"{column_letter(min(column_index(first_match.group(1)), LINK_COLUMN))}"
+        f"{min(int(first_match.group(2)), rows[0])}:"
+        f"{column_letter(max(column_index(last_match.group(1)), max_col))}"
+        f"{max(int(last_match.group(2)), rows[-1])}"
+    )
+    return tag[:ref.start(1)] + new_ref.encode('ascii') + tag[ref.end(1):]
+
+
+class _SheetStream:
+    """シートのXMLを先頭から読み進め、変更しない部分はそのまま書き出す"""
+
+    def __init__(self, src, out):
+        self._src = src
+        self._out = out
+        self._pending = []
+        self._pending_size = 0
+        self.buf = b''
+        self.pos = 0  # ここより前は書き出し済み（または置き換え済み）
+
+    def _fill(self):
+        """次のチャンクを読み足す（posより前は捨て、posが0になる）。ファイルの終わりならFalse"""
+        chunk = self._src.read(_CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def search(self, pattern):
+        """patternが見つかるまでの部分をそのまま書き出し、posをマッチの先頭に進める（見つからなければNone）"""
+        while True:
+            match = pattern.search(self.buf, self.pos)
+            if match:
+                self.emit(match.start())
+                return match
+            # 途中で切れているかもしれない最後のタグの手前までを書き出してから読み足す
+            safe = self.buf.rfind(b'<', self.pos)
+            self.emit(len(self.buf) if safe == -1 else safe)
+            if not self._fill():
+                return None
+
+    def find(self, token, start):
+        """start以降でtokenの位置を探す（必要なら読み足す）。見つからなければ-1"""
+        while True:
+            index = self.buf.find(token, start)
+            if index != -1:
+                return index
+            start = max(start, len(self.buf) - len(token) + 1)
+            shift = self.pos
+            if not self._fill():
+                return -1
+            start -= shift
+
+    def read_rest(self):
+        """残りをすべて読み込んで返す（書き出さない）"""
+        rest = [self.buf[self.pos:]]
+        while True:
+            chunk = self._src.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            rest.append(chunk)
+        self.buf = b''
+        self.pos = 0
+        return b''.join(rest)
+
+    def emit(self, end):
+        """posからendまでをそのまま書き出す"""
+        self.write(self.buf[self.pos:end])
+        self.pos = end
+
+    def skip(self, end):
+        """posからendまでを書き出さずに読み飛ばす（置き換える部分）"""
+        self.pos = end
+
+    def write(self, data):
+        if not data:
+            return
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= _WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._out.write(b''.join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+
+def _top_level_tag_at(tail, names):
+    """ワークシートの直下の要素のうち、namesのいずれかの開始位置（なければ</worksheet>の位置、どちらもなければ-1）"""
+    depth = 0
+    for match in _TAG_RE.finditer(tail):
+        closing, name, empty = match.groups()
+        if closing:
+            if depth == 0:
+                return match.start() if name == b'worksheet' else -1
+            depth -= 1
+        else:
+            if depth == 0 and name in names:
+                return match.start()
+            if not empty:
+                depth += 1
+    return -1
+
+
+def _patch_hyperlinks(tail, links, rel_prefix):
+    """sheetDataより後ろの部分のハイパーリンクを置き換える
+
+    Args:
+        tail: </sheetData>より後ろのXML
+        links: {セル参照: (リレーションID, ツールチップ)}
+        rel_prefix: ルート要素でリレーションの名前空間に付けられた接頭辞（なければNone）
+
+    Returns:
+        (書き換えたXML, 使われなくなったリレーションIDの集合)
+    """
+    removed = set()
+
+    def drop(match):
+        ref = _REF_ATTR_RE.search(match.group(1))
+        if not ref or ref.group(1).decode('ascii') not in links:
+            return match.group(0)
+        rel_id = _REL_ID_ATTR_RE.search(match.group(1))
+        if rel_id:
+            removed.add(rel_id.group(1).decode('ascii'))
+        return b''
+
+    tail = _HYPERLINK_RE.sub(drop, tail)
+    # 他の要素（別のセルのハイパーリンク、図形など）から参照されているリレーションは残す
+    removed -= {rel_id.decode('ascii') for rel_id in _REL_ID_ATTR_RE.findall(tail)}
+
+    if rel_prefix:
+        rel_attr = rel_prefix.decode('ascii') + ':id'
+    else:
+        rel_attr = f'xmlns:r="{NS_REL}" r:id'
+    elements = ''.join(
+        f'<hyperlink ref="{ref}" {rel_attr}="{rel_id}" tooltip="{_escape(tooltip)}"/>'
+        for ref, (rel_id, tooltip) in links.items()
+    ).encode('utf-8')
+
+    end = tail.find(b'</hyperlinks>')
+    if end != -1:
+        return tail[:end] + elements + tail[end:], removed
+    empty = re.search(rb'<hyperlinks\s*/>', tail)
+    if empty:
+        return tail[:empty.start()] + b'<hyperlinks>' + elements + b'</hyperlinks>' + tail[empty.end():], removed
+    at = _top_level_tag_at(tail, _AFTER_HYPERLINKS)
+    if at == -1:
+        raise PatchUnsupported("ハイパーリンクを追加する位置が見つかりません")
+    return tail[:at] + b'<hyperlinks>' + elements + b'</hyperlinks>' + tail[at:], removed
+
+
+def _patch_sheet(src, out, updates, rel_ids):
+    """シートのXMLを読みながら、更新する行だけを書き換えて書き出す
+
+    Args:
+        src: 元のシートのXML（読み込み用のファイルオブジェクト）
+        out: 書き込み先
+        updates: {行番号: (ファイル名, URL, 再生時間)}
+        rel_ids: {行番号: 追加するハイパーリンクのリレーションID}
+
+    Returns:
+        使われなくなったハイパーリンクのリレーションIDの集合
+    """
+    stream = _SheetStream(src, out)
+    rows = sorted(updates)
+    max_col = DURATION_COLUMN if any(update[2] for update in updates.values()) else LINK_COLUMN
+    rel_prefix = None
+
+    # sheetDataの手前まで（ルート要素の名前空間を確認し、dimensionの範囲を広げる）
+    while True:
+        match = stream.search(_HEAD_RE)
+        if match is None:
+            raise PatchUnsupported("sheetDataが見つかりません")
+        tag = match.group(0)
+        if tag.startswith(b'<sheetData'):
+            break
+        if tag.startswith(b'<dimension'):
+            stream.write(_expand_dimension(tag, rows, max_col))
+            stream.skip(match.end())
+        elif match.group(1):
+            raise PatchUnsupported("名前空間の接頭辞付きのシートには対応していません")
+        else:
+            prefix = _NS_REL_PREFIX_RE.search(tag)
+            rel_prefix = prefix.group(1) if prefix else None
+            stream.emit(match.end())
+
+    index = 0
+    if match.group(2):  # <sheetData/>（空のシート）
+        stream.skip(match.end())
+        stream.write(b'<sheetData>' + b''.join(_new_row(row, updates[row]) for row in rows) + b'</sheetData>')
+    else:
+        stream.emit(match.end())
+        while True:
+            # 更新する行が残っていなければ、行ごとに調べずに</sheetData>まで書き出す
+            match = stream.search(_ROW_OR_END_RE if index < len(rows) else _SHEET_DATA_END_RE)
+            if match is None:
+                raise PatchUnsupported("sheetDataの終わりが見つかりません")
+            if match.group(0) == b'</sheetData>':
+                stream.write(b''.join(_new_row(row, updates[row]) for row in rows[index:]))
+                stream.emit(match.end())
+                break
+
+            row_num = _ROW_NUM_RE.search(match.group(0))
+            if row_num is None:
+                raise PatchUnsupported("r属性のない行があります")
+            row_num = int(row_num.group(1))
+            # シートにない行は、行番号の順になる位置に追加する
+            while index < len(rows) and rows[index] < row_num:
+                stream.write(_new_row(rows[index], updates[rows[index]]))
+                index += 1
+            if index < len(rows) and rows[index] == row_num:
+                index += 1
+                if match.group(1):  # <row .../>（セルのない行）
+                    end = match.end()
+                else:
+                    close = stream.find(b'</row>', match.end())
+                    if close == -1:
+                        raise PatchUnsupported(f"{row_num}行目の終わりが見つかりません")
+                    end = close + len(b'</row>')
+                stream.write(_patch_row(stream.buf[stream.pos:end], row_num, updates[row_num]))
+                stream.skip(end)
+            else:
+                stream.emit(match.end())
+
+    links = {
+        f"{column_letter(LINK_COLUMN)}{row}": (rel_ids[row], f"Open {updates[row][0]}") for row in rows
+    }
+    tail, removed = _patch_hyperlinks(stream.read_rest(), links, rel_prefix)
+    stream.write(tail)
+    stream.flush()
+    return removed
+
+
+def _new_rel_ids(existing, count):
+    """既存のIDと重ならないリレーションIDをcount個返す"""
+    ids = []
+    number = 1
+    while len(ids) < count:
+        rel_id = f"rId{number}"
+        if rel_id not in existing:
+            ids.append(rel_id)
+        number += 1
+    return ids
+
+
+def _empty_rels():
+    return (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<Relationships xmlns="{NS_PKG_REL}"></Relationships>'
+    ).encode('utf-8')
+
+
+def _rel_ids_in(rels_xml):
+    if _PREFIXED_PACKAGE_RE.search(rels_xml):
+        raise PatchUnsupported("名前空間の接頭辞付きの.relsには対応していません")
+    return {rel_id.decode('ascii') for rel_id in _RELATIONSHIP_RE.findall(rels_xml)}
+
+
+def _relationship(rel_id, rel_type, target, external):
+    mode = ' TargetMode="External"' if external else ''
+    return f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="{_escape(target)}"{mode}/>'.encode('utf-8')
+
+
+def _patch_rels(rels_xml, added, removed=()):
+    """リレーションを追加・削除した.relsのXMLを返す
+
+    Args:
+        added: [(リレーションID, 種類, ターゲット, 外部リンクかどうか)]
+        removed: 削除するリレーションIDの集合
+    """
+    if removed:
+        rels_xml = _RELATIONSHIP_RE.sub(
+            lambda match: b'' if match.group(1).decode('ascii') in removed else match.group(0), rels_xml
+        )
+    elements = b''.join(_relationship(*rel) for rel in added)
+
+    end = rels_xml.rfind(b'</Relationships>')
+    if end != -1:
+        return rels_xml[:end] + elements + rels_xml[end:]
+    empty = _RELATIONSHIPS_EMPTY_RE.search(rels_xml)
+    if empty is None:
+        raise PatchUnsupported(".relsの形式が不正です")
+    return (
+        rels_xml[:empty.start()] + b'<Relationships' + empty.group(1) + b'>' + elements + b'</Relationships>' +
+        rels_xml[empty.end():]
+    )
+
+
+def _patch_content_types(types_xml, overrides, rels_default=False):
+    """[Content_Types].xmlにパーツの種類を追加する
+
+    Args:
+        overrides: [(パーツ名, 種類)]
+        rels_default: Trueの場合、.relsの既定の種類がなければ追加する
+    """
+    if _PREFIXED_PACKAGE_RE.search(types_xml):
+        raise PatchUnsupported("名前空間の接頭辞付きの[Content_Types].xmlには対応していません")
+    elements = ''.join(
+        f'<Override PartName="/{_escape(part)}" ContentType="{content_type}"/>' for part, content_type in overrides
+    )
+    if rels_default and not _RELS_DEFAULT_RE.search(types_xml):
+        elements = f'<Default Extension="rels" ContentType="{CONTENT_TYPE_RELS}"/>' + elements
+    end = types_xml.rfind(b'</Types>')
+    if end == -1:
+        raise PatchUnsupported("[Content_Types].xmlの形式が不正です")
+    return types_xml[:end] + elements.encode('utf-8') + types_xml[end:]
+
+
+def _add_sheet_entry(workbook_xml, sheet_name, rel_id):
+    """ブック定義（workbook.xml）のシート一覧の末尾にシートを追加する"""
+    if _PREFIXED_PACKAGE_RE.search(workbook_xml):
+        raise PatchUnsupported("名前空間の接頭辞付きのブック定義には対応していません")
+    sheet_id = max((int(value) for value in _SHEET_ID_ATTR_RE.findall(workbook_xml)), default=0) + 1
+    prefix = _NS_REL_PREFIX_RE.search(workbook_xml)
+    rel_attr = f"{prefix.group(1).decode('ascii')}:id" if prefix else f'xmlns:r="{NS_REL}" r:id'
+    element = f'<sheet name="{_escape(sheet_name)}" sheetId="{sheet_id}" {rel_attr}="{rel_id}"/>'.encode('utf-8')
+    end = workbook_xml.find(b'</sheets>')
+    if end == -1:
+        raise PatchUnsupported("ブック定義にシート一覧がありません")
+    return workbook_xml[:end] + element + workbook_xml[end:]
+
+
+def patch_workbook(file_path, sheet_updates, sheet_writers=None):
+    """xlsxのうち、変更するシートのパーツだけを書き換えて保存する
+
+    セルを更新するシートはXMLを先頭から読みながら、対象の行のJ列（ファイル名）とL列（再生時間）のセルと
+    ハイパーリンク（シートの.rels）だけを書き換える。それ以外のパーツは圧縮済みのデータをそのままコピーするので、
+    ワークブック全体を読み込まず、使用メモリは変更するシートの大きさにだけ比例する。
+    想定外の形式（名前空間の接頭辞付きのXML、r属性のない行・セル、数式のあるセルなど）を見つけた場合は、
+    ファイルを変更せずにPatchUnsupportedを送出する。
+
+    Args:
+        file_path: xlsxファイルのパス
+        sheet_updates: {シート名: {行番号: (ファイル名, URL, 再生時間)}}
+        sheet_writers: {シート名: 書き込み関数(f)}（シートのXML全体を書き出す。既存のシートは内容を置き換え、
+            なければブックの末尾に追加する）
+    """
+    sheet_updates = {name: rows for name, rows in sheet_updates.items() if rows}
+    sheet_writers = sheet_writers or {}
+    if not sheet_updates and not sheet_writers:
+        return
+
+    def rewrite(src, dst):
+        names = set(src.namelist())
+        sheet_parts = dict(read_sheet_parts(src))
+        writers = {}  # 丸ごと置き換えるパーツ -> 書き込み関数
+        patches = {}  # セルを更新するシートのパーツ -> (更新内容, .relsのパーツ名, 元の.rels, {行番号: リレーションID})
+        new_parts = []  # 末尾に追加するパーツ（パーツ名, 書き込み関数）
+        overrides = []  # [Content_Types].xmlに追加する種類
+        new_rels = False
+
+        for sheet_name, updates in sheet_updates.items():
+            part = sheet_parts.get(sheet_name)
+            if part is None or part not in names:
+                raise PatchUnsupported(f"シート「{sheet_name}」のパーツが見つかりません")
+            rels_part = rels_part_name(part)
+            rels_xml = src.read(rels_part) if rels_part in names else None
+            new_rels = new_rels or rels_xml is None
+            existing = _rel_ids_in(rels_xml) if rels_xml is not None else set()
+            rows = sorted(updates)
+            patches[part] = (updates, rels_part, rels_xml, dict(zip(rows, _new_rel_ids(existing, len(rows)))))
+
+        added_sheets = []
+        for sheet_name, writer in sheet_writers.items():
+            part = sheet_parts.get(sheet_name)
+            if part is not None and part in names:
+                writers[part] = writer
+                continue
+            if sheet_name in sheet_parts:
+                raise PatchUnsupported(f"シート「{sheet_name}」はワークシートではありません")
+            # 既存のワークシートと同じフォルダに、使われていない名前でパーツを作る
+            folder = next((posixpath.dirname(p) for p in sheet_parts.values() if p), 'xl/worksheets')
+            number = 1
+            while f"{folder}/sheet{number}.xml" in names:
+                number += 1
+            part = f"{folder}/sheet{number}.xml"
+            names.add(part)
+            new_parts.append((part, writer))
+            overrides.append((part, CONTENT_TYPE_WORKSHEET))
+            added_sheets.append((sheet_name, part))
+
+        if added_sheets:
+            workbook_part = find_workbook_part(src)
+            workbook_rels_part = rels_part_name(workbook_part)
+            workbook_xml = src.read(workbook_part)
+            workbook_rels = src.read(workbook_rels_part)
+            rel_ids = _new_rel_ids(_rel_ids_in(workbook_rels), len(added_sheets))
+            added = []
+            for (sheet_name, part), rel_id in zip(added_sheets, rel_ids):
+                workbook_xml = _add_sheet_entry(workbook_xml, sheet_name, rel_id)
+                target = posixpath.relpath(part, posixpath.dirname(workbook_part))
+                added.append((rel_id, REL_TYPE_WORKSHEET, target, False))
+            workbook_rels = _patch_rels(workbook_rels, added)
+            writers[workbook_part] = lambda f, data=workbook_xml: f.write(data)
+            writers[workbook_rels_part] = lambda f, data=workbook_rels: f.write(data)
+
+        if overrides or new_rels:
+            types_xml = _patch_content_types(src.read(CONTENT_TYPES_PART), overrides, rels_default=new_rels)
+            writers[CONTENT_TYPES_PART] = lambda f: f.write(types_xml)
+
+        # 更新するシートの.relsは、シートを書き出して不要になったリレーションが分かってから書く
+        deferred = {rels_part for _, rels_part, _, _ in patches.values()}
+        for info in src.infolist():
+            name = info.filename
+            if name in deferred:
+                continue
+            if name in patches:
+                updates, rels_part, rels_xml, rel_ids = patches[name]
+                with src.open(info) as sheet_xml:
+                    removed = xlsx_writer.write_member(
+                        dst, name, lambda f: _patch_sheet(sheet_xml, f, updates, rel_ids), info.date_time
+                    )
+                added = [
+                    (rel_ids[row], REL_TYPE_HYPERLINK, updates[row][1], True) for row in sorted(updates)
+                ]
+                data = _patch_rels(rels_xml if rels_xml is not None else _empty_rels(), added, removed)
+                xlsx_writer.write_member(dst, rels_part, lambda f: f.write(data), info.date_time)
+            elif name in writers:
+                xlsx_writer.write_member(dst, name, writers[name], info.date_time)
+            else:
+                xlsx_writer.copy_member(src, dst, info)
+
+        for part, writer in new_parts:
+            xlsx_writer.write_member(dst, part, writer)
+
+    xlsx_writer.rewrite_zip(file_path, rewrite)
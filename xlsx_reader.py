@@ -0,0 +1,416 @@
+import html
+import io
+import posixpath
+import re
+import zipfile
+from xml.parsers import expat
+from xml.etree.ElementTree import iterparse
+
+# xlsx（Office Open XML）内部の名前空間
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+REL_TYPE_WORKSHEET = NS_REL + "/worksheet"
+
+_CELL_REF_RE = re.compile(r'([A-Z]+)(\d+)')
+
+# 高速スキャン用のパターン（バイト列のXMLに直接適用する）
+_SCAN_CHUNK_SIZE = 1024 * 1024
+_NO_REF_CELL_RE = re.compile(rb'<c(?:\s(?![^>]*\br=)[^>]*)?/?>|<\w+:(?:worksheet|c)\b')
+_TYPE_ATTR_RE = re.compile(rb'\st="(\w+)"')
+_VALUE_RE = re.compile(rb'<v>(.*?)</v>', re.DOTALL)
+_FORMULA_RE = re.compile(rb'<f(?:\s[^>]*)?>(.*?)</f>', re.DOTALL)
+_INLINE_TEXT_RE = re.compile(rb'<t(?:\s[^>]*)?>(.*?)</t>', re.DOTALL)
+_PHONETIC_RE = re.compile(rb'<rPh\b.*?</rPh>', re.DOTALL)
+_HYPERLINK_RE = re.compile(rb'<hyperlink\s([^>]*?)/?>')
+_REF_ATTR_RE = re.compile(rb'\bref="([^"]+)"')
+_REL_ID_ATTR_RE = re.compile(rb'\b\w+:id="([^"]+)"')
+
+
+def _local(tag):
+    """名前空間を除いたタグ名を返す"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def column_index(letters):
+    """列記号（例: 'J'）を1始まりの列番号に変換する"""
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - 64)
+    return index
+
+
+def column_letter(index):
+    """1始まりの列番号を列記号（例: 27 -> 'AA'）に変換する"""
+    letters = ''
+    while index > 0:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def rels_part_name(part_name):
+    """パーツに対応する.relsファイルのパーツ名（例: xl/worksheets/_rels/sheet1.xml.rels）"""
+    base_dir, base_name = posixpath.split(part_name)
+    return posixpath.join(base_dir, '_rels', base_name + '.rels')
+
+
+def _read_rels(zf, part_name):
+    """パーツに対応する.relsファイルを読み、{rId: (Target, TargetMode)}を返す"""
+    try:
+        data = zf.read(rels_part_name(part_name))
+    except KeyError:
+        return {}
+
+    rels = {}
+    for _, elem in iterparse(io.BytesIO(data)):
+        if _local(elem.tag) == 'Relationship':
+            rels[elem.get('Id')] = (elem.get('Target'), elem.get('TargetMode'), elem.get('Type'))
+    return rels
+
+
+def _resolve_target(base_part, target):
+    """リレーションのTargetをzip内のパーツ名に変換する"""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+
+def find_workbook_part(zf):
+    """パッケージのリレーションからworkbook.xmlのパーツ名を取得する"""
+    for target, _, rel_type in _read_rels(zf, '').values():
+        if rel_type and rel_type.endswith('/officeDocument'):
+            return _resolve_target('', target)
+    return 'xl/workbook.xml'
+
+
+def read_sheet_parts(zf):
+    """ワークシート名とzip内のパーツ名の対応を、ブック内の順番どおりに返す
+
+    Returns:
+        [(シート名, パーツ名 または None)] のリスト（グラフシートなどワークシート以外はNone）
+    """
+    workbook_part = find_workbook_part(zf)
+    rels = _read_rels(zf, workbook_part)
+
+    sheets = []
+    with zf.open(workbook_part) as f:
+        for _, elem in iterparse(f):
+            tag = _local(elem.tag)
+            if tag == 'sheet':
+                rel = rels.get(elem.get(f'{{{NS_REL}}}id'))
+                part = None
+                if rel and rel[2] == REL_TYPE_WORKSHEET:
+                    part = _resolve_target(workbook_part, rel[0])
+                sheets.append((elem.get('name'), part))
+            elif tag == 'sheets':
+                # シート一覧以降は読む必要がない
+                break
+    return sheets
+
+
+def _read_shared_strings(zf, needed):
+    """共有文字列テーブルから、必要なインデックスの文字列だけを取り出す"""
+    if not needed:
+        return {}
+
+    workbook_part = find_workbook_part(zf)
+    part = None
+    for target, _, rel_type in _read_rels(zf, workbook_part).values():
+        if rel_type and rel_type.endswith('/sharedStrings'):
+            part = _resolve_target(workbook_part, target)
+            break
+    if part is None or part not in zf.namelist():
+        return {}
+
+    strings = {}
+    index = 0
+    last = max(needed)
+    texts = []
+    in_phonetic = False
+    with zf.open(part) as f:
+        for event, elem in iterparse(f, events=('start', 'end')):
+            tag = _local(elem.tag)
+            if event == 'start':
+                if tag == 'si':
+                    texts = []
+                elif tag == 'rPh':
+                    in_phonetic = True
+                continue
+            if tag == 't':
+                # ふりがなは値に含めない
+                if not in_phonetic:
+                    texts.append(elem.text or '')
+            elif tag == 'rPh':
+                in_phonetic = False
+            elif tag == 'si':
+                if index in needed:
+                    strings[index] = ''.join(texts)
+                index += 1
+                elem.clear()
+                if index > last:
+                    break
+    return strings
+
+
+def _cell_value(cell_type, raw, formula, inline_text):
+    """セルの種類に応じて値を返す（共有文字列はインデックスのまま返す）"""
+    if formula is not None:
+        # openpyxlの通常読み込みと同じく数式そのものを値とする
+        return ('value', '=' + formula)
+    if cell_type == 'inlineStr':
+        return ('value', inline_text)
+    if raw is None:
+        return ('value', None)
+    if cell_type == 's':
+        return ('shared', int(raw))
+    if cell_type in ('str', 'e'):
+        return ('value', raw)
+    if cell_type == 'b':
+        return ('value', raw == '1')
+    try:
+        number = float(raw)
+    except ValueError:
+        return ('value', raw)
+    return ('value', int(number) if number.is_integer() else number)
+
+
+def _scan_sheet_events(zf, part, columns):
+    """シートXMLをexpatで逐次解析し、指定した列のセル値とハイパーリンク参照を取得する
+
+    名前空間の接頭辞付きのXMLや、セルのr属性が省略されたXMLも扱える汎用の経路。
+    """
+    values = {}
+    hyperlink_refs = []
+    # 巨大なシートでも要素オブジェクトを作らないよう、expatのコールバックで直接処理する
+    state = {
+        'row': 0, 'col': 0,
+        'cell': None,  # 対象列のセルを読んでいる間は(行番号, 列番号, 種類)
+        'text': None,  # v/f/t要素の文字列を集めている間はリスト
+        'raw': None, 'formula': None, 'inline': [],
+    }
+    c_tag, row_tag = f'{NS_MAIN} c', f'{NS_MAIN} row'
+    text_tags = {f'{NS_MAIN} v', f'{NS_MAIN} f', f'{NS_MAIN} t'}
+    hyperlink_tag, rel_id_attr = f'{NS_MAIN} hyperlink', f'{NS_REL} id'
+
+    def start(name, attrs):
+        if name == c_tag:
+            cell_ref = attrs.get('r')
+            match = _CELL_REF_RE.match(cell_ref) if cell_ref else None
+            if match:
+                state['col'] = column_index(match.group(1))
+                state['row'] = int(match.group(2))
+            else:
+                state['col'] += 1
+            if state['col'] in columns:
+                state['cell'] = (state['row'], state['col'], attrs.get('t'))
+                state['raw'] = state['formula'] = None
+                state['inline'] = []
+        elif state['cell'] is not None and name in text_tags:
+            state['text'] = []
+        elif name == row_tag:
+            r = attrs.get('r')
+            state['row'] = int(r) if r else state['row'] + 1
+            state['col'] = 0
+        elif name == hyperlink_tag:
+            rel_id = attrs.get(rel_id_attr)
+            if rel_id and attrs.get('ref'):
+                hyperlink_refs.append((attrs['ref'], rel_id))
+
+    def end(name):
+        cell = state['cell']
+        if cell is None:
+            return
+        if state['text'] is not None and name in text_tags:
+            text = ''.join(state['text'])
+            state['text'] = None
+            local = name[-1]
+            if local == 'v':
+                state['raw'] = text
+            elif local == 'f':
+                state['formula'] = text
+            else:
+                state['inline'].append(text)
+        elif name == c_tag:
+            row_num, col_num, cell_type = cell
+            value = _cell_value(cell_type, state['raw'], state['formula'], ''.join(state['inline']))
+            if value[1] is not None:
+                values[(row_num, col_num)] = value
+            state['cell'] = None
+
+    def characters(data):
+        if state['text'] is not None:
+            state['text'].append(data)
+
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = characters
+    with zf.open(part) as f:
+        parser.ParseFile(f)
+
+    return values, hyperlink_refs
+
+
+def _cell_value_from_xml(cell_type, body):
+    """セル要素の中身（<c>〜</c>の内側）から値を取り出す"""
+    formula = _FORMULA_RE.search(body)
+    if formula:
+        return _cell_value(cell_type, None, html.unescape(formula.group(1).decode('utf-8')), '')
+    if cell_type == 'inlineStr':
+        inline = ''.join(
+            html.unescape(t.decode('utf-8')) for t in _INLINE_TEXT_RE.findall(_PHONETIC_RE.sub(b'', body))
+        )
+        return _cell_value(cell_type, None, None, inline)
+    raw = _VALUE_RE.search(body)
+    return _cell_value(cell_type, html.unescape(raw.group(1).decode('utf-8')) if raw else None, None, '')
+
+
+def _scan_sheet_fast(zf, part, columns):
+    """対象列のセルだけを正規表現で拾い出す高速な経路
+
+    Excelが書き出す一般的な形式（名前空間の接頭辞なし、全セルにr属性あり）を前提とし、
+    それ以外の形式を検出した場合はNoneを返す。
+    """
+    letters = b'|'.join(column_letter(col).encode('ascii') for col in sorted(columns))
+    cell_re = re.compile(rb'<c\s[^>]*?\br="(' + letters + rb')(\d+)"[^>]*?(/?)>')
+    values = {}
+    hyperlink_refs = []
+
+    buffer = b''
+    with zf.open(part) as f:
+        while True:
+            chunk = f.read(_SCAN_CHUNK_SIZE)
+            at_end = not chunk
+            buffer += chunk
+            # 接頭辞付きの要素やr属性のないセルがあれば汎用の経路に任せる
+            if _NO_REF_CELL_RE.search(buffer):
+                return None
+
+            consumed = 0
+            pending = None  # 閉じタグが次のチャンクにある対象セルの開始位置
+            for match in cell_re.finditer(buffer):
+                if match.group(3):  # <c .../> の空セル
+                    consumed = match.end()
+                    continue
+                close = buffer.find(b'</c>', match.end())
+                if close == -1:
+                    pending = match.start()
+                    break
+                consumed = close + 4
+                type_match = _TYPE_ATTR_RE.search(match.group(0))
+                cell_type = type_match.group(1).decode('ascii') if type_match else None
+                value = _cell_value_from_xml(cell_type, buffer[match.end():close])
+                if value[1] is not None:
+                    values[(int(match.group(2)), column_index(match.group(1).decode('ascii')))] = value
+
+            if at_end:
+                for attrs in _HYPERLINK_RE.findall(buffer):
+                    ref = _REF_ATTR_RE.search(attrs)
+                    rel_id = _REL_ID_ATTR_RE.search(attrs)
+                    if ref and rel_id:
+                        hyperlink_refs.append((ref.group(1).decode('ascii'), rel_id.group(1).decode('ascii')))
+                break
+
+            # 未処理の部分（途中で切れたセルなど）は次のチャンクに持ち越す
+            # ハイパーリンクはシートの末尾にまとまっているので、見つかった以降はすべて持ち越す
+            carry_from = pending if pending is not None else max(consumed, buffer.rfind(b'<'))
+            links_at = buffer.find(b'<hyperlinks', consumed)
+            if links_at != -1:
+                carry_from = min(carry_from, links_at)
+            buffer = buffer[carry_from:]
+
+    return values, hyperlink_refs
+
+
+def _scan_sheet(zf, part, columns):
+    """シートから指定した列のセル値とハイパーリンクを取得する
+
+    Returns:
+        ({(行番号, 列番号): ('value'|'shared', 値)}, {(行番号, 列番号): ハイパーリンク先})
+    """
+    result = _scan_sheet_fast(zf, part, columns)
+    if result is None:
+        result = _scan_sheet_events(zf, part, columns)
+    values, hyperlink_refs = result
+
+    hyperlinks = {}
+    if hyperlink_refs:
+        rels = _read_rels(zf, part)
+        for ref, rel_id in hyperlink_refs:
+            rel = rels.get(rel_id)
+            if not rel:
+                continue
+            start, _, end = ref.partition(':')
+            start_match = _CELL_REF_RE.match(start)
+            end_match = _CELL_REF_RE.match(end or start)
+            if not start_match or not end_match:
+                continue
+            first_col, last_col = column_index(start_match.group(1)), column_index(end_match.group(1))
+            for col in columns:
+                if first_col <= col <= last_col:
+                    for row in range(int(start_match.group(2)), int(end_match.group(2)) + 1):
+                        hyperlinks[(row, col)] = rel[0]
+
+    return values, hyperlinks
+
+
+def scan_links(file_path, target_sheets, check_l_column=True, link_column=10, skip_column=12):
+    """J列（リンク）とL列（再生時間）だけを読み取り、ExcelProcessor.get_links_from_sheetsと同じ形式で返す
+
+    ワークブック全体を読み込まず、対象シートのXMLを逐次解析する。
+    """
+    links_data = []
+    columns = {link_column, skip_column}
+
+    with zipfile.ZipFile(file_path) as zf:
+        sheet_parts = dict(read_sheet_parts(zf))
+
+        scanned = []
+        needed_strings = set()
+        for sheet_name in target_sheets:
+            part = sheet_parts.get(sheet_name)
+            if not part:
+                continue
+            values, hyperlinks = _scan_sheet(zf, part, columns)
+            scanned.append((sheet_name, values, hyperlinks))
+            needed_strings.update(v[1] for v in values.values() if v[0] == 'shared')
+
+        shared_strings = _read_shared_strings(zf, needed_strings)
+
+    def resolve(value):
+        if value is None:
+            return None
+        kind, v = value
+        return shared_strings.get(v) if kind == 'shared' else v
+
+    for sheet_name, values, hyperlinks in scanned:
+        rows = sorted({row for row, _ in values} | {row for row, _ in hyperlinks})
+        for row_num in rows:
+            if row_num < 2:  # ヘッダー行をスキップ
+                continue
+
+            # L列に値がある場合はスキップ
+            if check_l_column and resolve(values.get((row_num, skip_column))):
+                continue
+
+            cell_value = resolve(values.get((row_num, link_column)))
+            target = hyperlinks.get((row_num, link_column))
+
+            # セルの値がURLかどうかチェック
+            if cell_value and isinstance(cell_value, str) and "drive.google.com/file" in cell_value:
+                url = cell_value
+            # ハイパーリンクがある場合
+            elif target and "drive.google.com/file" in target:
+                url = target
+            else:
+                continue
+
+            links_data.append({
+                'sheet_name': sheet_name,
+                'row_num': row_num,
+                'url': url
+            })
+
+    return links_data
@@ -0,0 +1,285 @@
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zipfile
+
+import polars as pl
+
+from xlsx_reader import NS_MAIN, column_letter
+
+# XMLで使えない制御文字（タブ・改行以外）
+_ILLEGAL_XML_CHARS = '[\x00-\x08\x0b\x0c\x0e-\x1f]'
+_XML_ESCAPES = (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'))
+
+# 一度に文字列へ変換する行数（メモリ使用量の上限）
+_ROWS_PER_BATCH = 50000
+# 圧縮済みのデータのままコピーする（zipfileの内部の属性を使う）ことを確認したPythonのバージョンの範囲
+# 範囲外のバージョンでは、公開APIで展開・再圧縮してコピーする（benchmarks/check_save.pyで確認できる）
+RAW_COPY_PYTHON_VERSIONS = ((3, 8), (3, 13))
+
+
+def _escape(text):
+    text = re.sub(_ILLEGAL_XML_CHARS, '', str(text))
+    for char, entity in _XML_ESCAPES:
+        text = text.replace(char, entity)
+    return text
+
+
+def _escape_expr(expr):
+    expr = expr.str.replace_all(_ILLEGAL_XML_CHARS, '')
+    for char, entity in _XML_ESCAPES:
+        expr = expr.str.replace_all(char, entity, literal=True)
+    return expr
+
+
+def _cell_expr(name, dtype, letter, row_ref):
+    """列のデータ型に応じて、セルのXMLを組み立てる式を返す（値がnullのセルは出力しない）"""
+    col = pl.col(name)
+    if dtype == pl.Boolean:
+        xml = pl.format(f'<c r="{letter}{{}}" t="b"><v>{{}}</v></c>', row_ref, col.cast(pl.Int8))
+    elif dtype.is_numeric():
+        if dtype.is_float():
+            # NaN・無限大はExcelで扱えないので空セルにする
+            col = pl.when(col.is_finite()).then(col)
+        xml = pl.format(f'<c r="{letter}{{}}"><v>{{}}</v></c>', row_ref, col)
+    else:
+        text = _escape_expr(col.cast(pl.Utf8))
+        xml = pl.format(
+            f'<c r="{letter}{{}}" t="inlineStr"><is><t xml:space="preserve">{{}}</t></is></c>', row_ref, text
+        )
+    return xml.fill_null('')
+
+
+def write_sheet_xml(f, df, column_width=20):
+    """Polarsのデータフレームから、ワークシートのXMLを逐次書き出す
+
+    openpyxlのセルオブジェクトを作らず、セルのXMLをPolarsの文字列演算で列ごとにまとめて組み立てる。
+
+    Args:
+        f: バイナリモードの書き込み先
+        df: 書き込むデータフレーム（列名がヘッダー行になる）
+        column_width: すべての列に設定する列幅
+
+    Returns:
+        書き込んだデータ行数（ヘッダーを除く）
+    """
+    letters = [column_letter(i) for i in range(1, df.width + 1)]
+    f.write(
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<worksheet xmlns="{NS_MAIN}">'.encode('utf-8')
+    )
+    if letters:
+        f.write(
+            f'<cols><col min="1" max="{len(letters)}" width="{column_width}" customWidth="1"/></cols>'.encode('utf-8')
+        )
+    f.write(b'<sheetData>')
+
+    if letters:
+        header = ''.join(
+            f'<c r="{letter}1" t="inlineStr"><is><t xml:space="preserve">{_escape(name)}</t></is></c>'
+            for letter, name in zip(letters, df.columns)
+        )
+        f.write(f'<row r="1">{header}</row>'.encode('utf-8'))
+
+        row_ref = pl.col('__row').cast(pl.Utf8)
+        cells = [
+            _cell_expr(name, dtype, letter, row_ref)
+            for name, dtype, letter in zip(df.columns, df.dtypes, letters)
+        ]
+        row_xml = pl.format('<row r="{}">{}</row>', row_ref, pl.concat_str(cells))
+        for offset in range(0, df.height, _ROWS_PER_BATCH):
+            batch = df.slice(offset, _ROWS_PER_BATCH).with_row_index('__row', offset=offset + 2)
+            xml = batch.select(row_xml.alias('xml')).to_series()
+            f.write(''.join(xml.to_list()).encode('utf-8'))
+
+    f.write(b'</sheetData></worksheet>')
+    return df.height
+
+
+def raw_copy_supported():
+    """このPythonで、zipのメンバーを圧縮済みのデータのままコピーするかどうか"""
+    oldest, newest = RAW_COPY_PYTHON_VERSIONS
+    return sys.implementation.name == 'cpython' and oldest <= sys.version_info[:2] <= newest
+
+
+def copy_member(src, dst, info):
+    """zip内のメンバーを、圧縮済みのデータのまま展開・再圧縮せずにコピーする
+
+    ZipFileの公開されていない属性（fp, start_dir, NameToInfo, _didModifyとZipInfo.FileHeader）を使うため、
+    動作を確認したCPython（RAW_COPY_PYTHON_VERSIONS）でだけ使う。それ以外のPythonや、これらの属性がない場合は、
+    公開APIで展開・再圧縮してコピーする。
+
+    Args:
+        src: 読み込み用に開いたZipFile
+        dst: 書き込み用に開いたZipFile（書き込み中のメンバーがないこと）
+        info: srcのメンバーのZipInfo
+    """
+    if not raw_copy_supported():
+        _copy_member_decompressed(src, dst, info)
+        return
+    # 書き込みを始める前にローカルヘッダーまで作っておき、内部の属性が使えない場合は何も書かずにフォールバックする
+    try:
+        if not all(hasattr(dst, name) for name in ('start_dir', 'NameToInfo', '_didModify')):
+            raise AttributeError("ZipFileの内部の属性が見つかりません")
+        out_info, data_offset, header = _raw_member_header(src, info)
+    except (AttributeError, TypeError) as e:
+        print(f"圧縮済みデータのコピーに対応していないため、展開してコピーします: {info.filename}: {str(e)}")
+        _copy_member_decompressed(src, dst, info)
+        return
+
+    src.fp.seek(data_offset)
+    dst.fp.seek(dst.start_dir)
+    out_info.header_offset = dst.fp.tell()
+    dst.fp.write(header)
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = src.fp.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise zipfile.BadZipFile(f"データが途中で終わっています: {info.filename}")
+        dst.fp.write(chunk)
+        remaining -= len(chunk)
+
+    # ZipFile.open(..., 'w')で書き込んだ場合と同じように、中央ディレクトリに載せる
+    dst.start_dir = dst.fp.tell()
+    dst.filelist.append(out_info)
+    dst.NameToInfo[out_info.filename] = out_info
+    dst._didModify = True
+
+
+def _raw_member_header(src, info):
+    """コピー先のZipInfo、コピー元でのデータの開始位置、コピー先のローカルヘッダーを返す（何も書き込まない）"""
+    # ローカルヘッダーの可変長部分（ファイル名・拡張フィールド）を飛ばしてデータの先頭に移動する
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"ローカルヘッダーが不正です: {info.filename}")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    data_offset = info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+
+    out_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    out_info.compress_type = info.compress_type
+    out_info.CRC = info.CRC
+    out_info.compress_size = info.compress_size
+    out_info.file_size = info.file_size
+    out_info.external_attr = info.external_attr
+    out_info.create_system = info.create_system
+    # サイズとCRCはローカルヘッダーに書くので、データ記述子（bit 3）は使わない
+    out_info.flag_bits = info.flag_bits & ~0x08
+    out_info.extra = _strip_zip64_extra(info.extra)
+    zip64 = max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT
+    return out_info, data_offset, out_info.FileHeader(zip64)
+
+
+def _copy_member_decompressed(src, dst, info):
+    """公開APIだけでメンバーをコピーする（展開して再圧縮する）"""
+    out_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    out_info.compress_type = info.compress_type
+    out_info.external_attr = info.external_attr
+    with src.open(info) as f_in, dst.open(out_info, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+
+def _strip_zip64_extra(extra):
+    """拡張フィールドからZIP64の項目（ID 0x0001）を除く（書き込み時に必要なら付け直される）"""
+    kept = []
+    offset = 0
+    while offset + 4 <= len(extra):
+        field_id, size = struct.unpack('<HH', extra[offset:offset + 4])
+        if field_id != 0x0001:
+            kept.append(extra[offset:offset + 4 + size])
+        offset += 4 + size
+    return b''.join(kept)
+
+
+def write_member(dst, name, writer, date_time=None):
+    """zipにメンバーを追加し、writer(f)で内容を書き込む（writerの戻り値を返す）"""
+    out_info = zipfile.ZipInfo(name, date_time=date_time or time.localtime()[:6])
+    out_info.compress_type = zipfile.ZIP_DEFLATED
+    with dst.open(out_info, 'w', force_zip64=True) as out:
+        return writer(out)
+
+
+def rewrite_zip(file_path, rewrite):
+    """xlsx（zip）を書き直す
+
+    一時ファイルに書き出してから置き換えるので、途中で失敗しても元のファイルは壊れない。
+    置き換える前に、元のファイルの所有者・パーミッション・拡張属性（ACLなど）を一時ファイルに写す。
+    元のファイルがハードリンクされている場合は、リンクが切れないよう書き出した内容を元のファイルに上書きする。
+    大きなシートでは圧縮が書き込み時間の大半を占めるため、圧縮レベルは速度を優先する。
+
+    Args:
+        file_path: xlsxファイルのパス
+        rewrite: 書き込み関数(src, dst)（srcは元のファイル、dstは書き込み先のZipFile）
+    """
+    dir_name = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=dir_name)
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(file_path) as src, \
+                zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as dst:
+            rewrite(src, dst)
+        stat = os.stat(file_path)
+        if stat.st_nlink > 1:
+            with open(tmp_path, 'rb') as f_in, open(file_path, 'r+b') as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+                f_out.truncate()
+            os.remove(tmp_path)
+            return
+        _copy_file_metadata(file_path, tmp_path, stat)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _copy_file_metadata(src_path, dst_path, stat):
+    """src_pathの所有者・パーミッション・拡張属性をdst_pathに写す（更新日時は写さない）"""
+    if hasattr(os, 'chown'):
+        try:
+            os.chown(dst_path, stat.st_uid, stat.st_gid)
+        except OSError:
+            # 所有者を変える権限がない場合（他のユーザーのファイルなど）は、作成したユーザーのままにする
+            pass
+    # パーミッションと拡張属性（ACLを含む）を写し、更新日時は保存した時刻に戻す
+    shutil.copystat(src_path, dst_path)
+    os.utime(dst_path)
+
+
+def save_workbook(workbook, file_path, sheet_writers):
+    """openpyxlのワークブックを保存する（指定したシートは、セルを通さずにXMLを直接書き込む）
+
+    openpyxlの保存処理の中でシートのパーツを書き込むので、zipを書き直す必要がない。
+    openpyxlのWorkbook.saveと同じく既存のファイルをそのまま上書きするので、パーミッションや所有者も変わらない。
+
+    Args:
+        workbook: openpyxlのWorkbook
+        file_path: 保存先のパス
+        sheet_writers: {シート名: 書き込み関数(f)}（対象のシートは空であること）
+    """
+    import datetime
+
+    from openpyxl.packaging.relationship import RelationshipList
+    from openpyxl.writer.excel import ExcelWriter
+
+    writers = {id(workbook[name]): writer for name, writer in sheet_writers.items()}
+
+    class _Writer(ExcelWriter):
+        def write_worksheet(self, ws):
+            writer = writers.get(id(ws))
+            if writer is None:
+                return super().write_worksheet(ws)
+            # 空のシートなので、図・コメント・テーブルなどの関連パーツはない
+            ws._drawing = None
+            ws._rels = RelationshipList()
+            write_member(self._archive, ws.path[1:], writer)
+            self.manifest.append(ws)
+
+    # openpyxl.writer.excel.save_workbookと同じ手順で保存する
+    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        workbook.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+        _Writer(workbook, archive).save()